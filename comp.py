@@ -3,6 +3,7 @@ import math
 import matplotlib.gridspec as gridspec
 import matplotlib.pyplot as plt
 import matplotlib.ticker as tkr
+import multiprocessing
 import os
 import pandas as pd
 import urbs
@@ -37,6 +38,46 @@ def glob_result_files(folder_name):
     result_files = sorted(glob.glob(glob_pattern))
     return result_files
 
+def glob_result_archives(folder_name):
+    """ Glob result archives (cf. urbs.save) from specified folder.
+
+    Args:
+        folder_name: an absolute or relative path to a directory
+
+    Returns:
+        list of archive names that match the pattern 'scenario_*.urbs'
+    """
+    glob_pattern = os.path.join(folder_name, 'scenario_*.urbs')
+    result_archives = sorted(glob.glob(glob_pattern))
+    return result_archives
+
+def get_scenario_names(result_files):
+    """ Derive scenario names from result filenames, base scenario first.
+
+    Args:
+        result_files: a list of result spreadsheet or archive names; it is
+                      reordered in place to match the returned names
+
+    Returns:
+        list of scenario names for column labels/figure captions
+    """
+    scenario_names = [os.path.splitext(
+                          os.path.basename(rf))[0] # drop folder, extension
+                      .replace('_', ' ') # replace _ with spaces
+                      .replace('scenario ', '') # drop 'scenario ' prefix
+                      for rf in result_files]
+    scenario_names = [s[0:s.find('-')] if '-' in s else s
+                      for s in scenario_names] # drop everything after first '-'
+
+    # find base scenario and put at first position
+    try:
+        base_scenario = scenario_names.index('base')
+        result_files.insert(0, result_files.pop(base_scenario))
+        scenario_names.insert(0, scenario_names.pop(base_scenario))
+    except ValueError:
+        pass # do nothing if no base scenario is found
+    return scenario_names
+
 def compare_scenarios(result_files, output_filename):
     """ Create report sheet and plots for given report spreadsheets.
     
@@ -48,28 +89,12 @@ def compare_scenarios(result_files, output_filename):
      Returns:
         Nothing
     
-    To do: 
-        Don't use report spreadsheets, instead load pickled problem 
-        instances. This would make this function less fragile and dependent
-        on the output format of urbs.report().
+    Depends on the output format of urbs.report(); compare_archives reads
+    the same numbers from result archives instead.
     """
         
     # derive list of scenario names for column labels/figure captions
-    scenario_names = [os.path.basename(rf) # drop folder names, keep filename
-                      .replace('_', ' ') # replace _ with spaces
-                      .replace('.xlsx', '') # drop file extension
-                      .replace('scenario ', '') # drop 'scenario ' prefix
-                      for rf in result_files]
-    scenario_names = [s[0:s.find('-')] for s in scenario_names] # drop everything after first '-'
-    
-    
-    # find base scenario and put at first position
-    try:
-        base_scenario = scenario_names.index('base')
-        result_files.insert(0, result_files.pop(base_scenario))
-        scenario_names.insert(0, scenario_names.pop(base_scenario))
-    except ValueError:
-        pass # do nothing if no base scenario is found
+    scenario_names = get_scenario_names(result_files)
     
     costs = []  # total costs by type and scenario
     esums = []  # sum of energy produced by scenario
@@ -114,6 +139,122 @@ def compare_scenarios(result_files, output_filename):
     esums = esums[used_commodities].sort().transpose()
     esums = esums / 1e3
     
+    plot_comparison(costs, esums, output_filename)
+
+def summarize_archive(result_archive):
+    """ Read costs, capacities and energy sums from a result archive.
+
+    Runs in a worker process of compare_archives, so only returns the small
+    summary, not the whole result archive.
+
+    Args:
+        result_archive: a result archive name written by urbs.save
+
+    Returns:
+        (costs, cap_pro, cap_tra, cap_sto, energy) tuple of Series: costs by
+        type, total capacities by process, transmission and storage (power
+        and capacity), and energy sums of the demand commodities by
+        commodity, site, category (e.g. 'Created') and name (e.g. process),
+        cf. urbs.get_balance
+    """
+    prob = urbs.load(result_archive)
+    costs, cpro, ctra, csto = urbs.get_constants(prob)
+    energy = urbs.get_balance(prob)
+
+    # like report's energy sums: only demand commodities in the modelled
+    # sites, without the storage level (a state, not an energy flow)
+    coms = energy.index.get_level_values('com')
+    sites = energy.index.get_level_values('sit')
+    categories = energy.index.get_level_values('category')
+    names = energy.index.get_level_values('name')
+    energy = energy[coms.isin(list(prob.com_demand)) &
+                    sites.isin(list(prob.sit)) &
+                    ~((categories == 'Storage') & (names == 'Level'))]
+    energy = energy.groupby(level=['com', 'sit', 'category', 'name']).sum()
+
+    cap_sto = csto[['P Total', 'C Total']].stack() if not csto.empty else csto
+    return (costs['costs'],
+            cpro['Total'] if not cpro.empty else cpro,
+            ctra['Total'] if not ctra.empty else ctra,
+            cap_sto,
+            energy)
+
+def compare_archives(result_archives, output_filename, processes=None):
+    """ Create report sheet and plots for given result archives.
+
+    Like compare_scenarios, but reads costs, capacities and energy sums
+    directly from the result archives, loading them in parallel. Besides
+    costs and created energy, the report lists energy sums by site and
+    commodity and total capacities; with a base scenario, also their
+    differences to it.
+
+    Args:
+        result_archives: a list of result archive names written by urbs.save
+        output_filename: a spreadsheet filename that the comparison is to be
+                         written to
+        processes: (optional) number of worker processes; default: number
+                   of CPUs
+
+    Returns:
+        Nothing
+    """
+    scenario_names = get_scenario_names(result_archives)
+
+    # READ
+
+    pool = multiprocessing.Pool(processes)
+    summaries = pool.map(summarize_archive, result_archives)
+    pool.close()
+    pool.join()
+
+    # merge everything into one DataFrame each
+    costs, cap_pro, cap_tra, cap_sto, energy = [
+        pd.concat(frames, axis=1, keys=scenario_names).fillna(0)
+        for frames in zip(*summaries)]
+
+    # ANALYSE
+
+    # convert EUR/a to 1e9 EUR/a
+    costs.index.name = 'Cost type'
+    costs = costs.sort_index().transpose()
+    costs = costs / 1e9
+
+    # created energy of the demand commodities summed over all sites by
+    # process, like in compare_scenarios; convert MWh to GWh
+    esums = energy.xs('Created', level='category').groupby(level='name').sum()
+    esums.index.name = 'Commodity'
+    used_commodities = (esums.sum(axis=1) > 0)
+    esums = esums[used_commodities].sort_index().transpose()
+    esums = esums / 1e3
+
+    # energy sums by commodity and site and capacities; differences to the
+    # base scenario if there is one
+    details = [('Site energy sums', 'Site energy deltas', energy),
+               ('Process caps', 'Process cap deltas', cap_pro),
+               ('Transmission caps', 'Transmission cap deltas', cap_tra),
+               ('Storage caps', 'Storage cap deltas', cap_sto)]
+    sheets = [(name, frame) for name, delta_name, frame in details]
+    if scenario_names[0] == 'base':
+        sheets += [(delta_name, frame.sub(frame['base'], axis=0))
+                   for name, delta_name, frame in details]
+
+    plot_comparison(costs, esums, output_filename, sheets)
+
+def plot_comparison(costs, esums, output_filename, sheets=()):
+    """ Plot and write comparison of costs and energy sums to files.
+
+    Args:
+        costs: DataFrame of costs (1e9 EUR/a), scenarios x cost types
+        esums: DataFrame of created energy (GWh), scenarios x processes
+        output_filename: filename without extension for the plot (png, pdf)
+                         and the spreadsheet (xlsx)
+        sheets: (optional) list of (sheet name, DataFrame) tuples to be
+                additionally written to the spreadsheet
+
+    Returns:
+        Nothing
+    """
+    
     # PLOT
     
     fig = plt.figure(figsize=(20, 8))
@@ -164,6 +305,8 @@ def compare_scenarios(result_files, output_filename):
     with pd.ExcelWriter('{}.{}'.format(output_filename, 'xlsx')) as writer:
         costs.to_excel(writer, 'Costs')
         esums.to_excel(writer, 'Energy sums')
+        for sheet_name, frame in sheets:
+            frame.to_excel(writer, sheet_name)
         
 if __name__ == '__main__':
     
@@ -174,9 +317,13 @@ if __name__ == '__main__':
         directories = [get_most_recent_entry('result')]
     
     for directory in directories:
-        result_files = glob_result_files(directory)
-        
         # specify comparison result filename 
-        # and run the comparison function
+        # and run the comparison function; prefer result archives over
+        # report spreadsheets
         comp_filename = os.path.join(directory, 'comparison')
-        compare_scenarios(result_files, comp_filename)
+        result_archives = glob_result_archives(directory)
+        if result_archives:
+            compare_archives(result_archives, comp_filename)
+        else:
+            result_files = glob_result_files(directory)
+            compare_scenarios(result_files, comp_filename)
@@ -92,7 +92,7 @@ def run_scenario(input_file, timesteps, scenario, result_dir):
     # store optimisation problem for later re-analysis
     urbs.save(
         prob,
-        os.path.join(result_dir, '{}-{}.pgz').format(sce, now))
+        os.path.join(result_dir, '{}-{}.urbs').format(sce, now))
 
     # add or change plot colors
     my_colors = {
@@ -1,6 +1,10 @@
+import contextlib
 import coopr.environ
+import multiprocessing
 import os
 import shutil
+import sys
+import traceback
 import urbs
 from coopr.opt.base import SolverFactory
 from datetime import datetime
@@ -56,17 +60,20 @@ def prepare_result_directory(result_name):
     return result_dir
 
 
-def setup_solver(optim, logfile='solver.log'):
+def setup_solver(optim, logfile='solver.log', threads=None):
     """ """
-    if optim.name == 'gurobi':
+    if optim.name in ('gurobi', 'gurobi_direct'):
         # reference with list of option names
         # http://www.gurobi.com/documentation/5.6/reference-manual/parameters
         optim.set_options("logfile={}".format(logfile)) 
+        if threads:
+            optim.set_options("threads={}".format(threads))
         # optim.set_options("timelimit=7200")  # seconds
         # optim.set_options("mipgap=5e-4")  # default = 1e-4
     elif optim.name == 'glpk':
         # reference with list of options
         # execute 'glpsol --help'
+        # glpk is single-threaded, so option threads needs no handling
         optim.set_options("log={}".format(logfile))
         # optim.set_options("tmlim=7200")  # seconds
         # optim.set_options("mipgap=.0005")
@@ -75,7 +82,9 @@ def setup_solver(optim, logfile='solver.log'):
               "'{}'!".format(optim.name))
     return optim
 
-def run_scenario(input_file, timesteps, scenario, result_dir, plot_periods={}):
+def run_scenario(input_file, timesteps, scenario, result_dir, plot_periods={},
+                 solver='glpk', solver_io=None, prob=None, threads=None,
+                 tee=True):
     """ run an urbs model for given input, time steps and scenario
 
     Args:
@@ -83,6 +92,17 @@ def run_scenario(input_file, timesteps, scenario, result_dir, plot_periods={}):
         timesteps: a list of timesteps, e.g. range(0,8761)
         scenario: a scenario function that modifies the input data dict
         result_dir: directory name for result spreadsheet and plots
+        plot_periods: (optional) dict of 'period name': timesteps_list items
+        solver: (optional) solver name, e.g. 'glpk' (default), 'gurobi'
+        solver_io: (optional) solver interface; 'python' hands the problem
+                   to an in-process solver interface (gurobi, cplex) instead
+                   of writing and parsing an LP file; default: LP file
+        prob: (optional) a urbs model instance of a previous scenario; it is
+              re-used if the scenario has the same timesteps and only changes
+              mutable parameters (cf. urbs.update_model)
+        threads: (optional) maximum number of solver threads
+        tee: (optional) if True (default), show solver output on the console;
+             it is written to the file '<scenario>.log' in result_dir anyway
 
     Returns:
         the urbs model instance
@@ -90,22 +110,39 @@ def run_scenario(input_file, timesteps, scenario, result_dir, plot_periods={}):
 
     # scenario name, read and modify data for scenario
     sce = scenario.__name__
-    data = urbs.read_excel(input_file)
-    data = scenario(data)
+    with urbs.read_excel(input_file, cache_dir='cache') as data:
+        data = scenario(data)
 
-    # create model
-    model = urbs.create_model(data, timesteps)
-    prob = model.create()
+    # check input before spending time on model creation and solving
+    problems = urbs.check_input(data, timesteps)
+    for severity, check, problem in problems.itertuples(index=False):
+        print("{}: {} ({})".format(severity.title(), problem, check))
+    if (problems['Severity'] == 'error').any():
+        raise ValueError("Scenario '{}' has input errors.".format(sce))
+
+    # re-use model instance of previous scenario if possible,
+    # otherwise create model
+    if prob is not None:
+        try:
+            prob = urbs.update_model(prob, data, timesteps)
+        except ValueError:
+            prob = None
+    if prob is None:
+        model = urbs.create_model(data, timesteps)
+        prob = model.create()
 
     # refresh time stamp string and create filename for logfile
     now = prob.created
     log_filename = os.path.join(result_dir, '{}.log').format(sce)
 
     # solve model and read results
-    optim = SolverFactory('glpk')  # cplex, glpk, gurobi, ...
-    optim = setup_solver(optim, logfile=log_filename)
-    result = optim.solve(prob, tee=True)
-    prob.load(result)
+    if solver_io:
+        optim = SolverFactory(solver, solver_io=solver_io)
+    else:
+        optim = SolverFactory(solver)  # cplex, glpk, gurobi, ...
+    optim = setup_solver(optim, logfile=log_filename, threads=threads)
+    result = optim.solve(prob, tee=tee)
+    prob = urbs.load_result(prob, result)
 
     # copy input file in result directory
     cdir = os.getcwd()
@@ -121,7 +158,7 @@ def run_scenario(input_file, timesteps, scenario, result_dir, plot_periods={}):
     # store optimisation problem for later re-analysis
     urbs.save(
         prob,
-        os.path.join(result_dir, '{}.pgz').format(sce))
+        os.path.join(result_dir, '{}.urbs').format(sce))
 
     urbs.result_figures(
         prob, 
@@ -130,6 +167,100 @@ def run_scenario(input_file, timesteps, scenario, result_dir, plot_periods={}):
         periods=plot_periods)
     return prob
 
+
+def run_scenarios_parallel(input_file, timesteps, scenarios, result_dir,
+                           plot_periods={}, processes=None, solver='glpk',
+                           solver_io=None, threads=1, colors=None):
+    """ run scenarios in a pool of worker processes
+
+    Each scenario is run by run_scenario in its own worker process. Its
+    console output is written to the file '<scenario>.out' in result_dir,
+    the solver output only to the solver log file '<scenario>.log'. A
+    failing scenario does not stop the others; its traceback is returned and,
+    if the '.out' file could be opened, appended to it.
+
+    Settings are passed to the workers explicitly, as workers do not see
+    changes of module variables made in the main process if they are
+    started by spawning a new interpreter (e.g. on Windows).
+
+    Args:
+        input_file: filename to an Excel spreadsheet for urbs.read_excel
+        timesteps: a list of timesteps, e.g. range(0,8761)
+        scenarios: a list of scenario functions
+        result_dir: directory name for result spreadsheet and plots
+        plot_periods: (optional) dict of 'period name': timesteps_list items
+        processes: (optional) number of worker processes; default: number of
+                   CPUs divided by threads, at most one per scenario
+        solver: (optional) solver name, e.g. 'glpk' (default), 'gurobi'
+        solver_io: (optional) solver interface, cf. run_scenario
+        threads: (optional) maximum number of solver threads per worker,
+                 default: 1
+        colors: (optional) dict of plot colors for urbs.COLORS in the
+                workers; default: urbs.COLORS of the calling process
+
+    Returns:
+        a dict of scenario name: None if successful, traceback string if not
+    """
+    if processes is None:
+        processes = max(1, min(len(scenarios),
+                               multiprocessing.cpu_count() // threads))
+    if colors is None:
+        colors = dict(urbs.COLORS)
+
+    pool = multiprocessing.Pool(processes)
+    jobs = [(scenario.__name__,
+             pool.apply_async(_run_scenario_worker,
+                              (input_file, timesteps, scenario, result_dir,
+                               plot_periods, solver, solver_io, threads,
+                               colors)))
+            for scenario in scenarios]
+    pool.close()
+
+    errors = {}
+    for sce, job in jobs:
+        errors[sce] = job.get()
+        if errors[sce]:
+            print("Scenario '{}' failed, see {}.out".format(sce, sce))
+    pool.join()
+    return errors
+
+
+@contextlib.contextmanager
+def _redirect_output(out):
+    """ redirect sys.stdout and sys.stderr to file out, then restore them """
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = out
+    try:
+        yield out
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+
+
+def _run_scenario_worker(input_file, timesteps, scenario, result_dir,
+                         plot_periods, solver, solver_io, threads, colors):
+    """ run_scenario wrapper for run_scenarios_parallel; catches errors """
+    sce = scenario.__name__
+    try:
+        urbs.COLORS.update(colors)
+        # only redirects output of Python code; the solver writes to its
+        # own log file instead of the console (tee=False)
+        filename = os.path.join(result_dir, '{}.out'.format(sce))
+        with open(filename, 'w') as out, _redirect_output(out):
+            try:
+                # the model instance is not returned, as sending it back to
+                # the main process would take longer than reading the result
+                # files
+                run_scenario(input_file, timesteps, scenario, result_dir,
+                             plot_periods=plot_periods, solver=solver,
+                             solver_io=solver_io, threads=threads, tee=False)
+            except Exception:
+                # to the scenario's output file, then to the caller
+                traceback.print_exc()
+                raise
+        return None
+    except Exception:
+        return traceback.format_exc()
+
 if __name__ == '__main__':
     input_file = 'mimo-example.xlsx'
     result_name = os.path.splitext(input_file)[0]  # cut away file extension
@@ -163,6 +294,17 @@ if __name__ == '__main__':
         scenario_north_process_caps,
         scenario_all_together]
 
-    for scenario in scenarios:
-        prob = run_scenario(input_file, timesteps, scenario, 
-                            result_dir, plot_periods=periods)
+    # number of worker processes; with 1 (default), scenarios run one after
+    # another, re-using the model instance where possible. With more (None:
+    # one per scenario, at most one per CPU), they run in parallel, each
+    # building its own model.
+    processes = 1
+
+    if processes == 1:
+        prob = None
+        for scenario in scenarios:
+            prob = run_scenario(input_file, timesteps, scenario,
+                                result_dir, plot_periods=periods, prob=prob)
+    else:
+        run_scenarios_parallel(input_file, timesteps, scenarios, result_dir,
+                               plot_periods=periods, processes=processes)
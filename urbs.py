@@ -9,14 +9,20 @@ transporting commodities between sites and storage for saving/retrieving
 commodities.
 
 """
+import abc
 import coopr.pyomo as pyomo
 import math
 import matplotlib.pyplot as plt
+import numpy as np
+import os
 import pandas as pd
 from datetime import datetime
 from operator import itemgetter
 from random import random
-from xlrd import XLRDError
+try:
+    from collections.abc import Mapping, MutableMapping
+except ImportError:  # Python 2
+    from collections import Mapping, MutableMapping
 
 COLORS = {
     'Biomass plant': (0, 122, 55),
@@ -34,8 +40,78 @@ COLORS = {
     'Storage': (60, 36, 154),  # storage area
     'Stock': (222, 222, 222)}  # stock commodity power
 
-
-def read_excel(filename):
+# input attributes that become mutable parameters of the model; these are the
+# values update_model may change on an existing model instance. Commodity
+# prices are only mutable for stock commodities, as buy/sell prices may refer
+# to timeseries.
+MUTABLE_ATTRIBUTES = {
+    'commodity': ['price'],
+    'process': ['inv-cost', 'fix-cost', 'var-cost', 'cap-lo', 'cap-up'],
+    'transmission': ['inv-cost', 'fix-cost', 'var-cost', 'cap-lo', 'cap-up'],
+    'storage': ['inv-cost-p', 'inv-cost-c', 'fix-cost-p', 'fix-cost-c',
+                'var-cost-p', 'var-cost-c', 'cap-lo-p', 'cap-up-p',
+                'cap-lo-c', 'cap-up-c']}
+
+# input sheets: key in input dict, sheet name, index columns. All but
+# 'Hacks' are required.
+INPUT_SHEETS = [
+    ('commodity', 'Commodity', ['Site', 'Commodity', 'Type']),
+    ('process', 'Process', ['Site', 'Process']),
+    ('process_commodity', 'Process-Commodity',
+     ['Process', 'Commodity', 'Direction']),
+    ('transmission', 'Transmission',
+     ['Site In', 'Site Out', 'Transmission', 'Commodity']),
+    ('storage', 'Storage', ['Site', 'Storage', 'Commodity']),
+    ('demand', 'Demand', ['t']),
+    ('supim', 'SupIm', ['t']),
+    ('buy_sell_price', 'Buy-Sell-Price', ['t']),
+    ('hacks', 'Hacks', ['Name'])]
+
+# version of the input cache format of read_excel; part of the cache file
+# name, so increase it whenever reading or preparing the input changes (e.g.
+# INPUT_SHEETS, _parse_sheet, _prepare_sheet, annuity_factor) to not read
+# outdated cache files
+INPUT_CACHE_VERSION = 1
+
+# timeseries input: key in input dict, sheet name (also used as filename
+# by read_input and write_timeseries)
+TIMESERIES_SHEETS = [
+    ('demand', 'Demand'),
+    ('supim', 'SupIm'),
+    ('buy_sell_price', 'Buy-Sell-Price')]
+
+# capacity variables that are fixed for a dispatch-only run (rolling_horizon)
+# and that link the time blocks of a benders decomposition
+CAPACITY_VARIABLES = ['cap_pro', 'cap_tra', 'cap_sto_c', 'cap_sto_p']
+
+# annual limits, i.e. constraints on a sum over all modelled timesteps that
+# create_model scales to a year by m.weight: constraint name: (commodity type
+# whose commodity.max is the limit, index set, limited variable). The global
+# CO2 limit is taken from 'hacks'; environmental commodities are limited by
+# their commodity balance. rolling_horizon and benders split them among time
+# windows or blocks, cf. annual_limits and annual_usage.
+ANNUAL_LIMITS = {
+    'res_stock_total': ('Stock', 'stock_tuples', 'e_co_stock'),
+    'res_sell_total': ('Sell', 'sell_tuples', 'e_co_sell'),
+    'res_buy_total': ('Buy', 'buy_tuples', 'e_co_buy'),
+    'res_env_total': ('Env', 'env_tuples', None),
+    'res_global_co2_limit': (None, None, None)}
+
+# constraints on a single variable that create_model implements as variable
+# bounds: constraint name: (variable name, index set of the constraint,
+# whether the lower variable bound is part of the constraint). get_entity and
+# get_dual report them like constraints.
+BOUND_CONSTRAINTS = {
+    'res_stock_step': ('e_co_stock', 'stock_tuples', False),
+    'res_sell_step': ('e_co_sell', 'sell_tuples', False),
+    'res_buy_step': ('e_co_buy', 'buy_tuples', False),
+    'res_process_capacity': ('cap_pro', 'pro_tuples', True),
+    'res_transmission_capacity': ('cap_tra', 'tra_tuples', True),
+    'res_storage_power': ('cap_sto_p', 'sto_tuples', True),
+    'res_storage_capacity': ('cap_sto_c', 'sto_tuples', True)}
+
+
+def read_excel(filename, cache_dir=None):
     """Read Excel input file and prepare URBS input dict.
 
     Reads an Excel spreadsheet that adheres to the structure shown in
@@ -45,94 +121,566 @@ def read_excel(filename):
     2. The attribute 'annuity-factor' is derived here from the columns 'wacc'
     and 'depreciation' for 'Process', 'Transmission' and 'Storage'.
 
+    Sheets are only parsed when they are first accessed, cf. InputData. So
+    a script that only needs, e.g., the 'Process' sheet does not pay for
+    parsing the timeseries.
+
+    If cache_dir is given, all sheets are parsed and the prepared DataFrames
+    are stored there in a binary file named after a hash of the spreadsheet's
+    content, INPUT_CACHE_VERSION and the pandas version. Subsequent calls for
+    an unchanged spreadsheet read that file instead of parsing the
+    spreadsheet again; a changed spreadsheet gets a new cache file.
+
     Args:
         filename: filename to an Excel spreadsheet with the required sheets
             'Commodity', 'Process', 'Transmission', 'Storage', 'Demand' and
             'SupIm'.
+        cache_dir: optional directory for cached input, default: no cache
 
     Returns:
-        a dict of 6 DataFrames
+        an InputData object of 6 or 7 DataFrames; with cache_dir, all of
+        them are parsed and the spreadsheet is closed
 
     Example:
         >>> data = read_excel('mimo-example.xlsx')
         >>> data['hacks'].loc['Global CO2 limit', 'Value']
         150000000
     """
+    if cache_dir is None:
+        return InputData(filename)
+
+    cache_file = _cache_filename(filename, cache_dir)
+    cached = _load_cache(cache_file)
+    if cached is not None:
+        return InputData(filename, cached)
+    with InputData(filename) as data:
+        _save_cache(dict(data), cache_file)
+    return data
+
+
+class InputData(MutableMapping):
+    """Input dict that parses each sheet of a spreadsheet on first access.
+
+    Behaves like the dict of DataFrames read_excel used to return: keys are
+    known without parsing, a parsed DataFrame is kept, so that in-place
+    modifications (e.g. by scenario functions) persist, and keys can be
+    assigned or deleted. Pickling (e.g. for worker processes) parses all
+    sheets first.
+
+    The spreadsheet is kept open until all sheets are parsed or close is
+    called, e.g. by using InputData as a context manager. After close, a
+    sheet not parsed yet is parsed by opening the spreadsheet once more.
+
+    Args:
+        filename: filename to an Excel spreadsheet (cf. read_excel)
+        data: optional dict of already prepared DataFrames, e.g. from the
+            input cache; if given, the spreadsheet is not opened
+
+    Example:
+        >>> with read_excel('mimo-example.xlsx') as data:
+        ...     process = data['process']
+    """
+    def __init__(self, filename, data=None):
+        self.filename = filename
+        if data is not None:
+            self._xls = None
+            self._unparsed = set()
+            self._data = dict(data)
+            return
+        self._xls = pd.ExcelFile(filename)
+        self._unparsed = set(key for key, sheet, index_col in INPUT_SHEETS
+                             if sheet in self._xls.sheet_names)
+        self._data = {}
+
+    def __getitem__(self, key):
+        if key in self._unparsed:
+            if self._xls is None:
+                with pd.ExcelFile(self.filename) as xls:
+                    self._data[key] = _parse_sheet(xls, key)
+            else:
+                self._data[key] = _parse_sheet(self._xls, key)
+            self._unparsed.remove(key)
+            if not self._unparsed:
+                self.close()
+        return self._data[key]
+
+    def close(self):
+        """Close the spreadsheet file."""
+        if self._xls is not None:
+            self._xls.close()
+            self._xls = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __setitem__(self, key, value):
+        self._unparsed.discard(key)
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        if key in self._unparsed:
+            self._unparsed.remove(key)
+        else:
+            del self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data or key in self._unparsed
+
+    def __iter__(self):
+        return iter(list(self._data) + sorted(self._unparsed))
+
+    def __len__(self):
+        return len(self._data) + len(self._unparsed)
+
+    def __getstate__(self):
+        for key in list(self._unparsed):
+            self[key]
+        state = self.__dict__.copy()
+        state['_xls'] = None
+        return state
+
+
+def read_input(filename, timeseries_dir, timesteps=None):
+    """Read static input from spreadsheet and timeseries from files.
+
+    Alternative to read_excel for long timeseries: the spreadsheet only needs
+    the sheets 'Commodity', 'Process', 'Process-Commodity', 'Transmission',
+    'Storage' and optionally 'Hacks'. The timeseries are read from the files
+    'Demand', 'SupIm' and 'Buy-Sell-Price' in timeseries_dir, with extension
+    '.h5' (HDF5, as written by write_timeseries) or '.csv'. Only the rows of
+    the given timesteps are loaded.
+
+    Args:
+        filename: filename to an Excel spreadsheet
+        timeseries_dir: directory of the timeseries files
+        timesteps: optional list of timesteps to read, default: all
+
+    Returns:
+        a dict of DataFrames like returned by read_excel
+
+    Example:
+        >>> import shutil, tempfile
+        >>> timeseries_dir = tempfile.mkdtemp()
+        >>> write_timeseries(read_excel('mimo-example.xlsx'), timeseries_dir)
+        >>> data = read_input('mimo-example.xlsx', timeseries_dir,
+        ...                   range(5000, 5241))
+        >>> len(data['demand'])
+        241
+        >>> shutil.rmtree(timeseries_dir)
+    """
+    timeseries_keys = [key for key, sheet in TIMESERIES_SHEETS]
     with pd.ExcelFile(filename) as xls:
-        commodity = xls.parse(
-            'Commodity',
-            index_col=['Site', 'Commodity', 'Type'])
-        process = xls.parse(
-            'Process',
-            index_col=['Site', 'Process'])
-        process_commodity = xls.parse(
-            'Process-Commodity',
-            index_col=['Process', 'Commodity', 'Direction'])
-        transmission = xls.parse(
-            'Transmission',
-            index_col=['Site In', 'Site Out', 'Transmission', 'Commodity'])
-        storage = xls.parse(
-            'Storage',
-            index_col=['Site', 'Storage', 'Commodity'])
-        demand = xls.parse(
-            'Demand',
-            index_col=['t'])
-        supim = xls.parse(
-            'SupIm',
-            index_col=['t'])
-        buy_sell_price = xls.parse(
-            'Buy-Sell-Price',
-            index_col=['t'])
-        try:
-            hacks = xls.parse(
-                'Hacks',
-                index_col=['Name'])
-        except XLRDError:
-            hacks = None
+        data = dict((key, _parse_sheet(xls, key))
+                    for key, sheet, index_col in INPUT_SHEETS
+                    if key not in timeseries_keys
+                    and sheet in xls.sheet_names)
+    for key, sheet in TIMESERIES_SHEETS:
+        data[key] = _prepare_sheet(key, read_timeseries(
+            os.path.join(timeseries_dir, sheet), timesteps))
+    return data
+
 
-    # prepare input data
+def read_timeseries(basename, timesteps=None, chunksize=8760):
+    """Read rows of given timesteps from a timeseries file.
+
+    HDF5 files ('.h5') are queried for the range of timesteps, so that only
+    that range is read from disk. CSV files ('.csv') are read in chunks, of
+    which only the requested rows are kept.
+
+    Args:
+        basename: filename without extension; '.h5' is preferred over '.csv'
+        timesteps: optional list of timesteps, default: all
+        chunksize: rows per chunk when reading CSV files
+
+    Returns:
+        a DataFrame with index 't' and the column titles of the file; empty
+        if the file has none of the timesteps
+    """
+    if os.path.exists(basename + '.h5'):
+        if timesteps is None:
+            timeseries = pd.read_hdf(basename + '.h5', 'timeseries')
+        else:
+            timeseries = pd.read_hdf(
+                basename + '.h5', 'timeseries',
+                where='index >= {} & index <= {}'.format(
+                    min(timesteps), max(timesteps)))
+    else:
+        reader = pd.read_csv(basename + '.csv', index_col=0,
+                             chunksize=chunksize)
+        if timesteps is None:
+            timeseries = pd.concat(reader)
+        else:
+            # rows are sorted by timestep; the first chunk is always kept,
+            # so that the result has the file's columns even if empty
+            last = max(timesteps)
+            chunks = []
+            for chunk in reader:
+                chunks.append(chunk[chunk.index.isin(timesteps)])
+                if chunk.index[-1] >= last:
+                    break
+            timeseries = pd.concat(chunks)
+
+    if timesteps is not None:
+        timeseries = timeseries[timeseries.index.isin(timesteps)]
+    timeseries.index.name = 't'
+    return timeseries
+
+
+def write_timeseries(data, timeseries_dir, fmt='hdf'):
+    """Write timeseries of input dict to files for read_input.
+
+    Args:
+        data: input dict as returned by read_excel
+        timeseries_dir: directory for the files 'Demand', 'SupIm' and
+            'Buy-Sell-Price'; is created if necessary
+        fmt: file format, 'hdf' (default, needs PyTables) or 'csv'
+
+    Returns:
+        Nothing
+    """
+    if not os.path.exists(timeseries_dir):
+        os.makedirs(timeseries_dir)
+    for key, sheet in TIMESERIES_SHEETS:
+        timeseries = data[key].copy()
+        # join split column titles again, e.g. ('DE', 'Elec') to 'DE.Elec'
+        timeseries.columns = [
+            '.'.join(col) if isinstance(col, tuple) else col
+            for col in timeseries.columns]
+        basename = os.path.join(timeseries_dir, sheet)
+        if fmt == 'hdf':
+            timeseries.to_hdf(basename + '.h5', 'timeseries',
+                              mode='w', format='table')
+        elif fmt == 'csv':
+            timeseries.to_csv(basename + '.csv')
+        else:
+            raise ValueError("Unknown timeseries format '{}'".format(fmt))
+
+
+def _parse_sheet(xls, key):
+    """Parse and prepare the sheet of an input key from an open ExcelFile."""
+    for name, sheet, index_col in INPUT_SHEETS:
+        if name == key:
+            return _prepare_sheet(key, xls.parse(sheet, index_col=index_col))
+    raise KeyError(key)
+
+
+def _prepare_sheet(key, df):
+    """Split timeseries column titles, derive annuity factors, sort index."""
     # split columns by dots '.', so that 'DE.Elec' becomes the two-level
     # column index ('DE', 'Elec')
-    demand.columns = split_columns(demand.columns, '.')
-    supim.columns = split_columns(supim.columns, '.')
-    buy_sell_price.columns = split_columns(buy_sell_price.columns, '.')
+    if key in [name for name, sheet in TIMESERIES_SHEETS]:
+        df.columns = split_columns(df.columns, '.')
 
     # derive annuity factor from WACC and depreciation periods
-    process['annuity-factor'] = annuity_factor(
-        process['depreciation'], process['wacc'])
-    transmission['annuity-factor'] = annuity_factor(
-        transmission['depreciation'], transmission['wacc'])
-    storage['annuity-factor'] = annuity_factor(
-        storage['depreciation'], storage['wacc'])
-
-    data = {
-        'commodity': commodity,
-        'process': process,
-        'process_commodity': process_commodity,
-        'transmission': transmission,
-        'storage': storage,
-        'demand': demand,
-        'supim': supim,
-        'buy_sell_price': buy_sell_price}
-    if hacks is not None:
-        data['hacks'] = hacks
+    if key in ['process', 'transmission', 'storage']:
+        df['annuity-factor'] = annuity_factor(df['depreciation'], df['wacc'])
 
     # sort nested indexes to make direct assignments work, cf
     # http://pandas.pydata.org/pandas-docs/stable/indexing.html#the-need-for-sortedness-with-multiindex
-    for key in data:
-        if isinstance(data[key].index, pd.core.index.MultiIndex):
-            data[key].sortlevel(inplace=True)
-    return data
+    if isinstance(df.index, pd.core.index.MultiIndex):
+        df.sortlevel(inplace=True)
+    return df
+
+
+def _cache_filename(filename, cache_dir):
+    """Return name of cache file for a spreadsheet, unique for its content,
+    the cache format version and the pandas version."""
+    import hashlib
+    with open(filename, 'rb') as file_handle:
+        digest = hashlib.sha1(file_handle.read()).hexdigest()
+    basename = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(cache_dir, '{}-{}-v{}-pandas{}.pkl'.format(
+        basename, digest, INPUT_CACHE_VERSION, pd.__version__))
+
+
+def _load_cache(cache_file):
+    """Return input dict from cache file, or None if there is none.
+
+    A cache file that cannot be unpickled, e.g. truncated or written by an
+    incompatible Python or pandas version, is ignored, i.e. the spreadsheet
+    is parsed again. Other errors, e.g. missing permissions, are raised.
+    """
+    try:
+        import cPickle as pickle
+    except ImportError:
+        import pickle
+    if not os.path.exists(cache_file):
+        return None
+    with open(cache_file, 'rb') as file_handle:
+        try:
+            return pickle.load(file_handle)
+        except (pickle.UnpicklingError, EOFError, ValueError, ImportError,
+                AttributeError):
+            return None
+
+
+def _save_cache(data, cache_file):
+    """Write input dict to cache file.
+
+    Pickle stores the DataFrames' column blocks as binary arrays, so that
+    loading is much faster than parsing the spreadsheet. A columnar format
+    like HDF5 or Parquet is not used: both need an optional dependency, and
+    neither stores the input as is, e.g. the object column commodity.price
+    (floats and timeseries names, cf. get_com_price), which HDF5 pickles
+    anyway and Parquet rejects. The file is written
+    under a temporary name first, so that parallel scenario runs never read
+    a partially written cache file.
+    """
+    import tempfile
+    try:
+        import cPickle as pickle
+    except ImportError:
+        import pickle
+    cache_dir = os.path.dirname(cache_file)
+    if cache_dir and not os.path.exists(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # created by another process in the meantime
+            pass
+    file_handle, temp_file = tempfile.mkstemp(dir=cache_dir or None)
+    with os.fdopen(file_handle, 'wb') as file_handle:
+        pickle.dump(data, file_handle, pickle.HIGHEST_PROTOCOL)
+    try:
+        os.rename(temp_file, cache_file)
+    except OSError:
+        # on Windows, if another process was faster; its file is identical
+        os.remove(temp_file)
+
+
+def check_input(data, timesteps=None):
+    """Check input for errors that make a model infeasible or unbounded.
+
+    Meant to be called before create_model, as it takes only a fraction of a
+    second, while a solver may need minutes to detect an infeasible model.
+    Checks for:
+
+    * dangling references: process, transmission and storage commodities
+      not defined at their site, Process-Commodity entries of undefined
+      processes, missing SupIm or Buy-Sell-Price timeseries
+    * inconsistent capacity bounds: cap-lo or inst-cap > cap-up
+    * unbounded directions: negative costs of unlimited capacities
+    * capacity shortfalls: demand exceeding the upper bound of supply (cf.
+      get_capacity_shortfall) in some timestep
 
+    Args:
+        data: input dict as returned by read_excel
+        timesteps: optional list of timesteps like for create_model, i.e.
+            the first one only initialises storage content and is not
+            checked; default: demand timeseries
+
+    Returns:
+        a DataFrame with columns 'Severity' ('error' or 'warning'), 'Check'
+        and 'Problem', one row per problem; empty if no problems were found
+
+    Example:
+        >>> data = read_excel('mimo-example.xlsx')
+        >>> check_input(data).empty
+        True
+    """
+    problems = []
+    commodity, process = data['commodity'], data['process']
+    transmission, storage = data['transmission'], data['storage']
+    process_commodity = data['process_commodity']
+
+    # (site, commodity) pairs, process commodities and commodity types
+    site_commodities = set(zip(commodity.index.get_level_values('Site'),
+                               commodity.index.get_level_values('Commodity')))
+    process_commodities = {}
+    for pro, com, direction in process_commodity.index:
+        process_commodities.setdefault(pro, []).append((com, direction))
+    com_types = commodity.reset_index().groupby('Type')['Commodity']
+    com_types = dict((com_type, set(coms)) for com_type, coms in com_types)
+
+    # dangling references
+    for pro in sorted(set(process_commodities) -
+                      set(process.index.get_level_values('Process'))):
+        problems.append(('warning', 'reference',
+                         "Process-Commodity entry of undefined process "
+                         "'{}'".format(pro)))
+    for sit, pro in process.index:
+        if pro not in process_commodities:
+            problems.append(('error', 'reference',
+                             "Process {} has no Process-Commodity "
+                             "entries".format((sit, pro))))
+            continue
+        for com, direction in process_commodities[pro]:
+            if (sit, com) not in site_commodities:
+                problems.append(('error', 'reference',
+                                 "Process {} {} commodity '{}', which is not "
+                                 "defined at that site".format(
+                                     (sit, pro), direction.lower(), com)))
+            elif (com in com_types.get('SupIm', ()) and
+                    (sit, com) not in data['supim'].columns):
+                problems.append(('error', 'reference',
+                                 "Process {} needs SupIm timeseries "
+                                 "{}".format((sit, pro), (sit, com))))
+    for sin, sout, tra, com in transmission.index:
+        for sit in (sin, sout):
+            if (sit, com) not in site_commodities:
+                problems.append(('error', 'reference',
+                                 "Transmission {} commodity not defined at "
+                                 "site '{}'".format((sin, sout, tra, com),
+                                                    sit)))
+    for sit, sto, com in storage.index:
+        if (sit, com) not in site_commodities:
+            problems.append(('error', 'reference',
+                             "Storage {} commodity not defined at that "
+                             "site".format((sit, sto, com))))
+    for sit, com in data['demand'].columns:
+        if com not in com_types.get('Demand', ()):
+            problems.append(('warning', 'reference',
+                             "Demand timeseries {} of a commodity without "
+                             "type Demand is ignored".format((sit, com))))
+    price_columns = [col[0] if isinstance(col, tuple) else col
+                     for col in data['buy_sell_price'].columns]
+    for (sit, com, com_type), price in commodity['price'].iteritems():
+        # cf. get_com_price: non-float prices refer to a timeseries
+        if (com_type in ('Buy', 'Sell') and not isinstance(price, float) and
+                com not in price_columns):
+            problems.append(('error', 'reference',
+                             "Commodity {} has no Buy-Sell-Price "
+                             "timeseries".format((sit, com, com_type))))
+
+    # capacity bounds and unbounded directions
+    bounds = [(process, '', 'inst-cap', ['inv-cost', 'fix-cost', 'var-cost']),
+              (transmission, '', 'inst-cap',
+               ['inv-cost', 'fix-cost', 'var-cost']),
+              (storage, '-p', 'inst-cap-p',
+               ['inv-cost-p', 'fix-cost-p', 'var-cost-p']),
+              (storage, '-c', 'inst-cap-c',
+               ['inv-cost-c', 'fix-cost-c', 'var-cost-c'])]
+    for df, suffix, inst_cap, costs in bounds:
+        cap_up = df['cap-up' + suffix]
+        for lower in ['cap-lo' + suffix, inst_cap]:
+            for index in df.index[df[lower] > cap_up]:
+                problems.append(('error', 'bounds',
+                                 "{} {} > {}".format(
+                                     index, lower, 'cap-up' + suffix)))
+        unlimited = cap_up == float('inf')
+        for cost in costs:
+            for index in df.index[unlimited & (df[cost] < 0)]:
+                problems.append(('error', 'unbounded',
+                                 "{} has negative {} and unlimited "
+                                 "{}".format(index, cost, 'cap-up' + suffix)))
+    stock = commodity[commodity.index.get_level_values('Type') == 'Stock']
+    unlimited = ((stock['max'] == float('inf')) &
+                 (stock['maxperstep'] == float('inf')))
+    for index in stock.index[unlimited & (stock['price'] < 0)]:
+        problems.append(('warning', 'unbounded',
+                         "Stock commodity {} has negative price and "
+                         "unlimited max/maxperstep".format(index)))
+
+    # capacity shortfalls
+    shortfall = get_capacity_shortfall(data, timesteps)
+    for (sit, com), series in shortfall.iteritems():
+        hours = series[series > 0]
+        if not hours.empty:
+            problems.append(('error', 'shortfall',
+                             "Demand {} exceeds maximum supply in {} "
+                             "timesteps (first: {}, max: {:.6g} at "
+                             "{})".format((sit, com), len(hours),
+                                          hours.index[0], hours.max(),
+                                          hours.idxmax())))
+
+    return pd.DataFrame(problems, columns=['Severity', 'Check', 'Problem'])
+
+
+def get_capacity_shortfall(data, timesteps=None):
+    """Return demand in excess of maximum possible supply per timestep.
+
+    The maximum supply of a demand commodity in a site is the sum of the
+    output of all processes at their cap-up (for processes with SupIm input,
+    limited by the SupIm timeseries), of imports at the cap-up of all
+    incoming transmissions and of storage output at cap-up-p. As this is an
+    upper bound, any positive shortfall makes the model infeasible. Process
+    inputs are not checked for availability.
 
-def create_model(data, timesteps=None, dt=1):
+    Args:
+        data: input dict as returned by read_excel
+        timesteps: optional list of timesteps like for create_model, i.e.
+            the first one only initialises storage content; default: demand
+            timeseries
+
+    Returns:
+        a DataFrame with the modelled timesteps (all but the first) as index
+        and (site, commodity) of each demand timeseries as columns,
+        containing demand - maximum supply
+    """
+    if not timesteps:
+        timesteps = data['demand'].index.tolist()
+    # the first timestep is not modelled, cf. create_model
+    modelled = list(timesteps)[1:]
+    demand = data['demand'].loc[modelled]
+    supim = data['supim'].loc[modelled]
+    r_in = data['process_commodity'].xs('In', level='Direction')['ratio']
+    r_out = data['process_commodity'].xs('Out', level='Direction')['ratio']
+    com_supim = set(com for (sit, com, com_type) in data['commodity'].index
+                    if com_type == 'SupIm')
+
+    # process outputs and SupIm inputs, one row per (site, process, commodity)
+    process = data['process'][['cap-up']].reset_index()
+    outputs = pd.merge(process, r_out.reset_index(), on='Process')
+    supim_in = r_in[r_in.index.get_level_values('Commodity').isin(com_supim)]
+    inputs = pd.merge(process, supim_in.reset_index(), on='Process')
+
+    # share of cap-up available per timestep: SupIm / r_in, at most 1; the
+    # scarcest SupIm input of a process limits its throughput
+    available = supim.reindex(
+        columns=list(zip(inputs['Site'], inputs['Commodity']))).fillna(0)
+    available = (available / inputs['ratio'].values).clip(upper=1)
+    available.columns = pd.MultiIndex.from_arrays(
+        [inputs['Site'], inputs['Process']])
+    available = available.T.groupby(level=[0, 1]).min().T
+
+    # process output at cap-up; where() avoids inf * 0 for unlimited
+    # capacities
+    factor = available.reindex(
+        columns=list(zip(outputs['Site'], outputs['Process']))).fillna(1)
+    factor.columns = pd.MultiIndex.from_arrays(
+        [outputs['Site'], outputs['Commodity']])
+    output = factor * (outputs['cap-up'] * outputs['ratio']).values
+    output = output.where(factor > 0, 0)
+    supply = output.T.groupby(level=[0, 1]).sum().T
+
+    # imports at cap-up of incoming transmissions and storage output
+    tra, sto = data['transmission'], data['storage']
+    imports = (tra['cap-up'] * tra['eff']).groupby(
+        level=['Site Out', 'Commodity']).sum()
+    retrieved = sto['cap-up-p'].groupby(level=['Site', 'Commodity']).sum()
+
+    supply = (supply.reindex(columns=demand.columns).fillna(0) +
+              imports.reindex(demand.columns).fillna(0).values +
+              retrieved.reindex(demand.columns).fillna(0).values)
+    return demand - supply
+
+
+def create_model(data, timesteps=None, dt=1, prune=True, compact=False,
+                 undirected=False):
     """Create a pyomo ConcreteModel URBS object from given input data.
 
     Args:
         data: a dict of 6 DataFrames with the keys 'commodity', 'process',
-            'transmission', 'storage', 'demand' and 'supim'.
+            'transmission', 'storage', 'demand' and 'supim'. If the
+            timeseries were aggregated by aggregate_timeseries, all typical
+            periods are modelled and argument timesteps is ignored.
         timesteps: optional list of timesteps, default: demand timeseries
         dt: timestep duration in hours (default: 1)
+        prune: if True (default), leave out processes, transmissions,
+            storages and commodities that are zero in any solution (cf.
+            prune_tuples); get_constants still reports them
+        compact: if True, process inputs and outputs are no variables, but
+            expressions tau_pro * ratio; get_entity still returns values
+            for e_pro_in and e_pro_out (default: False)
+        undirected: if True, both directions of a transmission line share
+            one capacity variable instead of two variables forced equal
+            (cf. transmission_lines); requires symmetric capacity input.
+            Investment and fixed costs are still charged for both
+            directions, and get_entity still returns cap_tra and
+            cap_tra_new for both (default: False)
 
     Returns:
         a pyomo ConcreteModel object
@@ -142,30 +690,84 @@ def create_model(data, timesteps=None, dt=1):
     m.created = datetime.now().strftime('%Y%m%dT%H%M')
     
     # Optional
-    if not timesteps:
+    if not timesteps or 'typical_periods' in data:
         timesteps = data['demand'].index.tolist()
 
     # Preparations
     # ============
-    # Data import. Syntax to access a value within equation definitions looks
-    # like this:
-    #
-    #     m.storage.loc[site, storage, commodity][attribute]
-    #
+    # Data import. The DataFrames are kept for result analysis (cf. report,
+    # plot); equation definitions use the lookup tables derived below.
+    # Timeseries are only kept for the modelled timesteps.
+    m.timesteps = timesteps
     m.commodity = data['commodity']
     m.process = data['process']
     m.process_commodity = data['process_commodity']
     m.transmission = data['transmission']
     m.storage = data['storage']
-    m.demand = data['demand']
-    m.supim = data['supim']
-    m.buy_sell_price = data['buy_sell_price']
-    m.timesteps = timesteps
+    m.demand = data['demand'].loc[m.timesteps]
+    m.supim = data['supim'].loc[m.timesteps]
+    m.buy_sell_price = data['buy_sell_price'].loc[m.timesteps]
+
+    # typical periods (cf. aggregate_timeseries), None if not aggregated
+    m.typical_periods = data.get('typical_periods')
+
+    # compact formulation: process inputs and outputs only as expressions
+    m.compact = compact
+
+    # index tuples of modelled commodities, processes, transmissions and
+    # storages; without pruning, all of them
+    m.prune = prune
+    if prune:
+        live_tuples = prune_tuples(data)
+    else:
+        live_tuples = dict((key, data[key].index) for key in
+                           ['commodity', 'process', 'transmission', 'storage'])
+    m.period_order = data.get('period_order')
 
     # process input/output ratios
     m.r_in = m.process_commodity.xs('In', level='Direction')['ratio']
     m.r_out = m.process_commodity.xs('Out', level='Direction')['ratio']
 
+    # parameter lookup tables: DataFrame .loc lookups are far too slow to be
+    # done in every call of an equation rule, so convert all parameters to
+    # nested dicts once. Syntax to access a value within equation definitions
+    # looks like this:
+    #
+    #     m.storage_dict[attribute][site, storage, commodity]
+    #     m.r_in_dict[process, commodity]
+    #
+    m.commodity_dict = m.commodity.to_dict()
+    m.process_dict = m.process.to_dict()
+    m.transmission_dict = m.transmission.to_dict()
+    m.storage_dict = m.storage.to_dict()
+    m.r_in_dict = m.r_in.to_dict()
+    m.r_out_dict = m.r_out.to_dict()
+
+    # timeseries lookup tables: slice to the modelled timesteps and convert
+    # to nested dicts once, accessed like
+    #
+    #     m.demand_dict[site, commodity][timestep]
+    #     m.buy_sell_price_dict[commodity][timestep]
+    #
+    m.demand_dict = m.demand.to_dict()
+    m.supim_dict = m.supim.to_dict()
+
+    # Buy-Sell-Price columns only have one level (the commodity name), so
+    # unpack the 1-tuple column labels created by split_columns
+    m.buy_sell_price_dict = dict(
+        (col[0] if isinstance(col, tuple) else col, series)
+        for col, series in m.buy_sell_price.to_dict().items())
+
+    # demand commodities without a timeseries (in a given site) have no
+    # demand; resolve these once here instead of in each res_vertex_rule call
+    demand_commodities = set(
+        com for (sit, com, com_type) in m.commodity.index
+        if com_type == 'Demand')
+    for sit in m.commodity.index.get_level_values('Site').unique():
+        for com in demand_commodities:
+            if (sit, com) not in m.demand_dict:
+                m.demand_dict[sit, com] = dict.fromkeys(m.timesteps, 0)
+
     # Sets
     # ====
     # Syntax: m.{name} = Set({domain}, initialize={values})
@@ -179,10 +781,15 @@ def create_model(data, timesteps=None, dt=1):
         ordered=True,
         doc='Set of timesteps')
 
-    # modelled (i.e. excluding init time step for storage) time steps
+    # modelled (i.e. excluding init time step for storage) time steps;
+    # typical periods each have their own init time step
+    if m.typical_periods is None:
+        init_timesteps = m.timesteps[:1]
+    else:
+        init_timesteps = m.typical_periods['start'].tolist()
     m.tm = pyomo.Set(
         within=m.t,
-        initialize=m.timesteps[1:],
+        initialize=[t for t in m.timesteps if t not in set(init_timesteps)],
         ordered=True,
         doc='Set of modelled timesteps')
 
@@ -224,19 +831,29 @@ def create_model(data, timesteps=None, dt=1):
     # tuple sets
     m.com_tuples = pyomo.Set(
         within=m.sit*m.com*m.com_type,
-        initialize=m.commodity.index,
+        initialize=live_tuples['commodity'],
         doc='Combinations of defined commodities, e.g. (Mid,Elec,Demand)')
     m.pro_tuples = pyomo.Set(
         within=m.sit*m.pro,
-        initialize=m.process.index,
+        initialize=live_tuples['process'],
         doc='Combinations of possible processes, e.g. (North,Coal plant)')
     m.tra_tuples = pyomo.Set(
         within=m.sit*m.sit*m.tra*m.com,
-        initialize=m.transmission.index,
+        initialize=live_tuples['transmission'],
         doc='Combinations of possible transmission, e.g. (South,Mid,hvac,Elec)')
+
+    # transmission lines: each transmission tuple refers to the capacity
+    # of its line, which is the transmission itself if not undirected
+    m.undirected = undirected
+    m.tra_line = transmission_lines(
+        m.transmission_dict, m.tra_tuples, undirected)
+    m.tra_line_tuples = pyomo.Set(
+        within=m.sit*m.sit*m.tra*m.com,
+        initialize=[t for t in m.tra_tuples if m.tra_line[t] == t],
+        doc='Transmission lines with a capacity, e.g. (Mid,South,hvac,Elec)')
     m.sto_tuples = pyomo.Set(
         within=m.sit*m.sto*m.com,
-        initialize=m.storage.index,
+        initialize=live_tuples['storage'],
         doc='Combinations of possible storage by site, e.g. (Mid,Bat,Elec)')
 
     # process input/output
@@ -255,6 +872,12 @@ def create_model(data, timesteps=None, dt=1):
                     if process == pro],
         doc='Commodities produced by process by site, e.g. (Mid,PV,Elec)')
 
+    # commodity incidence: for each (site, commodity), all process,
+    # transmission and storage tuples that consume or provide it. Used by
+    # commodity_balance, so that it needs not scan all tuple sets on each call
+    m.com_incidence = commodity_incidence(
+        m.pro_input_tuples, m.pro_output_tuples, m.tra_tuples, m.sto_tuples)
+
     # commodity type subsets
     m.com_supim = pyomo.Set(
         within=m.com,
@@ -281,6 +904,68 @@ def create_model(data, timesteps=None, dt=1):
         initialize=commodity_subset(m.com_tuples, 'Env'),
         doc='Commodities that (might) have a maximum creation limit')
 
+    # commodity tuple subsets; used as index for constraints that only apply
+    # to commodities of a certain type, instead of skipping all others
+    m.stock_tuples = pyomo.Set(
+        within=m.sit*m.com*m.com_type,
+        initialize=commodity_subset(m.com_tuples, m.com_stock),
+        doc='Combinations of stock commodities, e.g. (Mid,Coal,Stock)')
+    m.sell_tuples = pyomo.Set(
+        within=m.sit*m.com*m.com_type,
+        initialize=commodity_subset(m.com_tuples, m.com_sell),
+        doc='Combinations of sell commodities, e.g. (South,Elec sell,Sell)')
+    m.buy_tuples = pyomo.Set(
+        within=m.sit*m.com*m.com_type,
+        initialize=commodity_subset(m.com_tuples, m.com_buy),
+        doc='Combinations of buy commodities, e.g. (South,Elec buy,Buy)')
+    m.env_tuples = pyomo.Set(
+        within=m.sit*m.com*m.com_type,
+        initialize=commodity_subset(m.com_tuples, m.com_env),
+        doc='Combinations of environmental commodities, e.g. (Mid,CO2,Env)')
+
+    # process input subsets
+    m.pro_supim_tuples = pyomo.Set(
+        within=m.sit*m.pro*m.com,
+        initialize=[(site, process, commodity)
+                    for (site, process, commodity) in m.pro_input_tuples
+                    if commodity in m.com_supim],
+        doc='Intermittent inputs of process by site, e.g. (Mid,PV,Solar)')
+    m.pro_buy_tuples = pyomo.Set(
+        within=m.sit*m.pro*m.com,
+        initialize=[(site, process, commodity)
+                    for (site, process, commodity) in m.pro_input_tuples
+                    if commodity in m.com_buy],
+        doc='Buy commodity inputs of process by site, '
+            'e.g. (South,Purchase,Elec buy)')
+
+    # first and last timestep, the only ones with storage state boundary
+    # conditions
+    m.t_endpoints = pyomo.Set(
+        within=m.t,
+        initialize=[m.timesteps[0], m.timesteps[-1]],
+        ordered=True,
+        doc='Set of first and last timestep')
+
+    # boundaries between consecutive original periods; storage content is
+    # carried over these when timeseries are aggregated to typical periods
+    if m.typical_periods is not None:
+        m.period_boundary = pyomo.Set(
+            initialize=range(len(m.period_order) + 1),
+            ordered=True,
+            doc='Set of boundaries between original periods')
+        m.typical_period = pyomo.Set(
+            initialize=m.typical_periods.index.tolist(),
+            ordered=True,
+            doc='Set of typical periods')
+
+        # typical period of each timestep, including its init timestep
+        m.timestep_period = dict(
+            (t, period)
+            for period, start, end in zip(m.typical_periods.index,
+                                          m.typical_periods['start'],
+                                          m.typical_periods['end'])
+            for t in range(start, end + 1))
+
     # Parameters
 
     # weight = length of year (hours) / length of simulation (hours)
@@ -288,10 +973,34 @@ def create_model(data, timesteps=None, dt=1):
     # year, making comparisons among cost types (invest is annualized, fixed
     # costs are annual by default, variable costs are scaled by weight) and
     # among different simulation durations meaningful.
+    # for typical periods, the length of simulation is that of all
+    # original periods
+    if m.typical_periods is None:
+        simulation_length = len(m.t) * dt
+    else:
+        period_length = len(m.tm) // len(m.typical_periods)
+        simulation_length = len(m.period_order) * period_length * dt
     m.weight = pyomo.Param(
-        initialize=float(8760) / (len(m.t) * dt),
+        initialize=float(8760) / simulation_length,
         doc='Pre-factor for variable costs and emissions for an annual result')
 
+    # period_weight = number of original periods a modelled timestep stands
+    # for; 1 unless the timeseries were aggregated to typical periods. Scales
+    # all sums over timesteps, together with weight.
+    if m.typical_periods is None:
+        period_weight = dict.fromkeys(m.tm, 1)
+    else:
+        period_weight = {}
+        for start, end, weight in zip(m.typical_periods['start'],
+                                      m.typical_periods['end'],
+                                      m.typical_periods['weight']):
+            for t in range(start + 1, end + 1):
+                period_weight[t] = weight
+    m.period_weight = pyomo.Param(
+        m.tm,
+        initialize=period_weight,
+        doc='Number of original periods represented by modelled timestep')
+
     # dt = spacing between timesteps. Required for storage equation that
     # converts between energy (storage content, e_sto_con) and power (all other
     # quantities that start with "e_")
@@ -299,6 +1008,51 @@ def create_model(data, timesteps=None, dt=1):
         initialize=dt,
         doc='Time step duration (in hours), default: 1')
 
+    # mutable parameters: cost coefficients, capacity bounds and stock
+    # commodity prices, i.e. the attributes in MUTABLE_ATTRIBUTES. Scenarios
+    # that only change these can re-use an existing model instance, cf.
+    # function update_model. Syntax to access a value looks like this:
+    #
+    #     m.process_param[site, process, attribute]
+    #
+    m.commodity_attr = pyomo.Set(
+        initialize=MUTABLE_ATTRIBUTES['commodity'],
+        doc='Mutable commodity attributes')
+    m.process_attr = pyomo.Set(
+        initialize=MUTABLE_ATTRIBUTES['process'],
+        doc='Mutable process attributes')
+    m.transmission_attr = pyomo.Set(
+        initialize=MUTABLE_ATTRIBUTES['transmission'],
+        doc='Mutable transmission attributes')
+    m.storage_attr = pyomo.Set(
+        initialize=MUTABLE_ATTRIBUTES['storage'],
+        doc='Mutable storage attributes')
+    m.commodity_param = pyomo.Param(
+        m.stock_tuples, m.commodity_attr,
+        initialize=mutable_values(
+            m.commodity_dict, m.stock_tuples, MUTABLE_ATTRIBUTES['commodity']),
+        mutable=True,
+        doc='Stock commodity prices (EUR/MWh)')
+    m.process_param = pyomo.Param(
+        m.pro_tuples, m.process_attr,
+        initialize=mutable_values(
+            m.process_dict, m.pro_tuples, MUTABLE_ATTRIBUTES['process']),
+        mutable=True,
+        doc='Process costs and capacity bounds')
+    m.transmission_param = pyomo.Param(
+        m.tra_tuples, m.transmission_attr,
+        initialize=mutable_values(
+            m.transmission_dict, m.tra_tuples,
+            MUTABLE_ATTRIBUTES['transmission']),
+        mutable=True,
+        doc='Transmission costs and capacity bounds')
+    m.storage_param = pyomo.Param(
+        m.sto_tuples, m.storage_attr,
+        initialize=mutable_values(
+            m.storage_dict, m.sto_tuples, MUTABLE_ATTRIBUTES['storage']),
+        mutable=True,
+        doc='Storage costs and capacity bounds')
+
     # Variables
 
     # costs
@@ -308,23 +1062,29 @@ def create_model(data, timesteps=None, dt=1):
         doc='Costs by type (EUR/a)')
 
     # commodity
+    # simple upper and lower limits are variable bounds, not constraints
+    # (cf. BOUND_CONSTRAINTS)
     m.e_co_stock = pyomo.Var(
-        m.tm, m.com_tuples,
+        m.tm, m.stock_tuples,
         within=pyomo.NonNegativeReals,
+        bounds=res_stock_step_rule,
         doc='Use of stock commodity source (MW) per timestep')
     m.e_co_sell = pyomo.Var(
-        m.tm, m.com_tuples,
+        m.tm, m.sell_tuples,
         within=pyomo.NonNegativeReals,
+        bounds=res_sell_step_rule,
         doc='Use of sell commodity source (MW) per timestep')
     m.e_co_buy = pyomo.Var(
-       m.tm, m.com_tuples,
+       m.tm, m.buy_tuples,
        within=pyomo.NonNegativeReals,
+       bounds=res_buy_step_rule,
        doc='Use of buy commodity source (MW) per timestep')
 
     # process
     m.cap_pro = pyomo.Var(
         m.pro_tuples,
         within=pyomo.NonNegativeReals,
+        bounds=res_process_capacity_rule,
         doc='Total process capacity (MW)')
     m.cap_pro_new = pyomo.Var(
         m.pro_tuples,
@@ -334,22 +1094,24 @@ def create_model(data, timesteps=None, dt=1):
         m.tm, m.pro_tuples,
         within=pyomo.NonNegativeReals,
         doc='Power flow (MW) through process')
-    m.e_pro_in = pyomo.Var(
-        m.tm, m.pro_tuples, m.com,
-        within=pyomo.NonNegativeReals,
-        doc='Power flow of commodity into process (MW) per timestep')
-    m.e_pro_out = pyomo.Var(
-        m.tm, m.pro_tuples, m.com,
-        within=pyomo.NonNegativeReals,
-        doc='Power flow out of process (MW) per timestep')
+    if not m.compact:
+        m.e_pro_in = pyomo.Var(
+            m.tm, m.pro_input_tuples,
+            within=pyomo.NonNegativeReals,
+            doc='Power flow of commodity into process (MW) per timestep')
+        m.e_pro_out = pyomo.Var(
+            m.tm, m.pro_output_tuples,
+            within=pyomo.NonNegativeReals,
+            doc='Power flow out of process (MW) per timestep')
 
     # transmission
     m.cap_tra = pyomo.Var(
-        m.tra_tuples,
+        m.tra_line_tuples,
         within=pyomo.NonNegativeReals,
+        bounds=res_transmission_capacity_rule,
         doc='Total transmission capacity (MW)')
     m.cap_tra_new = pyomo.Var(
-        m.tra_tuples,
+        m.tra_line_tuples,
         within=pyomo.NonNegativeReals,
         doc='New transmission capacity (MW)')
     m.e_tra_in = pyomo.Var(
@@ -365,6 +1127,7 @@ def create_model(data, timesteps=None, dt=1):
     m.cap_sto_c = pyomo.Var(
         m.sto_tuples,
         within=pyomo.NonNegativeReals,
+        bounds=res_storage_capacity_rule,
         doc='Total storage size (MWh)')
     m.cap_sto_c_new = pyomo.Var(
         m.sto_tuples,
@@ -373,6 +1136,7 @@ def create_model(data, timesteps=None, dt=1):
     m.cap_sto_p = pyomo.Var(
         m.sto_tuples,
         within=pyomo.NonNegativeReals,
+        bounds=res_storage_power_rule,
         doc='Total storage power (MW)')
     m.cap_sto_p_new = pyomo.Var(
         m.sto_tuples,
@@ -390,6 +1154,21 @@ def create_model(data, timesteps=None, dt=1):
         m.t, m.sto_tuples,
         within=pyomo.NonNegativeReals,
         doc='Energy content of storage (MWh) in timestep')
+    if m.typical_periods is not None:
+        m.e_sto_con_inter = pyomo.Var(
+            m.period_boundary, m.sto_tuples,
+            within=pyomo.NonNegativeReals,
+            doc='Energy content of storage (MWh) at period boundary')
+        m.e_sto_con_dev_max = pyomo.Var(
+            m.typical_period, m.sto_tuples,
+            within=pyomo.Reals,
+            doc='Maximum storage content within typical period relative '
+                'to its start (MWh)')
+        m.e_sto_con_dev_min = pyomo.Var(
+            m.typical_period, m.sto_tuples,
+            within=pyomo.Reals,
+            doc='Minimum storage content within typical period relative '
+                'to its start (MWh)')
 
     # Equation declarations
     # equation bodies are defined in separate functions, referred to here by 
@@ -400,36 +1179,24 @@ def create_model(data, timesteps=None, dt=1):
         m.tm, m.com_tuples,
         rule=res_vertex_rule,
         doc='storage + transmission + process + source + buy - sell == demand')
-    m.res_stock_step = pyomo.Constraint(
-        m.tm, m.com_tuples,
-        rule=res_stock_step_rule,
-        doc='stock commodity input per step <= commodity.maxperstep')
     m.res_stock_total = pyomo.Constraint(
-        m.com_tuples,
+        m.stock_tuples,
         rule=res_stock_total_rule,
         doc='total stock commodity input <= commodity.max')
-    m.res_sell_step = pyomo.Constraint(
-       m.tm, m.com_tuples,
-       rule=res_sell_step_rule,
-       doc='sell commodity output per step <= commodity.maxperstep')
     m.res_sell_total = pyomo.Constraint(
-        m.com_tuples,
+        m.sell_tuples,
         rule=res_sell_total_rule,
         doc='total sell commodity output <= commodity.max')
-    m.res_buy_step = pyomo.Constraint(
-        m.tm, m.com_tuples,
-        rule=res_buy_step_rule,
-        doc='buy commodity output per step <= commodity.maxperstep')
     m.res_buy_total = pyomo.Constraint(
-       m.com_tuples,
+       m.buy_tuples,
        rule=res_buy_total_rule,
        doc='total buy commodity output <= commodity.max')
     m.res_env_step = pyomo.Constraint(
-        m.tm, m.com_tuples,
+        m.tm, m.env_tuples,
         rule=res_env_step_rule,
         doc='environmental output per step <= commodity.maxperstep')
     m.res_env_total = pyomo.Constraint(
-        m.com_tuples,
+        m.env_tuples,
         rule=res_env_total_rule,
         doc='total environmental commodity output <= commodity.max')
 
@@ -438,34 +1205,31 @@ def create_model(data, timesteps=None, dt=1):
         m.pro_tuples,
         rule=def_process_capacity_rule,
         doc='total process capacity = inst-cap + new capacity')
-    m.def_process_input = pyomo.Constraint(
-        m.tm, m.pro_input_tuples,
-        rule=def_process_input_rule,
-        doc='process input = process throughput * input ratio')
-    m.def_process_output = pyomo.Constraint(
-        m.tm, m.pro_output_tuples,
-        rule=def_process_output_rule,
-        doc='process output = process throughput * output ratio')
+    if not m.compact:
+        m.def_process_input = pyomo.Constraint(
+            m.tm, m.pro_input_tuples,
+            rule=def_process_input_rule,
+            doc='process input = process throughput * input ratio')
+        m.def_process_output = pyomo.Constraint(
+            m.tm, m.pro_output_tuples,
+            rule=def_process_output_rule,
+            doc='process output = process throughput * output ratio')
     m.def_intermittent_supply = pyomo.Constraint(
-        m.tm, m.pro_input_tuples,
+        m.tm, m.pro_supim_tuples,
         rule=def_intermittent_supply_rule,
         doc='process output = process capacity * supim timeseries')
     m.res_process_throughput_by_capacity = pyomo.Constraint(
         m.tm, m.pro_tuples,
         rule=res_process_throughput_by_capacity_rule,
         doc='process throughput <= total process capacity')
-    m.res_process_capacity = pyomo.Constraint(
-        m.pro_tuples,
-        rule=res_process_capacity_rule,
-        doc='process.cap-lo <= total process capacity <= process.cap-up')
     m.res_sell_buy_symmetry = pyomo.Constraint(
-        m.pro_input_tuples,
+        m.pro_buy_tuples,
         rule=res_sell_buy_symmetry_rule,
         doc='total power connection capacity must be symmetric in both directions')
 
     # transmission
     m.def_transmission_capacity = pyomo.Constraint(
-        m.tra_tuples,
+        m.tra_line_tuples,
         rule=def_transmission_capacity_rule,
         doc='total transmission capacity = inst-cap + new capacity')
     m.def_transmission_output = pyomo.Constraint(
@@ -476,15 +1240,12 @@ def create_model(data, timesteps=None, dt=1):
         m.tm, m.tra_tuples,
         rule=res_transmission_input_by_capacity_rule,
         doc='transmission input <= total transmission capacity')
-    m.res_transmission_capacity = pyomo.Constraint(
-        m.tra_tuples,
-        rule=res_transmission_capacity_rule,
-        doc='transmission.cap-lo <= total transmission capacity <= '
-            'transmission.cap-up')
-    m.res_transmission_symmetry = pyomo.Constraint(
-        m.tra_tuples,
-        rule=res_transmission_symmetry_rule,
-        doc='total transmission capacity must be symmetric in both directions')
+    if not m.undirected:
+        m.res_transmission_symmetry = pyomo.Constraint(
+            m.tra_tuples,
+            rule=res_transmission_symmetry_rule,
+            doc='total transmission capacity must be symmetric in both '
+                'directions')
 
     # storage
     m.def_storage_state = pyomo.Constraint(
@@ -511,18 +1272,42 @@ def create_model(data, timesteps=None, dt=1):
         m.t, m.sto_tuples,
         rule=res_storage_state_by_capacity_rule,
         doc='storage content <= storage capacity')
-    m.res_storage_power = pyomo.Constraint(
-        m.sto_tuples,
-        rule=res_storage_power_rule,
-        doc='storage.cap-lo-p <= storage power <= storage.cap-up-p')
-    m.res_storage_capacity = pyomo.Constraint(
-        m.sto_tuples,
-        rule=res_storage_capacity_rule,
-        doc='storage.cap-lo-c <= storage capacity <= storage.cap-up-c')
-    m.res_initial_and_final_storage_state = pyomo.Constraint(
-        m.t, m.sto_tuples,
-        rule=res_initial_and_final_storage_state_rule,
-        doc='storage content initial == and final >= storage.init * capacity')
+    if m.typical_periods is None:
+        m.res_initial_and_final_storage_state = pyomo.Constraint(
+            m.t_endpoints, m.sto_tuples,
+            rule=res_initial_and_final_storage_state_rule,
+            doc='storage content initial == and final >= '
+                'storage.init * capacity')
+    else:
+        m.def_storage_state_inter = pyomo.Constraint(
+            m.period_boundary, m.sto_tuples,
+            rule=def_storage_state_inter_rule,
+            doc='storage[i+1] = storage[i] + net change in typical period')
+        m.res_storage_state_inter_by_capacity = pyomo.Constraint(
+            m.period_boundary, m.sto_tuples,
+            rule=res_storage_state_inter_by_capacity_rule,
+            doc='storage content at period boundary <= storage capacity')
+        m.def_storage_dev_max = pyomo.Constraint(
+            m.t, m.sto_tuples,
+            rule=def_storage_dev_max_rule,
+            doc='storage content - content at period start <= max deviation')
+        m.def_storage_dev_min = pyomo.Constraint(
+            m.t, m.sto_tuples,
+            rule=def_storage_dev_min_rule,
+            doc='storage content - content at period start >= min deviation')
+        m.res_storage_state_intra_max = pyomo.Constraint(
+            m.period_boundary, m.sto_tuples,
+            rule=res_storage_state_intra_max_rule,
+            doc='content at period boundary + max deviation <= capacity')
+        m.res_storage_state_intra_min = pyomo.Constraint(
+            m.period_boundary, m.sto_tuples,
+            rule=res_storage_state_intra_min_rule,
+            doc='content at period boundary + min deviation >= 0')
+        m.res_initial_and_final_storage_state_inter = pyomo.Constraint(
+            m.period_boundary, m.sto_tuples,
+            rule=res_initial_and_final_storage_state_inter_rule,
+            doc='storage content initial == and final >= '
+                'storage.init * capacity')
 
     # costs
     m.def_costs = pyomo.Constraint(
@@ -541,199 +1326,1178 @@ def create_model(data, timesteps=None, dt=1):
     return m
 
 
-# Constraints
-
-# commodity
+def update_model(prob, data, timesteps=None):
+    """Apply changed input data to an existing model instance.
 
-# vertex equation: calculate balance for given commodity and site;
-# contains implicit constraints for process activity, import/export and
-# storage activity (calculated by function commodity_balance);
-# contains implicit constraint for stock commodity source term
-def res_vertex_rule(m, tm, sit, com, com_type):
-    # environmental or supim commodities don't have this constraint (yet)
-    if com in m.com_env:
-        return pyomo.Constraint.Skip
-    if com in m.com_supim:
-        return pyomo.Constraint.Skip
+    Transfers the values of all mutable parameters (cf. MUTABLE_ATTRIBUTES
+    and the global CO2 limit in 'hacks') from data to prob. This way, a
+    scenario that only changes costs, capacity bounds, stock commodity prices
+    or the CO2 limit can be solved again without creating a new model.
 
-    # helper function commodity_balance calculates balance from input to
-    # and output from processes, storage and transmission.
-    # if power_surplus > 0: production/storage/imports create net positive
-    #                       amount of commodity com
-    # if power_surplus < 0: production/storage/exports consume a net
-    #                       amount of the commodity com
-    power_surplus = - commodity_balance(m, tm, sit, com)
+    Args:
+        prob: a urbs model instance, i.e. create_model(...).create()
+        data: a dict of DataFrames like returned by read_excel, e.g. after
+            modification by a scenario function
+        timesteps: optional list of timesteps of the scenario, like for
+            create_model; default: demand timeseries
 
-    # if com is a stock commodity, the commodity source term e_co_stock
-    # can supply a possibly negative power_surplus
-    if com in m.com_stock:
-        power_surplus += m.e_co_stock[tm, sit, com, com_type]
+    Returns:
+        prob, updated in place
 
-    # if com is a sell commodity, the commodity source term e_co_sell
-    # can supply a possibly positive power_surplus
-    if com in m.com_sell:
-        power_surplus -= m.e_co_sell[tm, sit, com, com_type]
+    Raises:
+        ValueError: if timesteps differ from those prob was created with,
+            or if data differs from the input prob was created with in
+            anything but the mutable parameters. Such scenarios need a new
+            model instance.
+    """
+    # check that the modelled timesteps are the same
+    if not timesteps or 'typical_periods' in data:
+        timesteps = data['demand'].index.tolist()
+    if list(timesteps) != list(prob.timesteps):
+        raise ValueError("Timesteps changed, cannot update model instance.")
+
+    # check that only mutable parameters differ
+    if not prob.process_commodity.equals(data['process_commodity']):
+        raise ValueError("Input 'process_commodity' changed, cannot update "
+                         "model instance.")
+    for key in ['demand', 'supim', 'buy_sell_price']:
+        if not getattr(prob, key).equals(data[key].loc[prob.timesteps]):
+            raise ValueError("Input '{}' changed, cannot update "
+                             "model instance.".format(key))
+    for key, tuples in [('commodity', prob.stock_tuples),
+                        ('process', prob.pro_tuples),
+                        ('transmission', prob.tra_tuples),
+                        ('storage', prob.sto_tuples)]:
+        if not _immutable_part(getattr(prob, key), key, tuples).equals(
+                _immutable_part(data[key], key, tuples)):
+            raise ValueError("Input '{}' changed in other than mutable "
+                             "attributes, cannot update model "
+                             "instance.".format(key))
+
+    if prob.prune:
+        live_tuples = prune_tuples(data)
+        for key, tuples in [('commodity', prob.com_tuples),
+                            ('process', prob.pro_tuples),
+                            ('transmission', prob.tra_tuples),
+                            ('storage', prob.sto_tuples)]:
+            if set(live_tuples[key]) != set(tuples):
+                raise ValueError("Input '{}' changed which entities are "
+                                 "pruned, cannot update model "
+                                 "instance.".format(key))
 
-    # if com is a buy commodity, the commodity source term e_co_buy
-    # can supply a possibly negative power_surplus
-    if com in m.com_buy:
-        power_surplus += m.e_co_buy[tm, sit, com, com_type]
+    try:
+        global_co2_limit = data['hacks'].loc['Global CO2 limit', 'Value']
+    except KeyError:
+        global_co2_limit = float('inf')
+    if math.isinf(global_co2_limit) == hasattr(prob, 'global_co2_limit'):
+        raise ValueError("Global CO2 limit added or removed, cannot update "
+                         "model instance.")
+
+    # replace input DataFrames and lookup tables
+    prob.commodity = data['commodity']
+    prob.process = data['process']
+    prob.transmission = data['transmission']
+    prob.storage = data['storage']
+    prob.commodity_dict = prob.commodity.to_dict()
+    prob.process_dict = prob.process.to_dict()
+    prob.transmission_dict = prob.transmission.to_dict()
+    prob.storage_dict = prob.storage.to_dict()
+
+    # set mutable parameter values
+    for key, tuples in [('commodity', prob.stock_tuples),
+                        ('process', prob.pro_tuples),
+                        ('transmission', prob.tra_tuples),
+                        ('storage', prob.sto_tuples)]:
+        param = getattr(prob, key + '_param')
+        values = mutable_values(getattr(prob, key + '_dict'), tuples,
+                                MUTABLE_ATTRIBUTES[key])
+        for index, value in values.items():
+            param[index] = value
+    if 'hacks' in data:
+        prob.hacks = data['hacks']
+        if hasattr(prob, 'global_co2_limit'):
+            prob.global_co2_limit[None] = global_co2_limit
+
+    # undirected transmission capacities need symmetric capacity bounds
+    transmission_lines(prob.transmission_dict, prob.tra_tuples,
+                       prob.undirected)
+
+    # capacity bounds are variable bounds, which are not updated by
+    # preprocess (cf. BOUND_CONSTRAINTS)
+    for var, rule in [(prob.cap_pro, res_process_capacity_rule),
+                      (prob.cap_tra, res_transmission_capacity_rule),
+                      (prob.cap_sto_p, res_storage_power_rule),
+                      (prob.cap_sto_c, res_storage_capacity_rule)]:
+        for index in var:
+            lower, upper = rule(prob, *index)
+            var[index].setlb(lower)
+            var[index].setub(upper)
+
+    # update constraint and objective coefficients; results of an earlier
+    # solve are outdated
+    prob.preprocess()
+    prob.result_cache = None
+    return prob
 
-    # if com is a demand commodity, the power_surplus is reduced by the
-    # demand value; no scaling by m.dt or m.weight is needed here, as this
-    # constraint is about power (MW), not energy (MWh)
-    if com in m.com_demand:
-        try:
-            power_surplus -= m.demand.loc[tm][sit, com]
-        except KeyError:
-            pass
-    return power_surplus == 0
 
-# stock commodity purchase == commodity consumption, according to
-# commodity_balance of current (time step, site, commodity);
-# limit stock commodity use per time step
-def res_stock_step_rule(m, tm, sit, com, com_type):
-    if com not in m.com_stock:
-        return pyomo.Constraint.Skip
-    else:
-        return (m.e_co_stock[tm, sit, com, com_type] <=
-                m.commodity.loc[sit, com, com_type]['maxperstep'])
+def prune_tuples(data):
+    """Return index tuples of all entities that may be non-zero in a model.
 
-# limit stock commodity use in total (scaled to annual consumption, thanks
-# to m.weight)
-def res_stock_total_rule(m, sit, com, com_type):
-    if com not in m.com_stock:
-        return pyomo.Constraint.Skip
-    else:
-        # calculate total consumption of commodity com
-        total_consumption = 0
-        for tm in m.tm:
-            total_consumption += (
-                m.e_co_stock[tm, sit, com, com_type] * m.dt)
-        total_consumption *= m.weight
-        return (total_consumption <=
-                m.commodity.loc[sit, com, com_type]['max'])
-
-# limit sell commodity use per time step
-def res_sell_step_rule(m, tm, sit, com, com_type):
-    if com not in m.com_sell:
-        return pyomo.Constraint.Skip
-    else:
-        return (m.e_co_sell[tm, sit, com, com_type] <=
-                   m.commodity.loc[sit, com, com_type]['maxperstep'])
+    Leaves out entities that are zero in any solution, so that create_model
+    needs no variables and constraints for them:
 
-# limit sell commodity use in total (scaled to annual consumption, thanks
-# to m.weight)
-def res_sell_total_rule(m, sit, com, com_type):
-    if com not in m.com_sell:
-        return pyomo.Constraint.Skip
-    else:
-        # calculate total sale of commodity com
-        total_consumption = 0
-        for tm in m.tm:
-            total_consumption += (
-                m.e_co_sell[tm, sit, com, com_type] * m.dt)
-        total_consumption *= m.weight
-        return (total_consumption <=
-                  m.commodity.loc[sit, com, com_type]['max'])
-
-# limit buy commodity use per time step
-def res_buy_step_rule(m, tm, sit, com, com_type):
-    if com not in m.com_buy:
-        return pyomo.Constraint.Skip
-    else:
-        return (m.e_co_buy[tm, sit, com, com_type] <=
-                   m.commodity.loc[sit, com, com_type]['maxperstep'])
+    * processes with inst-cap = cap-up = 0, unless linked to another process
+      by a Buy/Sell commodity (cf. res_sell_buy_symmetry)
+    * transmissions with inst-cap = cap-up = 0 in both directions
+    * storages with inst-cap-p = cap-up-p = 0 and inst-cap-c = cap-lo-c = 0
+    * commodities of a site that are neither demanded there nor consumed or
+      produced by any remaining process, transmission or storage
 
-# limit buy commodity use in total (scaled to annual consumption, thanks
-# to m.weight)
-def res_buy_total_rule(m, sit, com, com_type):
-    if com not in m.com_buy:
-        return pyomo.Constraint.Skip
-    else:
-        # calculate total sale of commodity com
-        total_consumption = 0
-        for tm in m.tm:
-            total_consumption += (
-                m.e_co_buy[tm, sit, com, com_type] * m.dt)
-        total_consumption *= m.weight
-        return (total_consumption <=
-                  m.commodity.loc[sit, com, com_type]['max'])
+    Args:
+        data: input dict as returned by read_excel
 
-# environmental commodity creation == - commodity_balance of that commodity
-# used for modelling emissions (e.g. CO2) or other end-of-pipe results of
-# any process activity;
-# limit environmental commodity output per time step
-def res_env_step_rule(m, tm, sit, com, com_type):
-    if com not in m.com_env:
-        return pyomo.Constraint.Skip
-    else:
-        environmental_output = - commodity_balance(m, tm, sit, com)
-        return (environmental_output <=
-                m.commodity.loc[sit, com, com_type]['maxperstep'])
+    Returns:
+        dict with keys 'commodity', 'process', 'transmission' and 'storage'
+        of lists of index tuples
+    """
+    commodity, process = data['commodity'], data['process']
+    transmission, storage = data['transmission'], data['storage']
+
+    # processes
+    process_commodities = {}
+    for pro, com, direction in data['process_commodity'].index:
+        process_commodities.setdefault(pro, []).append(com)
+    buy_sell = set(com for (sit, com, com_type) in commodity.index
+                   if com_type in ('Buy', 'Sell'))
+    linked = set(pro for pro, coms in process_commodities.items()
+                 if buy_sell.intersection(coms))
+    dead = (process['inst-cap'] == 0) & (process['cap-up'] == 0)
+    pro_tuples = [(sit, pro) for (sit, pro), is_dead
+                  in zip(process.index, dead)
+                  if not is_dead or pro in linked]
+
+    # transmissions; both directions must be kept, cf.
+    # res_transmission_symmetry
+    dead = (transmission['inst-cap'] == 0) & (transmission['cap-up'] == 0)
+    dead = set(transmission.index[dead])
+    tra_tuples = [(sin, sout, tra, com)
+                  for (sin, sout, tra, com) in transmission.index
+                  if (sin, sout, tra, com) not in dead or
+                  (sout, sin, tra, com) not in dead]
+
+    # storages: without power, stored energy is zero; a capacity without
+    # power is still kept if inst-cap-c or cap-lo-c forces it (fixed costs)
+    dead = ((storage['inst-cap-p'] == 0) & (storage['cap-up-p'] == 0) &
+            (storage['inst-cap-c'] == 0) & (storage['cap-lo-c'] == 0))
+    sto_tuples = list(storage.index[~dead])
+
+    # commodities
+    used = set(data['demand'].columns)
+    for sit, pro in pro_tuples:
+        used.update((sit, com) for com in process_commodities.get(pro, []))
+    for sin, sout, tra, com in tra_tuples:
+        used.update([(sin, com), (sout, com)])
+    for sit, sto, com in sto_tuples:
+        used.add((sit, com))
+    com_tuples = [(sit, com, com_type)
+                  for (sit, com, com_type) in commodity.index
+                  if (sit, com) in used]
+
+    return {'commodity': com_tuples,
+            'process': pro_tuples,
+            'transmission': tra_tuples,
+            'storage': sto_tuples}
+
+
+def _immutable_part(df, key, tuples):
+    """Return copy of input DataFrame with all mutable values set to zero."""
+    df = df.copy()
+    for attr in MUTABLE_ATTRIBUTES[key]:
+        if key == 'commodity':
+            # only stock commodity prices are mutable
+            rows = [row in tuples for row in df.index]
+            df.loc[rows, attr] = 0
+        else:
+            df[attr] = 0
+    return df
 
-# limit environmental commodity output in total (scaled to annual
-# emissions, thanks to m.weight)
-def res_env_total_rule(m, sit, com, com_type):
-    if com not in m.com_env:
-        return pyomo.Constraint.Skip
-    else:
-        # calculate total creation of environmental commodity com
-        env_output_sum = 0
-        for tm in m.tm:
-            env_output_sum += (- commodity_balance(m, tm, sit, com) * m.dt)
-        env_output_sum *= m.weight
-        return (env_output_sum <=
-                m.commodity.loc[sit, com, com_type]['max'])
 
-# process
-# process capacity == new capacity + existing capacity
-def def_process_capacity_rule(m, sit, pro):
-    return (m.cap_pro[sit, pro] ==
-            m.cap_pro_new[sit, pro] +
-            m.process.loc[sit, pro]['inst-cap'])
+def rolling_horizon(data, prob, optim, timesteps=None, window=168,
+                    lookahead=24, dt=1):
+    """Solve the dispatch for given capacities in consecutive time windows.
+
+    Creates and solves one model per window of length window + lookahead.
+    Capacities cap_pro, cap_tra, cap_sto_c and cap_sto_p are fixed to their
+    values in prob; window models leave out (prune) and merge (undirected)
+    the same tuples as prob. The storage content at the end of the retained
+    part of a window (its first 'window' timesteps) becomes the initial
+    content of the next window; only the last window has to meet the final
+    storage content condition. Only the retained part of each window's
+    timeseries is kept, so that memory use is bounded by the window size,
+    not the number of timesteps.
+
+    Annual limits (cf. ANNUAL_LIMITS, e.g. commodity.max or the global CO2
+    limit) hold for the whole time span, not for each window. A window may
+    use the limit minus the usage of all timesteps retained before, in
+    proportion to the window's share of the remaining timesteps. What a
+    window leaves unused is carried forward to the following ones, and the
+    last window may use all that remains. Thus the stitched dispatch meets
+    each annual limit like the model of the whole time span, but cannot use
+    more than that proportional share early on.
 
-# process input power == process throughput * input ratio
-def def_process_input_rule(m, tm, sit, pro, co):
-    return (m.e_pro_in[tm, sit, pro, co] ==
-            m.tau_pro[tm, sit, pro] * m.r_in.loc[pro, co])
+    Args:
+        data: input dict as returned by read_excel
+        prob: a solved urbs model instance (or ResultSet) with capacities
+        optim: a solver object, e.g. SolverFactory('glpk')
+        timesteps: optional list of timesteps, first one only initialises
+            storage content, like in create_model; default: all timesteps of
+            the demand timeseries
+        window: retained timesteps per window (default: 168, one week)
+        lookahead: additional timesteps per window that are only solved to
+            foresee the following timesteps (default: 24, one day)
+        dt: timestep duration in hours (default: 1)
 
-# process output power = process throughput * output ratio
-def def_process_output_rule(m, tm, sit, pro, co):
-    return (m.e_pro_out[tm, sit, pro, co] ==
-            m.tau_pro[tm, sit, pro] * m.r_out.loc[pro, co])
+    Returns:
+        a ResultSet with stitched timeseries and the constants of the whole
+        time span, usable with get_timeseries, report and plot
 
-# process input (for supim commodity) = process capacity * timeseries
-def def_intermittent_supply_rule(m, tm, sit, pro, coin):
-    if coin in m.com_supim:
-        return (m.e_pro_in[tm, sit, pro, coin] ==
-                m.cap_pro[sit, pro] * m.supim.loc[tm][sit, coin])
-    else:
+    Example:
+        >>> import coopr.environ
+        >>> from coopr.opt.base import SolverFactory
+        >>> data = read_excel('mimo-example.xlsx')
+        >>> prob = create_model(data, range(1, 169)).create()
+        >>> prob.load(SolverFactory('glpk').solve(prob))
+        True
+        >>> result = rolling_horizon(data, prob, SolverFactory('glpk'),
+        ...                          range(0, 673), window=168, lookahead=24)
+        >>> len(get_entity(result, 'tm'))
+        672
+
+        The stitched dispatch is a feasible dispatch of the whole time span,
+        so costs no less than the optimal one:
+
+        >>> whole = create_model(data, range(0, 673)).create()
+        >>> whole.load(SolverFactory('glpk').solve(whole))
+        True
+        >>> rolling_costs = get_entity(result, 'costs')['costs']
+        >>> (rolling_costs.sum() >=
+        ...  get_entity(whole, 'costs')['costs'].sum() - 1e-6)
+        True
+    """
+    if 'typical_periods' in data:
+        raise ValueError("Rolling horizon needs the original timeseries, "
+                         "not typical periods.")
+    if timesteps is None:
+        timesteps = data['demand'].index.tolist()
+    timesteps = list(timesteps)
+    modelled = timesteps[1:]
+
+    # window models leave out and merge the same tuples as prob
+    prune = getattr(prob, 'prune', True)
+    undirected = getattr(prob, 'undirected', False)
+
+    # capacities to be fixed in each window
+    capacities = {}
+    for name in CAPACITY_VARIABLES:
+        entity = get_entity(prob, name)
+        if entity.empty:
+            capacities[name] = {}
+        else:
+            capacities[name] = dict(zip(entity.index, entity[name]))
+
+    # retained parts of the timeseries, summed time-dependent costs,
+    # storage content at the end of the previous window and usage of annual
+    # limits (not scaled by weight) of all previous windows
+    timeseries = {}
+    costs = dict.fromkeys(['Var', 'Fuel', 'Revenue', 'Purchase'], 0)
+    storage_content = None
+    limits = annual_limits(data)
+    used = [0] * len(limits)
+
+    # scaling of time-dependent costs and annual limits to a year, like in
+    # create_model for the whole time span
+    weight = float(8760) / (len(timesteps) * dt)
+
+    for start in range(0, len(modelled), window):
+        retained = modelled[start:start + window]
+        horizon = [timesteps[start]] + modelled[start:start + window +
+                                                lookahead]
+        instance = create_model(data, horizon, dt, prune=prune,
+                                undirected=undirected).create()
+
+        # capacities are given per direction (cf. get_entity), variables
+        # cap_tra per line (cf. transmission_lines)
+        for name, values in capacities.items():
+            var = getattr(instance, name)
+            if name == 'cap_tra':
+                index_map = dict((instance.tra_line[t], t)
+                                 for t in instance.tra_tuples)
+            else:
+                index_map = dict((index, index) for index in var)
+            for index in var:
+                var[index].value = values[index_map[index]]
+                var[index].fixed = True
+
+        # initial storage content is fixed; final storage content condition
+        # only holds at the end of the last window
+        instance.res_initial_and_final_storage_state.deactivate()
+        for s in instance.sto_tuples:
+            init = (capacities['cap_sto_c'][s] *
+                    instance.storage_dict['init'][s])
+            if storage_content is None:
+                instance.e_sto_con[(horizon[0],) + s].value = init
+            else:
+                instance.e_sto_con[(horizon[0],) + s].value = \
+                    storage_content[s]
+            instance.e_sto_con[(horizon[0],) + s].fixed = True
+            if horizon[-1] == timesteps[-1]:
+                instance.e_sto_con[(horizon[-1],) + s].setlb(init)
+
+        # annual limits hold for the whole time span, not for each window
+        for name in ANNUAL_LIMITS:
+            if hasattr(instance, name):
+                getattr(instance, name).deactivate()
+        share = float(len(modelled) - start) / (len(horizon) - 1)
+        instance.window_limits = dict(
+            (k, (name, index, share, limit / weight - used[k]))
+            for k, (name, index, limit) in enumerate(limits))
+        instance.window_limit = pyomo.Set(
+            initialize=range(len(limits)),
+            doc='Set of annual limits')
+        instance.res_window_limit = pyomo.Constraint(
+            instance.window_limit,
+            rule=res_window_limit_rule,
+            doc='usage * remaining/window timesteps <= remaining limit')
+        instance.preprocess()
+
+        result = optim.solve(instance)
+        _check_optimal(result, "Window starting at timestep {}".format(
+            horizon[0]))
+        instance.load(result)
+
+        # keep retained timesteps only; storage content also of the very
+        # first timestep
+        for name in ['tm', 'tau_pro', 'e_co_stock', 'e_co_sell', 'e_co_buy',
+                     'e_pro_in', 'e_pro_out', 'e_tra_in', 'e_tra_out',
+                     'e_sto_in', 'e_sto_out', 'e_sto_con']:
+            if name == 'e_sto_con' and storage_content is None:
+                steps = [horizon[0]] + retained
+            else:
+                steps = retained
+            entity = get_entity(instance, name)
+            entity = entity[entity.index.get_level_values(0).isin(steps)]
+            timeseries.setdefault(name, []).append(entity)
+
+        for cost_type in costs:
+            costs[cost_type] += pyomo.value(
+                variable_costs(instance, cost_type, retained))
+
+        storage_content = dict(
+            (s, instance.e_sto_con[(retained[-1],) + s].value)
+            for s in instance.sto_tuples)
+        for k, (name, index, limit) in enumerate(limits):
+            used[k] += pyomo.value(
+                annual_usage(instance, name, index, retained))
+
+    # constants are identical in all windows, so take them from the last one
+    entities = dict((name, pd.concat(frames))
+                    for name, frames in timeseries.items())
+    for name in ['cap_pro', 'cap_pro_new', 'cap_tra', 'cap_tra_new',
+                 'cap_sto_c', 'cap_sto_c_new', 'cap_sto_p', 'cap_sto_p_new',
+                 'costs']:
+        entities[name] = get_entity(instance, name)
+
+    # time-dependent costs, scaled to a year like in create_model
+    for cost_type, value in costs.items():
+        entities['costs'].loc[cost_type, 'costs'] = weight * value
+
+    return ResultSet(entities,
+                     demand=data['demand'],
+                     com_demand=list(instance.com_demand),
+                     sit=list(instance.sit),
+                     prune=instance.prune,
+                     undirected=instance.undirected,
+                     process=data['process'],
+                     transmission=data['transmission'],
+                     storage=data['storage'])
+
+
+def benders(data, timesteps=None, block_length=168, solver='glpk',
+            processes=None, max_iter=50, tolerance=1e-4, dt=1, prune=True):
+    """Solve a urbs model by benders decomposition into time blocks.
+
+    A master problem decides all capacities and holds the investment and
+    fixed costs. For given capacities, the dispatch of each time block is an
+    independent subproblem; these are solved in parallel worker processes.
+    The duals of the fixed capacities yield one optimality cut per block and
+    iteration, which is added to the master problem. Iterations stop once the
+    gap between upper bound (master costs + dispatch costs) and lower bound
+    (master objective) is below tolerance.
+
+    Each time block starts with storage content storage.init * capacity and
+    must end with at least that content, like a model of that block alone.
+    Its dispatch costs are scaled to a year like those of the whole time
+    span in create_model, so that the upper bound is the objective of
+    create_model with the same capacities and blockwise storage content.
+    The subproblems must be feasible for any capacities the master chooses,
+    e.g. by a slack process for each demand; otherwise, a ValueError names
+    the block.
+
+    Annual limits (cf. ANNUAL_LIMITS, e.g. commodity.max or the global CO2
+    limit) link all blocks, so the master problem also assigns each block a
+    share of each limit; the shares sum up to at most the limit. In the first
+    iteration, the shares are proportional to the block lengths. Duals of the
+    shares enter the optimality cuts like those of the capacities. If a
+    block is infeasible for its shares, the excess of the shares is
+    minimized instead, and its duals yield a feasibility cut.
+
+    Args:
+        data: input dict as returned by read_excel
+        timesteps: optional list of timesteps, first one only initialises
+            storage content, like in create_model; default: all timesteps of
+            the demand timeseries
+        block_length: modelled timesteps per block (default: 168, one week)
+        solver: solver name, e.g. 'glpk' (default), 'gurobi'
+        processes: number of worker processes, default: number of CPUs
+        max_iter: maximum number of iterations (default: 50)
+        tolerance: relative gap at which to stop (default: 1e-4)
+        dt: timestep duration in hours (default: 1)
+        prune: if True (default), leave out the same entities in master
+            problem and subproblems, cf. create_model
+
+    Returns:
+        the master problem instance with the best capacities found; its
+        attribute benders_bounds lists (lower, upper) bounds per iteration.
+        Pass it to rolling_horizon to obtain the dispatch.
+    """
+    import multiprocessing
+    from coopr.opt.base import SolverFactory
+
+    if 'typical_periods' in data:
+        raise ValueError("Benders decomposition needs the original "
+                         "timeseries, not typical periods.")
+    if timesteps is None:
+        timesteps = data['demand'].index.tolist()
+    timesteps = list(timesteps)
+
+    # time blocks, each preceded by the timestep before it as init timestep;
+    # shares of the modelled timesteps (without the init timesteps)
+    blocks = [timesteps[start:start + block_length + 1]
+              for start in range(0, len(timesteps) - 1, block_length)]
+    shares = [float(len(block) - 1) / (len(timesteps) - 1)
+              for block in blocks]
+
+    # annual limits, and their scaling to a year like in create_model for
+    # the whole time span
+    limits = annual_limits(data)
+    weight = float(8760) / (len(timesteps) * dt)
+
+    optim = SolverFactory(solver)
+    # the input is sent to each worker process once, not with each block;
+    # all sheets are parsed first, as forked workers would otherwise parse
+    # them concurrently from the spreadsheet file they share
+    pool = multiprocessing.Pool(processes, _init_benders_subproblems,
+                                (dict(data),))
+    cuts = []
+    bounds = []
+    best_master, best_upper = None, float('inf')
+    try:
+        for iteration in range(max_iter):
+            # master problem is small, so simply re-create it with all cuts
+            master = create_benders_master(data, shares, cuts, limits,
+                                           prune).create()
+            result = optim.solve(master)
+            _check_optimal(result, "Benders master problem")
+            master.load(result)
+
+            # lower bound only once each block has an optimality cut
+            if len(set(cut[0] for cut in cuts if cut[4])) == len(blocks):
+                lower = pyomo.value(master.obj)
+            else:
+                lower = -float('inf')
+
+            values = dict(
+                (name, dict((index, var.value) for index, var
+                            in getattr(master, name).iteritems()))
+                for name in CAPACITY_VARIABLES + ['budget'])
+            results = pool.map(
+                _solve_benders_subproblem,
+                [(block, block_timesteps, values, limits, weight, solver, dt,
+                  prune)
+                 for block, block_timesteps in enumerate(blocks)])
+
+            # upper bound only if all blocks are feasible
+            if all(optimality for objective, duals, optimality in results):
+                upper = (master.costs['Inv'].value +
+                         master.costs['Fix'].value +
+                         sum(objective
+                             for objective, duals, optimality in results))
+            else:
+                upper = float('inf')
+            for block, (objective, duals, optimality) in enumerate(results):
+                cuts.append((block, objective, values, duals, optimality))
+
+            bounds.append((lower, upper))
+            if upper < best_upper:
+                best_master, best_upper = master, upper
+            if upper - lower <= tolerance * abs(upper):
+                break
+    finally:
+        pool.close()
+        pool.join()
+
+    # no iteration found capacities feasible for all blocks
+    if best_master is None:
+        best_master = master
+
+    best_master.benders_bounds = bounds
+    return best_master
+
+
+def create_benders_master(data, shares, cuts, limits=(), prune=True):
+    """Create the master problem of a benders decomposition.
+
+    Contains the capacity variables with their constraints from create_model,
+    investment and fixed costs, one variable for the dispatch costs of
+    each time block, estimated from below by the cuts, and the share of each
+    annual limit assigned to each time block.
+
+    Args:
+        data: input dict as returned by read_excel
+        shares: list of the share of each block in the modelled timesteps
+        cuts: list of (block, objective, values, duals, optimality) tuples,
+            as collected by function benders; optimality is False for
+            feasibility cuts, whose objective is the excess of the shares of
+            annual limits
+        limits: list of annual limits as returned by annual_limits
+        prune: if True (default), leave out entities like create_model
+
+    Returns:
+        a pyomo ConcreteModel object
+    """
+    m = pyomo.ConcreteModel()
+    m.name = 'URBS benders master'
+    m.created = datetime.now().strftime('%Y%m%dT%H%M')
+
+    # Preparations
+    m.commodity = data['commodity']
+    m.process = data['process']
+    m.transmission = data['transmission']
+    m.storage = data['storage']
+    m.process_dict = m.process.to_dict()
+    m.transmission_dict = m.transmission.to_dict()
+    m.storage_dict = m.storage.to_dict()
+    r_in = data['process_commodity'].xs('In', level='Direction')['ratio']
+    r_out = data['process_commodity'].xs('Out', level='Direction')['ratio']
+    m.cuts = cuts
+    m.limits = limits
+
+    # index tuples like in create_model
+    m.prune = prune
+    if prune:
+        live_tuples = prune_tuples(data)
+    else:
+        live_tuples = dict((key, data[key].index) for key in
+                           ['commodity', 'process', 'transmission', 'storage'])
+
+    # Sets
+    m.sit = pyomo.Set(
+        initialize=m.commodity.index.get_level_values('Site').unique(),
+        doc='Set of sites')
+    m.com = pyomo.Set(
+        initialize=m.commodity.index.get_level_values('Commodity').unique(),
+        doc='Set of commodities')
+    m.com_type = pyomo.Set(
+        initialize=m.commodity.index.get_level_values('Type').unique(),
+        doc='Set of commodity types')
+    m.pro = pyomo.Set(
+        initialize=m.process.index.get_level_values('Process').unique(),
+        doc='Set of conversion processes')
+    m.tra = pyomo.Set(
+        initialize=m.transmission.index.get_level_values('Transmission').unique(),
+        doc='Set of transmission technologies')
+    m.sto = pyomo.Set(
+        initialize=m.storage.index.get_level_values('Storage').unique(),
+        doc='Set of storage technologies')
+    m.cost_type = pyomo.Set(
+        initialize=['Inv', 'Fix'],
+        doc='Set of cost types in the master problem')
+    m.block = pyomo.Set(
+        initialize=range(len(shares)),
+        ordered=True,
+        doc='Set of time blocks')
+    m.cut = pyomo.Set(
+        initialize=range(len(cuts)),
+        ordered=True,
+        doc='Set of benders cuts')
+    m.limit = pyomo.Set(
+        initialize=range(len(limits)),
+        ordered=True,
+        doc='Set of annual limits')
+
+    m.com_tuples = pyomo.Set(
+        within=m.sit*m.com*m.com_type,
+        initialize=live_tuples['commodity'],
+        doc='Combinations of defined commodities, e.g. (Mid,Elec,Demand)')
+    m.pro_tuples = pyomo.Set(
+        within=m.sit*m.pro,
+        initialize=live_tuples['process'],
+        doc='Combinations of possible processes, e.g. (North,Coal plant)')
+    m.tra_tuples = pyomo.Set(
+        within=m.sit*m.sit*m.tra*m.com,
+        initialize=live_tuples['transmission'],
+        doc='Combinations of possible transmission, e.g. (South,Mid,hvac,Elec)')
+    m.tra_line = transmission_lines(m.transmission_dict, m.tra_tuples, False)
+    m.sto_tuples = pyomo.Set(
+        within=m.sit*m.sto*m.com,
+        initialize=live_tuples['storage'],
+        doc='Combinations of possible storage by site, e.g. (Mid,Bat,Elec)')
+    m.pro_input_tuples = pyomo.Set(
+        within=m.sit*m.pro*m.com,
+        initialize=[(site, process, commodity)
+                    for (site, process) in m.pro_tuples
+                    for (pro, commodity) in r_in.index
+                    if process == pro],
+        doc='Commodities consumed by process by site, e.g. (Mid,PV,Solar)')
+    m.pro_output_tuples = pyomo.Set(
+        within=m.sit*m.pro*m.com,
+        initialize=[(site, process, commodity)
+                    for (site, process) in m.pro_tuples
+                    for (pro, commodity) in r_out.index
+                    if process == pro],
+        doc='Commodities produced by process by site, e.g. (Mid,PV,Elec)')
+    m.com_sell = pyomo.Set(
+       within=m.com,
+       initialize=commodity_subset(m.com_tuples, 'Sell'),
+       doc='Commodities that can be sold')
+    m.pro_buy_tuples = pyomo.Set(
+        within=m.sit*m.pro*m.com,
+        initialize=[(site, process, commodity)
+                    for (site, process, commodity) in m.pro_input_tuples
+                    if commodity in commodity_subset(m.com_tuples, 'Buy')],
+        doc='Buy commodity inputs of process by site, '
+            'e.g. (South,Purchase,Elec buy)')
+
+    # Parameters
+    m.block_share = pyomo.Param(
+        m.block,
+        initialize=dict(enumerate(shares)),
+        doc='Share of time block in modelled timesteps')
+    m.process_attr = pyomo.Set(
+        initialize=MUTABLE_ATTRIBUTES['process'],
+        doc='Mutable process attributes')
+    m.transmission_attr = pyomo.Set(
+        initialize=MUTABLE_ATTRIBUTES['transmission'],
+        doc='Mutable transmission attributes')
+    m.storage_attr = pyomo.Set(
+        initialize=MUTABLE_ATTRIBUTES['storage'],
+        doc='Mutable storage attributes')
+    m.process_param = pyomo.Param(
+        m.pro_tuples, m.process_attr,
+        initialize=mutable_values(
+            m.process_dict, m.pro_tuples, MUTABLE_ATTRIBUTES['process']),
+        doc='Process costs and capacity bounds')
+    m.transmission_param = pyomo.Param(
+        m.tra_tuples, m.transmission_attr,
+        initialize=mutable_values(
+            m.transmission_dict, m.tra_tuples,
+            MUTABLE_ATTRIBUTES['transmission']),
+        doc='Transmission costs and capacity bounds')
+    m.storage_param = pyomo.Param(
+        m.sto_tuples, m.storage_attr,
+        initialize=mutable_values(
+            m.storage_dict, m.sto_tuples, MUTABLE_ATTRIBUTES['storage']),
+        doc='Storage costs and capacity bounds')
+
+    # Variables
+    m.costs = pyomo.Var(
+        m.cost_type,
+        within=pyomo.Reals,
+        doc='Costs by type (EUR/a)')
+    m.dispatch_costs = pyomo.Var(
+        m.block,
+        within=pyomo.Reals,
+        doc='Estimated dispatch costs of time block (EUR/a)')
+    m.budget = pyomo.Var(
+        m.block, m.limit,
+        within=pyomo.NonNegativeReals,
+        doc='Share of annual limit assigned to time block (per year)')
+    m.cap_pro = pyomo.Var(
+        m.pro_tuples,
+        within=pyomo.NonNegativeReals,
+        bounds=res_process_capacity_rule,
+        doc='Total process capacity (MW)')
+    m.cap_pro_new = pyomo.Var(
+        m.pro_tuples,
+        within=pyomo.NonNegativeReals,
+        doc='New process capacity (MW)')
+    m.cap_tra = pyomo.Var(
+        m.tra_tuples,
+        within=pyomo.NonNegativeReals,
+        bounds=res_transmission_capacity_rule,
+        doc='Total transmission capacity (MW)')
+    m.cap_tra_new = pyomo.Var(
+        m.tra_tuples,
+        within=pyomo.NonNegativeReals,
+        doc='New transmission capacity (MW)')
+    m.cap_sto_c = pyomo.Var(
+        m.sto_tuples,
+        within=pyomo.NonNegativeReals,
+        bounds=res_storage_capacity_rule,
+        doc='Total storage size (MWh)')
+    m.cap_sto_c_new = pyomo.Var(
+        m.sto_tuples,
+        within=pyomo.NonNegativeReals,
+        doc='New storage size (MWh)')
+    m.cap_sto_p = pyomo.Var(
+        m.sto_tuples,
+        within=pyomo.NonNegativeReals,
+        bounds=res_storage_power_rule,
+        doc='Total storage power (MW)')
+    m.cap_sto_p_new = pyomo.Var(
+        m.sto_tuples,
+        within=pyomo.NonNegativeReals,
+        doc='New  storage power (MW)')
+
+    # Equation declarations, rules shared with create_model
+    m.def_process_capacity = pyomo.Constraint(
+        m.pro_tuples,
+        rule=def_process_capacity_rule,
+        doc='total process capacity = inst-cap + new capacity')
+    m.res_sell_buy_symmetry = pyomo.Constraint(
+        m.pro_buy_tuples,
+        rule=res_sell_buy_symmetry_rule,
+        doc='total power connection capacity must be symmetric in both directions')
+    m.def_transmission_capacity = pyomo.Constraint(
+        m.tra_tuples,
+        rule=def_transmission_capacity_rule,
+        doc='total transmission capacity = inst-cap + new capacity')
+    m.res_transmission_symmetry = pyomo.Constraint(
+        m.tra_tuples,
+        rule=res_transmission_symmetry_rule,
+        doc='total transmission capacity must be symmetric in both directions')
+    m.def_storage_power = pyomo.Constraint(
+        m.sto_tuples,
+        rule=def_storage_power_rule,
+        doc='storage power = inst-cap + new power')
+    m.def_storage_capacity = pyomo.Constraint(
+        m.sto_tuples,
+        rule=def_storage_capacity_rule,
+        doc='storage capacity = inst-cap + new capacity')
+    m.def_costs = pyomo.Constraint(
+        m.cost_type,
+        rule=def_costs_rule,
+        doc='investment and fixed costs')
+    m.res_budget_total = pyomo.Constraint(
+        m.limit,
+        rule=res_budget_total_rule,
+        doc='sum of shares of annual limit <= annual limit')
+    m.res_benders_cut = pyomo.Constraint(
+        m.cut,
+        rule=res_benders_cut_rule,
+        doc='dispatch costs >= subproblem costs + duals * capacity change')
+    m.obj = pyomo.Objective(
+        rule=benders_obj_rule,
+        sense=pyomo.minimize,
+        doc='minimize(investment + fixed + estimated dispatch costs)')
+
+    # first iteration: shares of annual limits proportional to block length
+    if not cuts:
+        for block in m.block:
+            for limit in m.limit:
+                m.budget[block, limit].value = shares[block] * limits[limit][2]
+                m.budget[block, limit].fixed = True
+
+    return m
+
+
+# input dict shared by all subproblems of benders in a worker process
+_BENDERS_DATA = None
+
+
+def _init_benders_subproblems(data):
+    """Initialize a worker process of benders."""
+    global _BENDERS_DATA
+    _BENDERS_DATA = data
+
+
+def _solve_benders_subproblem(args, data=None):
+    """Solve the dispatch of one time block for fixed capacities.
+
+    Runs in a worker process of function benders, so takes one tuple
+    (block, timesteps, values, limits, weight, solver, dt, prune) and
+    imports the solver itself; data defaults to the input dict of the worker
+    process (cf. _init_benders_subproblems). values holds the capacities and
+    shares of annual limits ('budget') of the master problem, weight the
+    scaling of the whole time span to a year (cf. create_model). Dispatch
+    costs and their duals are scaled by weight, too, instead of by the
+    weight of the block alone.
+
+    If the block is infeasible for its shares of the annual limits, the
+    excess of the shares is minimized instead.
+
+    Returns:
+        (objective, duals, optimality) tuple: the dispatch costs (the excess
+        if optimality is False) and, for each name in CAPACITY_VARIABLES and
+        'budget', a dict of the duals of the values given by the master
+        problem
+
+    Raises:
+        ValueError: if the block cannot be solved, not even with unlimited
+            shares of the annual limits
+    """
+    from coopr.opt.base import SolverFactory
+    block, timesteps, values, limits, weight, solver, dt, prune = args
+    if data is None:
+        data = _BENDERS_DATA
+
+    model = create_model(data, timesteps, dt, prune=prune)
+    model.dual = pyomo.Suffix(direction=pyomo.Suffix.IMPORT)
+
+    # capacities are fixed by constraints, not by fixing the variables, to
+    # obtain their duals
+    model.cap_pro_fixed = pyomo.Param(
+        model.pro_tuples,
+        initialize=dict((p, values['cap_pro'][p])
+                        for p in model.pro_tuples),
+        doc='Process capacity given by master problem (MW)')
+    model.cap_tra_fixed = pyomo.Param(
+        model.tra_tuples,
+        initialize=dict((t, values['cap_tra'][t])
+                        for t in model.tra_tuples),
+        doc='Transmission capacity given by master problem (MW)')
+    model.cap_sto_c_fixed = pyomo.Param(
+        model.sto_tuples,
+        initialize=dict((s, values['cap_sto_c'][s])
+                        for s in model.sto_tuples),
+        doc='Storage size given by master problem (MWh)')
+    model.cap_sto_p_fixed = pyomo.Param(
+        model.sto_tuples,
+        initialize=dict((s, values['cap_sto_p'][s])
+                        for s in model.sto_tuples),
+        doc='Storage power given by master problem (MW)')
+    model.res_cap_pro_fixed = pyomo.Constraint(
+        model.pro_tuples,
+        rule=res_cap_pro_fixed_rule,
+        doc='process capacity = master problem process capacity')
+    model.res_cap_tra_fixed = pyomo.Constraint(
+        model.tra_tuples,
+        rule=res_cap_tra_fixed_rule,
+        doc='transmission capacity = master problem transmission capacity')
+    model.res_cap_sto_c_fixed = pyomo.Constraint(
+        model.sto_tuples,
+        rule=res_cap_sto_c_fixed_rule,
+        doc='storage capacity = master problem storage capacity')
+    model.res_cap_sto_p_fixed = pyomo.Constraint(
+        model.sto_tuples,
+        rule=res_cap_sto_p_fixed_rule,
+        doc='storage power = master problem storage power')
+
+    # annual limits hold for all blocks together; the block may only use
+    # the share the master problem assigns to it. The excess of the shares
+    # (budget_slack) is only allowed when minimizing it.
+    for name in ANNUAL_LIMITS:
+        if hasattr(model, name):
+            getattr(model, name).deactivate()
+    model.budget_limits = limits
+    model.budget_weight = weight
+    model.limit = pyomo.Set(
+        initialize=range(len(limits)),
+        doc='Set of annual limits')
+    model.budget_fixed = pyomo.Param(
+        model.limit,
+        initialize=dict((limit, values['budget'][block, limit])
+                        for limit in range(len(limits))),
+        doc='Share of annual limit given by master problem (per year)')
+    model.budget_slack = pyomo.Var(
+        model.limit,
+        within=pyomo.NonNegativeReals,
+        doc='Excess of share of annual limit (per year)')
+    model.res_budget_fixed = pyomo.Constraint(
+        model.limit,
+        rule=res_budget_fixed_rule,
+        doc='usage of annual limit <= share given by master problem')
+    for limit in model.limit:
+        model.budget_slack[limit].value = 0
+        model.budget_slack[limit].fixed = True
+
+    # investment and fixed costs are part of the master problem
+    for cost_type in ['Inv', 'Fix']:
+        model.def_costs[cost_type].deactivate()
+        model.costs[cost_type].value = 0
+        model.costs[cost_type].fixed = True
+
+    prob = model.create()
+    optim = SolverFactory(solver)
+    result = optim.solve(prob)
+    description = "Subproblem of block {} (timesteps {} to {})".format(
+        block, timesteps[0], timesteps[-1])
+    try:
+        _check_optimal(result, description)
+        optimality = True
+    except ValueError:
+        if not limits:
+            raise
+        optimality = False
+
+    if optimality:
+        prob.load(result)
+        # the block's costs are scaled to a year by its own weight; rescale
+        # them by the weight of the whole time span
+        scale = weight / pyomo.value(prob.weight)
+        objective = scale * pyomo.value(prob.obj)
+    else:
+        # feasibility problem: minimize excess of the shares
+        for limit in prob.limit:
+            prob.budget_slack[limit].fixed = False
+        prob.obj.deactivate()
+        prob.obj_budget_slack = pyomo.Objective(
+            expr=pyomo.summation(prob.budget_slack),
+            sense=pyomo.minimize,
+            doc='minimize(excess of shares of annual limits)')
+        prob.preprocess()
+        slack_result = optim.solve(prob)
+        _check_optimal(slack_result, description +
+                       " with unlimited shares of annual limits")
+        prob.load(slack_result)
+        scale = 1
+        objective = pyomo.value(prob.obj_budget_slack)
+        if objective <= 0:
+            # infeasible for another reason than the shares
+            _check_optimal(result, description)
+
+    duals = {}
+    for name in CAPACITY_VARIABLES:
+        constraint = getattr(prob, 'res_{}_fixed'.format(name))
+        duals[name] = dict(
+            (index, scale * prob.dual.getValue(constraint[index]))
+            for index in constraint)
+    duals['budget'] = dict(
+        ((block, limit),
+         scale * prob.dual.getValue(prob.res_budget_fixed[limit]))
+        for limit in prob.res_budget_fixed)
+    if not optimality and not any(dual for name in duals
+                                  for dual in duals[name].values()):
+        # no other capacities or shares make the block feasible
+        _check_optimal(result, description)
+    return objective, duals, optimality
+
+# share of an annual limit in a time block: usage, scaled to a year like for
+# the whole time span - excess <= share given by master problem
+def res_budget_fixed_rule(m, limit):
+    name, index, total = m.budget_limits[limit]
+    usage = annual_usage(m, name, index, m.tm)
+    if isinstance(usage, (int, float)):
+        # limited commodity not modelled
+        return pyomo.Constraint.Skip
+    return (m.budget_weight * usage - m.budget_slack[limit] <=
+            m.budget_fixed[limit])
+
+# sum of shares of an annual limit of all time blocks <= annual limit
+def res_budget_total_rule(m, limit):
+    return (sum(m.budget[block, limit] for block in m.block) <=
+            m.limits[limit][2])
+
+# optimality cut: dispatch costs of a time block >= its costs for the values
+# (capacities, shares of annual limits) of an earlier iteration + duals *
+# (values - values of that iteration);
+# feasibility cut: 0 >= excess of the shares of annual limits for the values
+# of an earlier iteration + duals * (values - values of that iteration)
+def res_benders_cut_rule(m, cut):
+    block, objective, values, duals, optimality = m.cuts[cut]
+    change = sum(duals[name][index] *
+                 (getattr(m, name)[index] - values[name][index])
+                 for name in duals
+                 for index in duals[name])
+    if optimality:
+        return m.dispatch_costs[block] >= objective + change
+    return 0 >= objective + change
+
+# objective: investment and fixed costs + dispatch costs of each block
+# (scaled to a year like the whole time span); the latter are unbounded
+# before the first optimality cut of a block exists
+def benders_obj_rule(m):
+    blocks = set(cut[0] for cut in m.cuts if cut[4])
+    return (pyomo.summation(m.costs) +
+            sum(m.dispatch_costs[block]
+                for block in m.block if block in blocks))
+
+# capacities in subproblem == capacities decided by master problem
+def res_cap_pro_fixed_rule(m, sit, pro):
+    return m.cap_pro[sit, pro] == m.cap_pro_fixed[sit, pro]
+
+def res_cap_tra_fixed_rule(m, sin, sout, tra, com):
+    return (m.cap_tra[sin, sout, tra, com] ==
+            m.cap_tra_fixed[sin, sout, tra, com])
+
+def res_cap_sto_c_fixed_rule(m, sit, sto, com):
+    return m.cap_sto_c[sit, sto, com] == m.cap_sto_c_fixed[sit, sto, com]
+
+def res_cap_sto_p_fixed_rule(m, sit, sto, com):
+    return m.cap_sto_p[sit, sto, com] == m.cap_sto_p_fixed[sit, sto, com]
+
+
+# Constraints
+
+# commodity
+
+# vertex equation: calculate balance for given commodity and site;
+# contains implicit constraints for process activity, import/export and
+# storage activity (calculated by function commodity_balance);
+# contains implicit constraint for stock commodity source term
+def res_vertex_rule(m, tm, sit, com, com_type):
+    # environmental or supim commodities don't have this constraint (yet)
+    if com in m.com_env:
         return pyomo.Constraint.Skip
+    if com in m.com_supim:
+        return pyomo.Constraint.Skip
+
+    # helper function commodity_balance calculates balance from input to
+    # and output from processes, storage and transmission.
+    # if power_surplus > 0: production/storage/imports create net positive
+    #                       amount of commodity com
+    # if power_surplus < 0: production/storage/exports consume a net
+    #                       amount of the commodity com
+    power_surplus = - commodity_balance(m, tm, sit, com)
+
+    # if com is a stock commodity, the commodity source term e_co_stock
+    # can supply a possibly negative power_surplus
+    if (sit, com, com_type) in m.stock_tuples:
+        power_surplus += m.e_co_stock[tm, sit, com, com_type]
+
+    # if com is a sell commodity, the commodity source term e_co_sell
+    # can supply a possibly positive power_surplus
+    if (sit, com, com_type) in m.sell_tuples:
+        power_surplus -= m.e_co_sell[tm, sit, com, com_type]
+
+    # if com is a buy commodity, the commodity source term e_co_buy
+    # can supply a possibly negative power_surplus
+    if (sit, com, com_type) in m.buy_tuples:
+        power_surplus += m.e_co_buy[tm, sit, com, com_type]
+
+    # if com is a demand commodity, the power_surplus is reduced by the
+    # demand value; no scaling by m.dt or m.weight is needed here, as this
+    # constraint is about power (MW), not energy (MWh)
+    if com in m.com_demand:
+        power_surplus -= m.demand_dict[sit, com][tm]
+    return power_surplus == 0
+
+# stock commodity purchase == commodity consumption, according to
+# commodity_balance of current (time step, site, commodity);
+# limit stock commodity use per time step (variable bounds of e_co_stock)
+def res_stock_step_rule(m, tm, sit, com, com_type):
+    return (0, _bound(m.commodity_dict['maxperstep'][sit, com, com_type]))
+
+# limit stock commodity use in total (scaled to annual consumption, thanks
+# to m.weight)
+def res_stock_total_rule(m, sit, com, com_type):
+    # calculate total consumption of commodity com
+    total_consumption = 0
+    for tm in m.tm:
+        total_consumption += (
+            m.e_co_stock[tm, sit, com, com_type] * m.dt * m.period_weight[tm])
+    total_consumption *= m.weight
+    return (total_consumption <=
+            m.commodity_dict['max'][sit, com, com_type])
+
+# limit sell commodity use per time step (variable bounds of e_co_sell)
+def res_sell_step_rule(m, tm, sit, com, com_type):
+    return (0, _bound(m.commodity_dict['maxperstep'][sit, com, com_type]))
+
+# limit sell commodity use in total (scaled to annual consumption, thanks
+# to m.weight)
+def res_sell_total_rule(m, sit, com, com_type):
+    # calculate total sale of commodity com
+    total_consumption = 0
+    for tm in m.tm:
+        total_consumption += (
+            m.e_co_sell[tm, sit, com, com_type] * m.dt * m.period_weight[tm])
+    total_consumption *= m.weight
+    return (total_consumption <=
+            m.commodity_dict['max'][sit, com, com_type])
+
+# limit buy commodity use per time step (variable bounds of e_co_buy)
+def res_buy_step_rule(m, tm, sit, com, com_type):
+    return (0, _bound(m.commodity_dict['maxperstep'][sit, com, com_type]))
+
+# limit buy commodity use in total (scaled to annual consumption, thanks
+# to m.weight)
+def res_buy_total_rule(m, sit, com, com_type):
+    # calculate total sale of commodity com
+    total_consumption = 0
+    for tm in m.tm:
+        total_consumption += (
+            m.e_co_buy[tm, sit, com, com_type] * m.dt * m.period_weight[tm])
+    total_consumption *= m.weight
+    return (total_consumption <=
+            m.commodity_dict['max'][sit, com, com_type])
+
+# environmental commodity creation == - commodity_balance of that commodity
+# used for modelling emissions (e.g. CO2) or other end-of-pipe results of
+# any process activity;
+# limit environmental commodity output per time step
+def res_env_step_rule(m, tm, sit, com, com_type):
+    environmental_output = - commodity_balance(m, tm, sit, com)
+    return (environmental_output <=
+            m.commodity_dict['maxperstep'][sit, com, com_type])
+
+# limit environmental commodity output in total (scaled to annual
+# emissions, thanks to m.weight)
+def res_env_total_rule(m, sit, com, com_type):
+    # calculate total creation of environmental commodity com
+    env_output_sum = 0
+    for tm in m.tm:
+        env_output_sum += (- commodity_balance(m, tm, sit, com) * m.dt *
+                           m.period_weight[tm])
+    env_output_sum *= m.weight
+    return (env_output_sum <=
+            m.commodity_dict['max'][sit, com, com_type])
+
+# process
+# process capacity == new capacity + existing capacity
+def def_process_capacity_rule(m, sit, pro):
+    return (m.cap_pro[sit, pro] ==
+            m.cap_pro_new[sit, pro] +
+            m.process_dict['inst-cap'][sit, pro])
+
+# process input power == process throughput * input ratio
+def def_process_input_rule(m, tm, sit, pro, co):
+    return (m.e_pro_in[tm, sit, pro, co] ==
+            m.tau_pro[tm, sit, pro] * m.r_in_dict[pro, co])
+
+# process output power = process throughput * output ratio
+def def_process_output_rule(m, tm, sit, pro, co):
+    return (m.e_pro_out[tm, sit, pro, co] ==
+            m.tau_pro[tm, sit, pro] * m.r_out_dict[pro, co])
+
+# process input (for supim commodity) = process capacity * timeseries
+def def_intermittent_supply_rule(m, tm, sit, pro, coin):
+    if m.compact:
+        process_input = m.tau_pro[tm, sit, pro] * m.r_in_dict[pro, coin]
+    else:
+        process_input = m.e_pro_in[tm, sit, pro, coin]
+    return (process_input ==
+            m.cap_pro[sit, pro] * m.supim_dict[sit, coin][tm])
 
 # process throughput <= process capacity
 def res_process_throughput_by_capacity_rule(m, tm, sit, pro):
     return (m.tau_pro[tm, sit, pro] <= m.cap_pro[sit, pro])
 
-# lower bound <= process capacity <= upper bound
+# lower bound <= process capacity <= upper bound (variable bounds)
 def res_process_capacity_rule(m, sit, pro):
-    return (m.process.loc[sit, pro]['cap-lo'],
-            m.cap_pro[sit, pro],
-            m.process.loc[sit, pro]['cap-up'])
+    return (_bound(m.process_param[sit, pro, 'cap-lo']),
+            _bound(m.process_param[sit, pro, 'cap-up']))
 
 # power connection capacity: Sell == Buy
 def res_sell_buy_symmetry_rule(m, sit_in, pro_in, coin):
-# constraint only for sell and buy processes
-# and the processes musst be in the same site
-    if coin in m.com_buy:
-        sell_pro = search_sell_buy_tuple(m, sit_in, pro_in, coin)
-        if sell_pro is None:
-            return pyomo.Constraint.Skip
-        else:
-            return (m.cap_pro[sit_in, pro_in] ==
-                        m.cap_pro[sit_in, sell_pro])
-    else:
+# constraint only for buy processes (cf. m.pro_buy_tuples) that have a
+# matching sell process; the processes musst be in the same site
+    sell_pro = search_sell_buy_tuple(m, sit_in, pro_in, coin)
+    if sell_pro is None:
         return pyomo.Constraint.Skip
+    else:
+        return (m.cap_pro[sit_in, pro_in] ==
+                    m.cap_pro[sit_in, sell_pro])
 
 # transmission
 
@@ -741,24 +2505,23 @@ def res_sell_buy_symmetry_rule(m, sit_in, pro_in, coin):
 def def_transmission_capacity_rule(m, sin, sout, tra, com):
     return (m.cap_tra[sin, sout, tra, com] ==
             m.cap_tra_new[sin, sout, tra, com] +
-            m.transmission.loc[sin, sout, tra, com]['inst-cap'])
+            m.transmission_dict['inst-cap'][sin, sout, tra, com])
 
 # transmission output == transmission input * efficiency
 def def_transmission_output_rule(m, tm, sin, sout, tra, com):
     return (m.e_tra_out[tm, sin, sout, tra, com] ==
             m.e_tra_in[tm, sin, sout, tra, com] *
-            m.transmission.loc[sin, sout, tra, com]['eff'])
+            m.transmission_dict['eff'][sin, sout, tra, com])
 
 # transmission input <= transmission capacity
 def res_transmission_input_by_capacity_rule(m, tm, sin, sout, tra, com):
     return (m.e_tra_in[tm, sin, sout, tra, com] <=
-            m.cap_tra[sin, sout, tra, com])
+            m.cap_tra[m.tra_line[sin, sout, tra, com]])
 
-# lower bound <= transmission capacity <= upper bound
+# lower bound <= transmission capacity <= upper bound (variable bounds)
 def res_transmission_capacity_rule(m, sin, sout, tra, com):
-    return (m.transmission.loc[sin, sout, tra, com]['cap-lo'],
-            m.cap_tra[sin, sout, tra, com],
-            m.transmission.loc[sin, sout, tra, com]['cap-up'])
+    return (_bound(m.transmission_param[sin, sout, tra, com, 'cap-lo']),
+            _bound(m.transmission_param[sin, sout, tra, com, 'cap-up']))
 
 # transmission capacity from A to B == transmission capacity from B to A
 def res_transmission_symmetry_rule(m, sin, sout, tra, com):
@@ -773,21 +2536,21 @@ def def_storage_state_rule(m, t, sit, sto, com):
     return (m.e_sto_con[t, sit, sto, com] ==
             m.e_sto_con[t-1, sit, sto, com] +
             m.e_sto_in[t, sit, sto, com] *
-            m.storage.loc[sit, sto, com]['eff-in'] * m.dt -
+            m.storage_dict['eff-in'][sit, sto, com] * m.dt -
             m.e_sto_out[t, sit, sto, com] /
-            m.storage.loc[sit, sto, com]['eff-out'] * m.dt)
+            m.storage_dict['eff-out'][sit, sto, com] * m.dt)
 
 # storage power == new storage power + existing storage power
 def def_storage_power_rule(m, sit, sto, com):
     return (m.cap_sto_p[sit, sto, com] ==
             m.cap_sto_p_new[sit, sto, com] +
-            m.storage.loc[sit, sto, com]['inst-cap-p'])
+            m.storage_dict['inst-cap-p'][sit, sto, com])
 
 # storage capacity == new storage capacity + existing storage capacity
 def def_storage_capacity_rule(m, sit, sto, com):
     return (m.cap_sto_c[sit, sto, com] ==
             m.cap_sto_c_new[sit, sto, com] +
-            m.storage.loc[sit, sto, com]['inst-cap-c'])
+            m.storage_dict['inst-cap-c'][sit, sto, com])
 
 # storage input <= storage power
 def res_storage_input_by_power_rule(m, t, sit, sto, com):
@@ -801,30 +2564,98 @@ def res_storage_output_by_power_rule(m, t, sit, sto, co):
 def res_storage_state_by_capacity_rule(m, t, sit, sto, com):
     return m.e_sto_con[t, sit, sto, com] <= m.cap_sto_c[sit, sto, com]
 
-# lower bound <= storage power <= upper bound
+# lower bound <= storage power <= upper bound (variable bounds)
 def res_storage_power_rule(m, sit, sto, com):
-    return (m.storage.loc[sit, sto, com]['cap-lo-p'],
-            m.cap_sto_p[sit, sto, com],
-            m.storage.loc[sit, sto, com]['cap-up-p'])
+    return (_bound(m.storage_param[sit, sto, com, 'cap-lo-p']),
+            _bound(m.storage_param[sit, sto, com, 'cap-up-p']))
 
-# lower bound <= storage capacity <= upper bound
+# lower bound <= storage capacity <= upper bound (variable bounds)
 def res_storage_capacity_rule(m, sit, sto, com):
-    return (m.storage.loc[sit, sto, com]['cap-lo-c'],
-            m.cap_sto_c[sit, sto, com],
-            m.storage.loc[sit, sto, com]['cap-up-c'])
+    return (_bound(m.storage_param[sit, sto, com, 'cap-lo-c']),
+            _bound(m.storage_param[sit, sto, com, 'cap-up-c']))
 
 # initialization of storage content in first timestep t[1]
 # forced minimun  storage content in final timestep t[len(m.t)]
 # content[t=1] == storage capacity * fraction <= content[t=final]
+# (only defined for m.t_endpoints, i.e. the first and the last timestep)
 def res_initial_and_final_storage_state_rule(m, t, sit, sto, com):
     if t == m.t[1]:  # first timestep (Pyomo uses 1-based indexing)
         return (m.e_sto_con[t, sit, sto, com] ==
                 m.cap_sto_c[sit, sto, com] *
-                m.storage.loc[sit, sto, com]['init'])
-    elif t == m.t[len(m.t)]:  # last timestep
+                m.storage_dict['init'][sit, sto, com])
+    else:  # last timestep
         return (m.e_sto_con[t, sit, sto, com] >=
                 m.cap_sto_c[sit, sto, com] *
-                m.storage.loc[sit, sto, com]['init'])
+                m.storage_dict['init'][sit, sto, com])
+
+# typical periods: storage content at the boundary after original period i
+# == content at boundary i + net change over the typical period representing
+# original period i (content at its last minus its initial timestep)
+def def_storage_state_inter_rule(m, i, sit, sto, com):
+    if i == m.period_boundary[1]:
+        return pyomo.Constraint.Skip
+    period = m.period_order['period'].iloc[i - 1]
+    start = m.typical_periods['start'][period]
+    end = m.typical_periods['end'][period]
+    return (m.e_sto_con_inter[i, sit, sto, com] ==
+            m.e_sto_con_inter[i - 1, sit, sto, com] +
+            m.e_sto_con[end, sit, sto, com] -
+            m.e_sto_con[start, sit, sto, com])
+
+# storage content at period boundary <= storage capacity
+def res_storage_state_inter_by_capacity_rule(m, i, sit, sto, com):
+    return m.e_sto_con_inter[i, sit, sto, com] <= m.cap_sto_c[sit, sto, com]
+
+# typical periods: the storage content within original period i is the
+# content at boundary i-1 plus the content of the representing typical
+# period relative to its start. Its range within each typical period is
+# bounded by deviation variables e_sto_con_dev_max/min:
+# content[t] - content[start] <= max deviation
+def def_storage_dev_max_rule(m, t, sit, sto, com):
+    period = m.timestep_period[t]
+    start = m.typical_periods['start'][period]
+    return (m.e_sto_con[t, sit, sto, com] -
+            m.e_sto_con[start, sit, sto, com] <=
+            m.e_sto_con_dev_max[period, sit, sto, com])
+
+# content[t] - content[start] >= min deviation
+def def_storage_dev_min_rule(m, t, sit, sto, com):
+    period = m.timestep_period[t]
+    start = m.typical_periods['start'][period]
+    return (m.e_sto_con[t, sit, sto, com] -
+            m.e_sto_con[start, sit, sto, com] >=
+            m.e_sto_con_dev_min[period, sit, sto, com])
+
+# storage content within original period i <= storage capacity:
+# content at boundary i-1 + max deviation of its typical period <= capacity
+def res_storage_state_intra_max_rule(m, i, sit, sto, com):
+    if i == m.period_boundary[1]:
+        return pyomo.Constraint.Skip
+    period = m.period_order['period'].iloc[i - 1]
+    return (m.e_sto_con_inter[i - 1, sit, sto, com] +
+            m.e_sto_con_dev_max[period, sit, sto, com] <=
+            m.cap_sto_c[sit, sto, com])
+
+# storage content within original period i >= 0:
+# content at boundary i-1 + min deviation of its typical period >= 0
+def res_storage_state_intra_min_rule(m, i, sit, sto, com):
+    if i == m.period_boundary[1]:
+        return pyomo.Constraint.Skip
+    period = m.period_order['period'].iloc[i - 1]
+    return (m.e_sto_con_inter[i - 1, sit, sto, com] +
+            m.e_sto_con_dev_min[period, sit, sto, com] >= 0)
+
+# typical periods: initial and final storage content are set at the first
+# and last period boundary instead of the first and last timestep
+def res_initial_and_final_storage_state_inter_rule(m, i, sit, sto, com):
+    if i == m.period_boundary[1]:
+        return (m.e_sto_con_inter[i, sit, sto, com] ==
+                m.cap_sto_c[sit, sto, com] *
+                m.storage_dict['init'][sit, sto, com])
+    elif i == m.period_boundary[len(m.period_boundary)]:
+        return (m.e_sto_con_inter[i, sit, sto, com] >=
+                m.cap_sto_c[sit, sto, com] *
+                m.storage_dict['init'][sit, sto, com])
     else:
         return pyomo.Constraint.Skip
 
@@ -850,70 +2681,93 @@ def def_costs_rule(m, cost_type):
     if cost_type == 'Inv':
         return m.costs['Inv'] == \
             sum(m.cap_pro_new[p] *
-                m.process.loc[p]['inv-cost'] *
-                m.process.loc[p]['annuity-factor']
+                m.process_param[p + ('inv-cost',)] *
+                m.process_dict['annuity-factor'][p]
                 for p in m.pro_tuples) + \
-            sum(m.cap_tra_new[t] *
-                m.transmission.loc[t]['inv-cost'] *
-                m.transmission.loc[t]['annuity-factor']
+            sum(m.cap_tra_new[m.tra_line[t]] *
+                m.transmission_param[t + ('inv-cost',)] *
+                m.transmission_dict['annuity-factor'][t]
                 for t in m.tra_tuples) + \
             sum(m.cap_sto_p_new[s] *
-                m.storage.loc[s]['inv-cost-p'] *
-                m.storage.loc[s]['annuity-factor'] +
+                m.storage_param[s + ('inv-cost-p',)] *
+                m.storage_dict['annuity-factor'][s] +
                 m.cap_sto_c_new[s] *
-                m.storage.loc[s]['inv-cost-c'] *
-                m.storage.loc[s]['annuity-factor']
+                m.storage_param[s + ('inv-cost-c',)] *
+                m.storage_dict['annuity-factor'][s]
                 for s in m.sto_tuples)
 
     elif cost_type == 'Fix':
         return m.costs['Fix'] == \
-            sum(m.cap_pro[p] * m.process.loc[p]['fix-cost']
+            sum(m.cap_pro[p] * m.process_param[p + ('fix-cost',)]
                 for p in m.pro_tuples) + \
-            sum(m.cap_tra[t] * m.transmission.loc[t]['fix-cost']
+            sum(m.cap_tra[m.tra_line[t]] *
+                m.transmission_param[t + ('fix-cost',)]
                 for t in m.tra_tuples) + \
-            sum(m.cap_sto_p[s] * m.storage.loc[s]['fix-cost-p'] +
-                m.cap_sto_c[s] * m.storage.loc[s]['fix-cost-c']
+            sum(m.cap_sto_p[s] * m.storage_param[s + ('fix-cost-p',)] +
+                m.cap_sto_c[s] * m.storage_param[s + ('fix-cost-c',)]
                 for s in m.sto_tuples)
 
-    elif cost_type == 'Var':
-        return m.costs['Var'] == \
+    elif cost_type in ('Var', 'Fuel', 'Revenue', 'Purchase'):
+        return m.costs[cost_type] == \
+            m.weight * variable_costs(m, cost_type, m.tm)
+
+    else:
+        raise NotImplementedError("Unknown cost type.")
+
+def variable_costs(m, cost_type, timesteps):
+    """Sum of time-dependent costs of one cost type over given timesteps.
+
+    Not yet scaled by m.weight. Used by def_costs_rule for all modelled
+    timesteps, and by rolling_horizon to evaluate the costs of the retained
+    timesteps of a solved window.
+
+    Args:
+        m: urbs model object or instance
+        cost_type: 'Var', 'Fuel', 'Revenue' or 'Purchase'
+        timesteps: iterable of modelled timesteps (subset of m.tm)
+
+    Returns:
+        a Pyomo expression
+    """
+    if cost_type == 'Var':
+        return \
             sum(m.tau_pro[(tm,) + p] * m.dt *
-                m.process.loc[p]['var-cost'] *
-                m.weight
-                for tm in m.tm for p in m.pro_tuples) + \
+                m.process_param[p + ('var-cost',)] *
+                m.period_weight[tm]
+                for tm in timesteps for p in m.pro_tuples) + \
             sum(m.e_tra_in[(tm,) + t] * m.dt *
-                m.transmission.loc[t]['var-cost'] *
-                m.weight
-                for tm in m.tm for t in m.tra_tuples) + \
-            sum(m.e_sto_con[(tm,) + s] *
-                m.storage.loc[s]['var-cost-c'] * m.weight +
-                (m.e_sto_in[(tm,) + s] + m.e_sto_out[(tm,) + s]) * m.dt *
-                m.storage.loc[s]['var-cost-p'] * m.weight
-                for tm in m.tm for s in m.sto_tuples)
+                m.transmission_param[t + ('var-cost',)] *
+                m.period_weight[tm]
+                for tm in timesteps for t in m.tra_tuples) + \
+            sum((m.e_sto_con[(tm,) + s] *
+                 m.storage_param[s + ('var-cost-c',)] +
+                 (m.e_sto_in[(tm,) + s] + m.e_sto_out[(tm,) + s]) * m.dt *
+                 m.storage_param[s + ('var-cost-p',)]) *
+                m.period_weight[tm]
+                for tm in timesteps for s in m.sto_tuples)
 
     elif cost_type == 'Fuel':
-        return m.costs['Fuel'] == sum(
+        return sum(
             m.e_co_stock[(tm,) + c] * m.dt *
-            m.commodity.loc[c]['price'] *
-            m.weight
-            for tm in m.tm for c in m.com_tuples
-            if c[1] in m.com_stock)
+            m.commodity_param[c + ('price',)] *
+            m.period_weight[tm]
+            for tm in timesteps for c in m.stock_tuples)
 
     elif cost_type == 'Revenue':
-        sell_tuples = commodity_subset(m.com_tuples, m.com_sell)
-        com_prices = get_com_price(m, sell_tuples)
+        com_prices = get_com_price(m, m.sell_tuples)
 
-        return m.costs['Revenue'] == -sum(
-            m.e_co_sell[(tm,) + c] * com_prices[c].loc[tm] * m.weight * m.dt
-            for tm in m.tm for c in sell_tuples)
+        return -sum(
+            m.e_co_sell[(tm,) + c] * com_prices[c][tm] * m.dt *
+            m.period_weight[tm]
+            for tm in timesteps for c in m.sell_tuples)
 
     elif cost_type == 'Purchase':
-        buy_tuples = commodity_subset(m.com_tuples, m.com_buy)
-        com_prices = get_com_price(m, buy_tuples)
+        com_prices = get_com_price(m, m.buy_tuples)
 
-        return m.costs['Purchase'] == sum(
-            m.e_co_buy[(tm,) + c] * com_prices[c].loc[tm] * m.weight * m.dt
-            for tm in m.tm for c in buy_tuples)
+        return sum(
+            m.e_co_buy[(tm,) + c] * com_prices[c][tm] * m.dt *
+            m.period_weight[tm]
+            for tm in timesteps for c in m.buy_tuples)
 
     else:
         raise NotImplementedError("Unknown cost type.")
@@ -946,6 +2800,10 @@ def add_hacks(model, hacks):
 
     # only add constraint if limit is finite
     if not math.isinf(global_co2_limit):
+        model.global_co2_limit = pyomo.Param(
+            initialize=global_co2_limit,
+            mutable=True,
+            doc='Global CO2 limit (t/a)')
         model.res_global_co2_limit = pyomo.Constraint(
             rule=res_global_co2_limit_rule,
             doc='total co2 commodity output <= hacks.Glocal CO2 limit')
@@ -959,11 +2817,22 @@ def res_global_co2_limit_rule(m):
         for sit in m.sit:
             # minus because negative commodity_balance represents creation of 
             # that commodity.
-            co2_output_sum += (- commodity_balance(m, tm, sit, 'CO2') * m.dt)
+            co2_output_sum += (- commodity_balance(m, tm, sit, 'CO2') *
+                               m.dt * m.period_weight[tm])
 
     # scaling to annual output (cf. definition of m.weight)
     co2_output_sum *= m.weight
-    return (co2_output_sum <= m.hacks.loc['Global CO2 limit', 'Value'])
+    return (co2_output_sum <= m.global_co2_limit)
+
+# rolling horizon: usage of an annual limit within a window, extrapolated to
+# all remaining timesteps <= remaining annual limit
+def res_window_limit_rule(m, limit):
+    name, index, share, remaining = m.window_limits[limit]
+    usage = annual_usage(m, name, index, m.tm)
+    if isinstance(usage, (int, float)):
+        # limited commodity not modelled in this window
+        return pyomo.Constraint.Skip
+    return share * usage <= remaining
 
 # Helper functions
 
@@ -980,56 +2849,422 @@ def annuity_factor(n, i):
         i: interest rate (percent, e.g. 0.06 means 6 %)
 
     Returns:
-        Value of the expression :math:`\\frac{(1+i)^n i}{(1+i)^n - 1}`
+        Value of the expression :math:`\\frac{(1+i)^n i}{(1+i)^n - 1}`
+
+    Example:
+        >>> round(annuity_factor(20, 0.07), 5)
+        0.09439
+
+    """
+    return (1+i)**n * i / ((1+i)**n - 1)
+
+
+def commodity_balance(m, tm, sit, com):
+    """Calculate commodity balance at given timestep.
+
+    For a given commodity co and timestep tm, calculate the balance of
+    consumed (to process/storage/transmission, counts positive) and provided
+    (from process/storage/transmission, counts negative) power. Used as helper
+    function in create_model for constraints on demand and stock commodities.
+
+    Args:
+        m: the model object
+        tm: the timestep
+        site: the site
+        com: the commodity
+
+    Returns
+        balance: net value of consumed (positive) or provided (negative) power
+
+    """
+    balance = 0
+    try:
+        incidence = m.com_incidence[sit, com]
+    except KeyError:
+        # commodity is neither consumed nor provided at that site
+        return balance
+
+    if m.compact:
+        # process inputs/outputs are throughput * ratio, cf. create_model
+        for site, pro, co in incidence['pro_in']:
+            balance += m.tau_pro[tm, site, pro] * m.r_in_dict[pro, co]
+        for site, pro, co in incidence['pro_out']:
+            balance -= m.tau_pro[tm, site, pro] * m.r_out_dict[pro, co]
+    else:
+        for process in incidence['pro_in']:
+            # usage as input for process increases balance
+            balance += m.e_pro_in[(tm,) + process]
+        for process in incidence['pro_out']:
+            # output from processes decreases balance
+            balance -= m.e_pro_out[(tm,) + process]
+    for transmission in incidence['tra_in']:
+        # exports increase balance
+        balance += m.e_tra_in[(tm,) + transmission]
+    for transmission in incidence['tra_out']:
+        # imports decrease balance
+        balance -= m.e_tra_out[(tm,) + transmission]
+    for storage in incidence['sto']:
+        # usage as input for storage increases consumption
+        # output from storage decreases consumption
+        balance += m.e_sto_in[(tm,) + storage]
+        balance -= m.e_sto_out[(tm,) + storage]
+    return balance
+
+
+def annual_limits(data):
+    """Return the finite annual limits of given input.
+
+    Args:
+        data: input dict as returned by read_excel
+
+    Returns:
+        list of (constraint name, index, limit) tuples, cf. ANNUAL_LIMITS;
+        index is the (site, commodity, type) tuple of the commodity, or None
+        for the global CO2 limit
+    """
+    names = dict((com_type, name)
+                 for name, (com_type, tuples, var) in ANNUAL_LIMITS.items()
+                 if com_type)
+    limits = []
+    for index, limit in data['commodity']['max'].iteritems():
+        name = names.get(index[2])
+        if name and not pd.isnull(limit) and not math.isinf(limit):
+            limits.append((name, index, limit))
+    try:
+        global_co2_limit = data['hacks'].loc['Global CO2 limit', 'Value']
+    except KeyError:
+        global_co2_limit = float('inf')
+    if not math.isinf(global_co2_limit):
+        limits.append(('res_global_co2_limit', None, global_co2_limit))
+    return limits
+
+
+def annual_usage(m, name, index, timesteps):
+    """Return the sum over timesteps an annual limit applies to.
+
+    Like variable_costs, the sum is not yet scaled by m.weight.
+
+    Args:
+        m: the model object
+        name: constraint name of the limit, a key of ANNUAL_LIMITS
+        index: (site, commodity, type) tuple, None for res_global_co2_limit
+        timesteps: list of modelled timesteps to sum over
+
+    Returns:
+        an expression, or 0 if the commodity is not modelled (e.g. pruned)
+    """
+    com_type, tuples, var = ANNUAL_LIMITS[name]
+    if name == 'res_global_co2_limit':
+        # minus because negative commodity_balance represents creation
+        return sum(- commodity_balance(m, tm, sit, 'CO2') *
+                   m.dt * m.period_weight[tm]
+                   for tm in timesteps for sit in m.sit)
+    if index not in getattr(m, tuples):
+        return 0
+    if var is None:
+        sit, com, com_type = index
+        return sum(- commodity_balance(m, tm, sit, com) *
+                   m.dt * m.period_weight[tm] for tm in timesteps)
+    var = getattr(m, var)
+    return sum(var[(tm,) + index] * m.dt * m.period_weight[tm]
+               for tm in timesteps)
+
+
+def _check_optimal(result, description):
+    """Raise ValueError if a solver result is not optimal.
+
+    Args:
+        result: a solver result, e.g. SolverFactory('glpk').solve(prob)
+        description: what was solved, for the error message
+    """
+    from coopr.opt import TerminationCondition
+    condition = result.solver.termination_condition
+    if condition != TerminationCondition.optimal:
+        raise ValueError("{} was not solved to optimality (termination "
+                         "condition: {}).".format(description, condition))
+
+
+def mutable_values(table, keys, attributes):
+    """Initial values of a mutable parameter from a parameter lookup table.
+
+    Args:
+        table: a parameter lookup table like m.process_dict, i.e. a dict of
+            dicts {attribute: {key: value}}
+        keys: list of index tuples, e.g. m.pro_tuples
+        attributes: list of attribute names, e.g. ['cap-lo', 'cap-up']
+
+    Returns:
+        a dict {key + (attribute,): value} for all keys and attributes
+
+    Example:
+        >>> mutable_values({'cap-up': {('Mid', 'PV'): 10}}, [('Mid', 'PV')],
+        ...                ['cap-up'])
+        {('Mid', 'PV', 'cap-up'): 10}
+    """
+    return dict((key + (attr,), table[attr][key])
+                for key in keys for attr in attributes)
+
+
+def _bound(value):
+    """Return value as a variable bound: a number or None if unbounded."""
+    value = pyomo.value(value)
+    if math.isinf(value):
+        return None
+    return value
+
+
+def commodity_incidence(pro_input_tuples, pro_output_tuples, tra_tuples,
+                        sto_tuples):
+    """Map each (site, commodity) to the tuples that consume or provide it.
+
+    Builds the index used by commodity_balance once upon model creation, so
+    that the balance expression of a (site, commodity) can be assembled
+    directly from the process, transmission and storage tuples touching it.
+
+    Args:
+        pro_input_tuples: list of (site, process, commodity) process inputs
+        pro_output_tuples: list of (site, process, commodity) process outputs
+        tra_tuples: list of (site in, site out, transmission, commodity)
+        sto_tuples: list of (site, storage, commodity) tuples
+
+    Returns:
+        a dict with (site, commodity) keys and dicts as values. These have the
+        keys 'pro_in', 'pro_out', 'tra_in', 'tra_out' and 'sto', each holding a
+        list of the index tuples (minus timestep) of the matching variables.
+
+    Example:
+        >>> inc = commodity_incidence([('Mid', 'Gas plant', 'Gas')],
+        ...                           [('Mid', 'Gas plant', 'Elec')],
+        ...                           [('Mid', 'North', 'hvac', 'Elec')], [])
+        >>> inc['Mid', 'Elec']['pro_out']
+        [('Mid', 'Gas plant', 'Elec')]
+        >>> inc['North', 'Elec']['tra_out']
+        [('Mid', 'North', 'hvac', 'Elec')]
+    """
+    incidence = {}
+
+    def entry(sit, com):
+        try:
+            return incidence[sit, com]
+        except KeyError:
+            incidence[sit, com] = {'pro_in': [], 'pro_out': [],
+                                   'tra_in': [], 'tra_out': [], 'sto': []}
+            return incidence[sit, com]
+
+    for sit, pro, com in pro_input_tuples:
+        entry(sit, com)['pro_in'].append((sit, pro, com))
+    for sit, pro, com in pro_output_tuples:
+        entry(sit, com)['pro_out'].append((sit, pro, com))
+    for sin, sout, tra, com in tra_tuples:
+        entry(sin, com)['tra_in'].append((sin, sout, tra, com))
+        entry(sout, com)['tra_out'].append((sin, sout, tra, com))
+    for sit, sto, com in sto_tuples:
+        entry(sit, com)['sto'].append((sit, sto, com))
+    return incidence
+
+
+def transmission_lines(transmission_dict, tra_tuples, undirected):
+    """Map each transmission tuple to the index of its capacity variable.
+
+    If undirected, both directions of a line share one capacity, indexed by
+    the direction whose tuple comes first in sort order. Otherwise, each
+    direction has a capacity of its own.
+
+    Args:
+        transmission_dict: transmission lookup table like m.transmission_dict
+        tra_tuples: list of (site in, site out, transmission, commodity)
+        undirected: whether both directions share one capacity
+
+    Returns:
+        a dict {transmission tuple: capacity tuple}
 
-    Example:
-        >>> round(annuity_factor(20, 0.07), 5)
-        0.09439
+    Raises:
+        ValueError: if undirected and a transmission has no reverse
+            direction or differs from it in inst-cap, cap-lo or cap-up
 
+    Example:
+        >>> line = {('Mid', 'North', 'hvac', 'Elec'): 0,
+        ...         ('North', 'Mid', 'hvac', 'Elec'): 0}
+        >>> tra = {'inst-cap': line, 'cap-lo': line, 'cap-up': line}
+        >>> lines = transmission_lines(tra, list(line), True)
+        >>> lines['North', 'Mid', 'hvac', 'Elec']
+        ('Mid', 'North', 'hvac', 'Elec')
     """
-    return (1+i)**n * i / ((1+i)**n - 1)
+    lines = dict((t, t) for t in tra_tuples)
+    if not undirected:
+        return lines
+
+    for sin, sout, tra, com in tra_tuples:
+        reverse = (sout, sin, tra, com)
+        if reverse not in lines:
+            raise ValueError("Transmission {} has no reverse direction, "
+                             "cannot model it undirected.".format(
+                                 (sin, sout, tra, com)))
+        for attr in ['inst-cap', 'cap-lo', 'cap-up']:
+            if (transmission_dict[attr][sin, sout, tra, com] !=
+                    transmission_dict[attr][reverse]):
+                raise ValueError("Transmission {} differs from its reverse "
+                                 "direction in {}, cannot model it "
+                                 "undirected.".format((sin, sout, tra, com),
+                                                      attr))
+        lines[sin, sout, tra, com] = min((sin, sout, tra, com), reverse)
+    return lines
+
+
+def aggregate_timeseries(data, n_periods, period_length=24, timesteps=None):
+    """Reduce input timeseries to typical periods.
+
+    Splits the timesteps into consecutive periods of equal length (e.g. days),
+    clusters these periods by their normalized Demand, SupIm and
+    Buy-Sell-Price profiles (k-medoids) and keeps one representative period
+    (the medoid) per cluster. A model created from the result only contains
+    the representative periods. Costs and emissions are weighted by the number
+    of original periods each representative stands for, and storage content
+    is linked across the original sequence of periods, so that seasonal
+    storage is still possible. Within each original period, the storage
+    content (at the preceding period boundary plus the change since the
+    start of the typical period) stays between 0 and the storage capacity.
 
+    Args:
+        data: input dict as returned by read_excel
+        n_periods: number of typical periods
+        period_length: timesteps per period (default: 24, i.e. days)
+        timesteps: optional list of timesteps to aggregate, default: all
+            timesteps of the demand timeseries except the first one (which
+            is the initialisation timestep in create_model)
 
-def commodity_balance(m, tm, sit, com):
-    """Calculate commodity balance at given timestep.
+    Returns:
+        a copy of data, with the timeseries replaced by the representative
+        periods. Each period is preceded by an initialisation timestep, so
+        that period k covers timesteps k*(period_length+1) to
+        k*(period_length+1)+period_length. Two DataFrames are added:
+        'typical_periods' with the 'weight' (number of original periods),
+        first and last timestep ('start', 'end') and the first original
+        timestep ('first') of each period; and 'period_order' with the
+        'period' that represents each original period, and its 'first'
+        original timestep.
 
-    For a given commodity co and timestep tm, calculate the balance of
-    consumed (to process/storage/transmission, counts positive) and provided
-    (from process/storage/transmission, counts negative) power. Used as helper
-    function in create_model for constraints on demand and stock commodities.
+    Example:
+        >>> data = read_excel('mimo-example.xlsx')
+        >>> data = aggregate_timeseries(data, 12)
+        >>> data['typical_periods']['weight'].sum()
+        365
+
+        The highest storage content within an original period reaches, but
+        does not exceed, the storage capacity:
+
+        >>> import coopr.environ
+        >>> from coopr.opt.base import SolverFactory
+        >>> prob = create_model(aggregate_timeseries(
+        ...     read_excel('mimo-example.xlsx'), 6)).create()
+        >>> prob.load(SolverFactory('glpk').solve(prob))
+        True
+        >>> cap = get_entity(prob, 'cap_sto_c')['cap_sto_c']
+        >>> inter = get_entity(prob, 'e_sto_con_inter')['e_sto_con_inter']
+        >>> dev = get_entity(prob, 'e_sto_con_dev_max')['e_sto_con_dev_max']
+        >>> slack = [cap[s] - inter[(i,) + s] - dev[(period,) + s]
+        ...          for s in cap.index for i, period
+        ...          in enumerate(prob.period_order['period'])]
+        >>> abs(min(slack)) < 1e-3
+        True
+    """
+    if timesteps is None:
+        timesteps = data['demand'].index.tolist()[1:]
+    timesteps = list(timesteps)
+    n_original = len(timesteps) // period_length
+    timesteps = timesteps[:n_original * period_length]
+
+    # feature matrix: one row per original period, containing the profiles
+    # of all timeseries, each normalized by its maximum absolute value
+    timeseries = ['demand', 'supim', 'buy_sell_price']
+    features = []
+    for key in timeseries:
+        for col in data[key].columns:
+            values = data[key].loc[timesteps, col].values.astype(float)
+            scale = abs(values).max()
+            if scale > 0:
+                values = values / scale
+            features.append(values.reshape(n_original, period_length))
+    features = np.hstack(features)
+
+    medoids, labels = k_medoids(features, n_periods)
+
+    # representative timeseries, each period preceded by an init timestep
+    index = pd.Index(range(len(medoids) * (period_length + 1)), name='t')
+    aggregated = dict(data)
+    for key in timeseries:
+        blocks = []
+        for medoid in medoids:
+            period = timesteps[medoid * period_length:
+                               (medoid + 1) * period_length]
+            blocks.append(data[key].loc[period[:1] + period].values)
+        aggregated[key] = pd.DataFrame(np.vstack(blocks), index=index,
+                                       columns=data[key].columns)
+
+    starts = [k * (period_length + 1) for k in range(len(medoids))]
+    aggregated['typical_periods'] = pd.DataFrame(
+        {'weight': np.bincount(labels, minlength=len(medoids)),
+         'start': starts,
+         'end': [start + period_length for start in starts],
+         'first': [timesteps[medoid * period_length] for medoid in medoids]},
+        index=pd.Index(range(len(medoids)), name='period'),
+        columns=['weight', 'start', 'end', 'first'])
+    aggregated['period_order'] = pd.DataFrame(
+        {'period': labels,
+         'first': timesteps[::period_length]},
+        index=pd.Index(range(n_original), name='original period'),
+        columns=['period', 'first'])
+    return aggregated
+
+
+def k_medoids(features, k, max_iter=100):
+    """Cluster rows of a feature matrix with the k-medoids algorithm.
+
+    Uses a deterministic farthest-point initialisation, followed by
+    alternating assignment and medoid update steps until the medoids no
+    longer change.
 
     Args:
-        m: the model object
-        tm: the timestep
-        site: the site
-        com: the commodity
+        features: a 2D numpy array, one row per object
+        k: number of clusters; fewer are returned if there are fewer distinct
+            rows
+        max_iter: maximum number of iterations (default: 100)
 
-    Returns
-        balance: net value of consumed (positive) or provided (negative) power
+    Returns:
+        (medoids, labels) tuple: list of row numbers of the cluster medoids
+        and array of cluster numbers (0 to len(medoids)-1) for each row
 
+    Example:
+        >>> features = np.array([[0.], [0.1], [1.], [1.2], [5.]])
+        >>> k_medoids(features, 2)
+        ([2, 4], array([0, 0, 0, 0, 1]))
     """
-    balance = 0
-    for site, process in m.pro_tuples:
-        if site == sit and com in m.r_in.loc[process].index:
-            # usage as input for process increases balance
-            balance += m.e_pro_in[(tm, site, process, com)]
-        if site == sit and com in m.r_out.loc[process].index:
-            # output from processes decreases balance
-            balance -= m.e_pro_out[(tm, site, process, com)]
-    for site_in, site_out, transmission, commodity in m.tra_tuples:
-        # exports increase balance
-        if site_in == sit and commodity == com:
-            balance += m.e_tra_in[(tm, site_in, site_out, transmission, com)]
-        # imports decrease balance
-        if site_out == sit and commodity == com:
-            balance -= m.e_tra_out[(tm, site_in, site_out, transmission, com)]
-    for site, storage, commodity in m.sto_tuples:
-        # usage as input for storage increases consumption
-        # output from storage decreases consumption
-        if site == sit and commodity == com:
-            balance += m.e_sto_in[(tm, site, storage, com)]
-            balance -= m.e_sto_out[(tm, site, storage, com)]
-    return balance
+    # squared euclidean distance between all pairs of rows
+    squares = (features ** 2).sum(axis=1)
+    distance = squares[:, np.newaxis] + squares - 2 * features.dot(features.T)
+    distance = np.maximum(distance, 0)
+
+    # initialisation: start with the most central row, then repeatedly add
+    # the row farthest from all medoids chosen so far
+    medoids = [int(distance.sum(axis=1).argmin())]
+    while len(medoids) < min(k, len(features)):
+        nearest = distance[:, medoids].min(axis=1)
+        if nearest.max() == 0:
+            break
+        medoids.append(int(nearest.argmax()))
+
+    for iteration in range(max_iter):
+        labels = distance[:, medoids].argmin(axis=1)
+        new_medoids = []
+        for cluster in range(len(medoids)):
+            members = np.flatnonzero(labels == cluster)
+            cost = distance[np.ix_(members, members)].sum(axis=1)
+            new_medoids.append(int(members[cost.argmin()]))
+        if new_medoids == medoids:
+            break
+        medoids = new_medoids
+    labels = distance[:, medoids].argmin(axis=1)
+    return medoids, labels
 
 
 def split_columns(columns, sep='.'):
@@ -1082,24 +3317,24 @@ def get_com_price(instance, tuples):
         tuples: a list of (site, commodity, commodity type) tuples
 
     Returns:
-        a Pandas DataFrame with entities as columns and timesteps as index
+        a dict with the tuples as keys and dicts {timestep: price} as values
     """
-    com_price = pd.DataFrame(index=instance.tm)
+    com_price = {}
     for c in tuples:
         # check commodity price: fix or has a timeseries
-        # type(instance.commodity.loc[c]['price']):
+        # type(instance.commodity_dict['price'][c]):
         # float => fix: com price = 0.15
         # string => var: com price = '1.25xBuy' (Buy: refers to timeseries)
-        if not isinstance(instance.commodity.loc[c]['price'], float):
+        if not isinstance(instance.commodity_dict['price'][c], float):
             # a different commodity price for each hour
             # factor, to realize a different commodity price for each site
-            factor = extract_number_str(instance.commodity.loc[c]['price'])
-            price = factor * instance.buy_sell_price.loc[(instance.tm,) + (c[1],)]
-            com_price[c] = pd.Series(price, index=com_price.index)
+            factor = extract_number_str(instance.commodity_dict['price'][c])
+            price = instance.buy_sell_price_dict[c[1]]
+            com_price[c] = dict((tm, factor * price[tm]) for tm in instance.tm)
         else:
             # same commdoity price for each hour
-            price = instance.commodity.loc[c]['price']
-            com_price[c] = pd.Series(price, index=com_price.index)
+            price = instance.commodity_dict['price'][c]
+            com_price[c] = dict.fromkeys(instance.tm, price)
     return com_price
 
 def extract_number_str(str_in):
@@ -1175,17 +3410,103 @@ def search_sell_buy_tuple(instance, sit_in, pro_in, coin):
             return sell_pro
     return None
 
+class ResultSet(object):
+    """Result values of a urbs model, detached from the model instance.
+
+    Holds a DataFrame per entity, as returned by get_entity, and the inputs
+    needed for reporting (e.g. demand) as attributes. get_entity, and thereby
+    all functions that retrieve results (get_constants, get_timeseries,
+    report, plot), accept a ResultSet in place of a model instance.
+
+    Args:
+        entities: dict of entity name: DataFrame like returned by get_entity
+        duals: optional dict of constraint name: DataFrame like returned by
+            get_dual
+        **attributes: e.g. demand=data['demand'], com_demand, sit
+    """
+    def __init__(self, entities, duals=None, **attributes):
+        self.entities = entities
+        self.duals = duals if duals is not None else {}
+        self.__dict__.update(attributes)
+
+
+def load_result(prob, result):
+    """Load a solver result into a model instance and cache its values.
+
+    Converts all variables to DataFrames once. get_entity, and thereby
+    get_entities, get_constants, get_timeseries, report and plot, then read
+    from the cache (prob.result_cache), which also keeps all other entities
+    once they are retrieved. update_model clears the cache.
+
+    Args:
+        prob: a urbs model instance
+        result: a solver result, e.g. SolverFactory('glpk').solve(prob)
+
+    Returns:
+        prob, with the result loaded
+    """
+    prob.load(result)
+    prob.result_cache = {}
+    for name in list_entities(prob, 'var').index:
+        get_entity(prob, name)
+    return prob
+
+
 def get_entity(instance, name):
     """ Return a DataFrame for an entity in model instance.
 
+    For a ResultSet, the DataFrame held by it is returned, not a copy, so
+    that the values of a loaded result archive stay memory mapped. Likewise,
+    for an instance with a result cache (cf. load_result), the cached
+    DataFrame is returned. In both cases, the DataFrame is read-only: callers
+    must not modify it in place, but copy it first.
+
     Args:
-        instance: a Pyomo ConcreteModel instance
+        instance: a Pyomo ConcreteModel instance or a ResultSet
         name: name of a Set, Param, Var, Constraint or Objective
 
     Returns:
         a single-columned Pandas DataFrame with domain as index
     """
 
+    # results detached from a model instance are stored ready-made
+    if isinstance(instance, ResultSet):
+        return instance.entities[name]
+
+    # results loaded by load_result are converted only once
+    cache = getattr(instance, 'result_cache', None)
+    if cache is None:
+        return _get_entity(instance, name)
+    if name not in cache:
+        cache[name] = _get_entity(instance, name)
+    return cache[name]
+
+
+def _get_entity(instance, name):
+    """Return a DataFrame for an entity in model instance, uncached."""
+
+    # process inputs/outputs of a compact model are derived from tau_pro
+    if (name in ('e_pro_in', 'e_pro_out') and
+            getattr(instance, 'compact', False)):
+        return _get_process_flows(instance, name)
+
+    # undirected transmission capacities are reported for both directions
+    if (name in ('cap_tra', 'cap_tra_new') and
+            getattr(instance, 'undirected', False)):
+        var = getattr(instance, name)
+        return _entity_frame(
+            [t + (var[instance.tra_line[t]].value,)
+             for t in instance.tra_tuples],
+            _get_onset_names(var), name)
+
+    # constraints implemented as variable bounds: value of the variable
+    if name in BOUND_CONSTRAINTS:
+        var = getattr(instance, BOUND_CONSTRAINTS[name][0])
+        return _entity_frame(
+            [index + (var[index].value,)
+             for index in _bound_constraint_index(instance, name)],
+            _get_onset_names(var), name)
+
     # retrieve entity, its type and its onset names
     entity = instance.__getattribute__(name)
     labels = _get_onset_names(entity)
@@ -1208,6 +3529,19 @@ def get_entity(instance, name):
             results = pd.DataFrame([v[0]+(v[1],) for v in entity.iteritems()])
         else:
             results = pd.DataFrame(entity.iteritems())
+    elif isinstance(entity, pyomo.Var) and entity.dim() > 0:
+        # variables can be large, so build index and value column directly
+        # in one pass instead of a DataFrame of row tuples
+        if len(entity) == 0:
+            return pd.DataFrame()
+        index, data = zip(*entity.iteritems())
+        values = np.array([v.value for v in data], dtype=float)
+        labels = _unique_labels(labels)
+        if entity.dim() > 1:
+            index = pd.MultiIndex.from_tuples(index, names=labels)
+        else:
+            index = pd.Index(index, name=labels[0])
+        return pd.DataFrame({name: values}, index=index)
     else:
         # create DataFrame
         if entity.dim() > 1:
@@ -1220,11 +3554,13 @@ def get_entity(instance, name):
             results = pd.DataFrame(
                 [(v[0], v[1].value) for v in entity.iteritems()])
 
-    # check for duplicate onset names and append one to several "_" to make
-    # them unique, e.g. ['sit', 'sit', 'com'] becomes ['sit', 'sit_', 'com']
-    for k, label in enumerate(labels):
-        if label in labels[:k]:
-            labels[k] = labels[k] + "_"
+    return _entity_frame(results, labels, name)
+
+
+def _entity_frame(rows, labels, name):
+    """Return DataFrame of (index..., value) rows with labels as index."""
+    results = pd.DataFrame(rows)
+    labels = _unique_labels(labels)
 
     if not results.empty:
         # name columns according to labels + entity name
@@ -1234,6 +3570,102 @@ def get_entity(instance, name):
     return results
 
 
+def _unique_labels(labels):
+    """Return copy of onset names with duplicates made unique."""
+    # check for duplicate onset names and append one to several "_" to make
+    # them unique, e.g. ['sit', 'sit', 'com'] becomes ['sit', 'sit_', 'com']
+    labels = list(labels)
+    for k, label in enumerate(labels):
+        if label in labels[:k]:
+            labels[k] = labels[k] + "_"
+    return labels
+
+
+def _bound_constraint_index(instance, name):
+    """Return variable indices covered by a constraint in BOUND_CONSTRAINTS.
+
+    Time-dependent variables are indexed by timestep and the index tuples of
+    the variable, of which the constraint covers only those in its index set
+    (e.g. res_stock_step: only stock commodities).
+    """
+    var_name, tuples, lower = BOUND_CONSTRAINTS[name]
+    var = getattr(instance, var_name)
+    tuples = set(getattr(instance, tuples))
+    return [index for index in var
+            if index in tuples or index[1:] in tuples]
+
+
+def _get_process_flows(instance, name):
+    """Return e_pro_in or e_pro_out of a compact model like get_entity.
+
+    Calculates the values from the throughput tau_pro and the input or
+    output ratios, as these are not variables in a compact model.
+    """
+    if name == 'e_pro_in':
+        tuples, ratios = instance.pro_input_tuples, instance.r_in_dict
+    else:
+        tuples, ratios = instance.pro_output_tuples, instance.r_out_dict
+
+    flows = []
+    for tm in instance.tm:
+        for sit, pro, com in tuples:
+            throughput = instance.tau_pro[tm, sit, pro].value
+            if throughput is not None:
+                throughput *= ratios[pro, com]
+            flows.append((tm, sit, pro, com, throughput))
+    return _entity_frame(flows, ['t', 'sit', 'pro', 'com'], name)
+
+
+def get_dual(instance, name):
+    """Return the duals of a constraint like get_entity returns values.
+
+    The instance must be solved with an import suffix 'dual' and, for the
+    constraints in BOUND_CONSTRAINTS, 'rc' for the reduced costs:
+
+        >>> prob.dual = pyomo.Suffix(direction=pyomo.Suffix.IMPORT)
+        >>> prob.rc = pyomo.Suffix(direction=pyomo.Suffix.IMPORT)
+
+    As these constraints are variable bounds, their dual is the reduced cost
+    of the variable. It is zero if the variable is only at a bound that does
+    not belong to the constraint, e.g. e_co_stock = 0 for res_stock_step.
+
+    Like get_entity, returns the DataFrame of a ResultSet itself, which
+    callers must not modify in place.
+
+    Args:
+        instance: a solved Pyomo ConcreteModel instance or a ResultSet
+        name: name of a Constraint or of an entry in BOUND_CONSTRAINTS
+
+    Returns:
+        a single-columned Pandas DataFrame with domain as index
+    """
+    if isinstance(instance, ResultSet):
+        return instance.duals[name]
+
+    if name in BOUND_CONSTRAINTS:
+        var_name, tuples, lower = BOUND_CONSTRAINTS[name]
+        var = getattr(instance, var_name)
+        duals = []
+        for index in _bound_constraint_index(instance, name):
+            dual = instance.rc.getValue(var[index])
+            if dual is not None and not lower:
+                # positive reduced costs in a minimisation come from the
+                # lower bound 0 of the variable
+                dual = min(dual, 0)
+            duals.append(index + (dual,))
+        return _entity_frame(duals, _get_onset_names(var), name)
+
+    constraint = getattr(instance, name)
+    duals = []
+    for index in constraint:
+        dual = instance.dual.getValue(constraint[index])
+        if isinstance(index, tuple):
+            duals.append(index + (dual,))
+        else:
+            duals.append((index, dual))
+    return _entity_frame(duals, _get_onset_names(constraint), name)
+
+
 def get_entities(instance, names):
     """ Return one DataFrame with entities in columns and a common index.
 
@@ -1260,7 +3692,7 @@ def get_entities(instance, names):
             df = df.join(other, how='outer')
 
             if index_names_before != df.index.names:
-                df.index.names = index_names_before
+                df.index = df.index.set_names(index_names_before)
 
     return df
 
@@ -1408,13 +3840,23 @@ def get_constants(instance):
     csto = get_entities(instance, ['cap_sto_c', 'cap_sto_c_new',
                                    'cap_sto_p', 'cap_sto_p_new'])
 
+    # report entities left out by prune_tuples as zero
+    if getattr(instance, 'prune', False):
+        if not cpro.empty:
+            cpro = cpro.reindex(instance.process.index).fillna(0)
+        if not ctra.empty:
+            ctra = ctra.reindex(instance.transmission.index).fillna(0)
+        if not csto.empty:
+            csto = csto.reindex(instance.storage.index).fillna(0)
+
     # better labels and index names and return sorted
     if not cpro.empty:
-        cpro.index.names = ['Site', 'Process']
+        cpro.index = cpro.index.set_names(['Site', 'Process'])
         cpro.columns = ['Total', 'New']
         cpro.sortlevel(inplace=True)
     if not ctra.empty:
-        ctra.index.names = ['Site In', 'Site Out', 'Transmission', 'Commodity']
+        ctra.index = ctra.index.set_names(
+            ['Site In', 'Site Out', 'Transmission', 'Commodity'])
         ctra.columns = ['Total', 'New']
         ctra.sortlevel(inplace=True)
     if not csto.empty:
@@ -1424,7 +3866,115 @@ def get_constants(instance):
     return costs, cpro, ctra, csto
 
 
-def get_timeseries(instance, com, sit, timesteps=None):
+def get_balance(instance, timesteps=None):
+    """Return the energy balance of all commodities, sites and timesteps.
+
+    Computes all timeseries that get_timeseries returns for a single
+    (commodity, site) in one pass over the model results. Slicing the result
+    is much faster than calling get_timeseries for each pair on its own, so
+    report, plot and result_figures pass it on to get_timeseries.
+
+    Args:
+        instance: a urbs model instance
+        timesteps: optional list of timesteps, default: all modelled timesteps
+
+    Returns:
+        a Series with index levels com, sit, category, name and t. Categories
+        and names are (cf. get_timeseries):
+
+        * Created: processes (non-zero only), 'Stock'
+        * Consumed: processes (non-zero only), 'Demand'
+        * Storage: 'Level', 'Stored', 'Retrieved'
+        * Import from, Export to: the other site
+
+    Example:
+        >>> import coopr.environ
+        >>> from coopr.opt.base import SolverFactory
+        >>> data = read_excel('mimo-example.xlsx')
+        >>> prob = create_model(data, range(1, 25)).create()
+        >>> prob.load(SolverFactory('glpk').solve(prob))
+        True
+        >>> balance = get_balance(prob)
+        >>> len(balance.loc['Elec', 'Mid', 'Consumed', 'Demand'])
+        23
+    """
+    if timesteps is None:
+        # default to all simulated timesteps
+        timesteps = sorted(get_entity(instance, 'tm').index)
+
+    parts = []
+
+    # DEMAND
+    demand = instance.demand.loc[timesteps].unstack()
+    demand.index.names = ['sit', 'com', 't']
+    parts.append(_balance_part(demand, 'Consumed', 'Demand'))
+
+    # STOCK
+    eco = get_entity(instance, 'e_co_stock')['e_co_stock']
+    eco = eco[eco.index.get_level_values('com_type') == 'Stock']
+    eco.index = eco.index.droplevel('com_type')
+    eco.index.names = ['t', 'sit', 'com']
+    parts.append(_balance_part(eco, 'Created', 'Stock'))
+
+    # PROCESS
+    # only keep non-zero entries, so that unused processes get no column
+    for name, category in [('e_pro_out', 'Created'),
+                           ('e_pro_in', 'Consumed')]:
+        epro = get_entity(instance, name)[name]
+        epro = epro[epro > 0]
+        epro.index.names = ['t', 'sit', 'name', 'com']
+        parts.append(_balance_part(epro, category))
+
+    # TRANSMISSION
+    # sum over transmission types; imports by origin, exports by destination
+    etra = get_entities(instance, ['e_tra_in', 'e_tra_out'])
+    if not etra.empty:
+        etra.index = etra.index.set_names(
+            ['t', 'sitin', 'sitout', 'tra', 'com'])
+        etra = etra.groupby(level=['t', 'sitin', 'sitout', 'com']).sum()
+        imported = etra['e_tra_out']
+        imported.index.names = ['t', 'name', 'sit', 'com']
+        parts.append(_balance_part(imported, 'Import from'))
+        exported = etra['e_tra_in']
+        exported.index.names = ['t', 'sit', 'name', 'com']
+        parts.append(_balance_part(exported, 'Export to'))
+
+    # STORAGE
+    # sum over storage types
+    esto = get_entities(instance, ['e_sto_con', 'e_sto_in', 'e_sto_out'])
+    if not esto.empty:
+        esto = esto.groupby(level=['t', 'sit', 'com']).sum()
+        esto.columns = ['Level', 'Stored', 'Retrieved']
+        esto = esto.stack()
+        esto.index.names = ['t', 'sit', 'com', 'name']
+        parts.append(_balance_part(esto, 'Storage'))
+
+    balance = pd.concat(parts)
+    balance = balance[balance.index.get_level_values('t').isin(timesteps)]
+    balance.name = 'balance'
+    return balance.sort_index()
+
+
+def _balance_part(values, category, name=None):
+    """Return Series values re-indexed by com, sit, category, name, t.
+
+    values must have the index levels t, sit, com and, unless a constant
+    name is given, name.
+    """
+    index = values.index
+    if name is None:
+        names = index.get_level_values('name')
+    else:
+        names = [name] * len(values)
+    return pd.Series(
+        values.values,
+        index=pd.MultiIndex.from_arrays(
+            [index.get_level_values('com'), index.get_level_values('sit'),
+             [category] * len(values), names, index.get_level_values('t')],
+            names=['com', 'sit', 'category', 'name', 't']))
+
+
+def get_timeseries(instance, com, sit, timesteps=None, balance=None):
     """Return DataFrames of all timeseries referring to given commodity
 
     Usage:
@@ -1436,6 +3986,8 @@ def get_timeseries(instance, com, sit, timesteps=None):
         com: a commodity
         sit: a site
         timesteps: optional list of timesteps, defaults: all modelled timesteps
+        balance: optional result of get_balance to slice from, to save its
+            computation when called for several commodities or sites
 
     Returns:
         a (created, consumed, storage, imported, exported) tuple of DataFrames
@@ -1450,152 +4002,448 @@ def get_timeseries(instance, com, sit, timesteps=None):
     if timesteps is None:
         # default to all simulated timesteps
         timesteps = sorted(get_entity(instance, 'tm').index)
+    if balance is None:
+        balance = get_balance(instance, timesteps)
 
-    # DEMAND
-    # default to zeros if commodity has no demand, get timeseries
-    try:
-        demand = instance.demand.loc[timesteps][sit, com]
-    except KeyError:
-        demand = pd.Series(0, index=timesteps)
-    demand.name = 'Demand'
+    # select the desired commodity com and site sit and unstack each category
+    # to a DataFrame with one column per name, sliced to timesteps
+    def category(name):
+        try:
+            values = balance.loc[com, sit, name]
+        except KeyError:
+            return pd.DataFrame(index=timesteps)
+        values = values.unstack(level='name').reindex(timesteps)
+        values.columns.name = None
+        return values.fillna(0)
+
+    created = category('Created')
+    consumed = category('Consumed')
+    stored = category('Storage').reindex(
+        columns=['Level', 'Stored', 'Retrieved']).fillna(0)
+    imported = category('Import from')
+    exported = category('Export to')
+
+    # show stock as created, demand as consumed, each as last column
+    for frame, name in [(created, 'Stock'), (consumed, 'Demand')]:
+        if name in frame.columns:
+            frame[name] = frame.pop(name)
+        else:
+            frame[name] = 0
 
-    # STOCK
-    eco = get_entity(instance, 'e_co_stock')['e_co_stock'].unstack()['Stock']
-    eco = eco.xs(sit, level='sit').unstack().fillna(0)
-    try:
-        stock = eco.loc[timesteps][com]
-    except KeyError:
-        stock = pd.Series(0, index=timesteps)
-    stock.name = 'Stock'
+    return created, consumed, stored, imported, exported
 
-    # PROCESS
-    # select all entries of created and consumed desired commodity com and site
-    # sit. Keep only entries with non-zero values and unstack process column.
-    # Finally, slice to the desired timesteps.
-    epro = get_entities(instance, ['e_pro_in', 'e_pro_out'])
-    epro = epro.xs(sit, level='sit').xs(com, level='com')
-    try:
-        created = epro[epro['e_pro_out'] > 0]['e_pro_out'].unstack(level='pro')
-        created = created.loc[timesteps].fillna(0)
-    except KeyError:
-        created = pd.DataFrame(index=timesteps)
 
-    try:
-        consumed = epro[epro['e_pro_in'] > 0]['e_pro_in'].unstack(level='pro')
-        consumed = consumed.loc[timesteps].fillna(0)
-    except KeyError:
-        consumed = pd.DataFrame(index=timesteps)
+# abc.ABCMeta as metaclass, in both Python 2 and 3
+class ReportWriter(abc.ABCMeta('ReportWriterBase', (object,), {})):
+    """Abstract base class of the table writers of report.
 
-    # TRANSMISSION
-    etra = get_entities(instance, ['e_tra_in', 'e_tra_out'])
-    try:
-        etra.index.names = ['tm', 'sitin', 'sitout', 'tra', 'com']
-        etra = etra.groupby(level=['tm', 'sitin', 'sitout', 'com']).sum()
-        etra = etra.xs(com, level='com')
+    Each table passed to write is written right away, as one file, sheet or
+    group of its own, so that report keeps none of them in memory. The list
+    of tables (self.tables), in which a table can be put at any position,
+    gives the order of the tables upon close. A subclass implements _write
+    for its backend; subclasses for formats that export_report can read
+    also provide a class method read, which yields the written tables in
+    listed order. Usable as a context manager.
 
-        imported = etra.xs(sit, level='sitout')['e_tra_out'].unstack().fillna(0)
-        exported = etra.xs(sit, level='sitin')['e_tra_in'].unstack().fillna(0)
-        
-    except (ValueError, KeyError):
-        imported = pd.DataFrame(index=timesteps)
-        exported = pd.DataFrame(index=timesteps)
+    Args:
+        path: filename or directory to write to, depending on backend
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tables = []
+
+    def write(self, name, df, position=None):
+        """Write DataFrame df as table name.
+
+        Args:
+            name: table name
+            df: a DataFrame
+            position: optional position of the table in the list of
+                tables, default: last
+        """
+        self._write(name, df)
+        if position is None:
+            position = len(self.tables)
+        self.tables.insert(
+            position, (name, df.index.nlevels, df.columns.nlevels))
+
+    @abc.abstractmethod
+    def _write(self, name, df):
+        """Write DataFrame df as table name to the backend."""
+
+    def close(self):
+        pass
 
-    # STORAGE
-    # group storage energies by commodity
-    # select all entries with desired commodity co
-    esto = get_entities(instance, ['e_sto_con', 'e_sto_in', 'e_sto_out'])
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ExcelReportWriter(ReportWriter):
+    """Write tables to sheets of an Excel spreadsheet.
+
+    If xlsxwriter is installed and path ends with '.xlsx', the spreadsheet
+    is written in its constant_memory mode: each table is flushed to disk
+    row by row as it is written, so memory use does not grow with the
+    number of sheets. Otherwise, e.g. for '.xls' files, pandas' default
+    ExcelWriter for the extension is used. Either way, sheets have the
+    layout of to_excel:
+
+        >>> import openpyxl, shutil, tempfile
+        >>> df = pd.DataFrame(
+        ...     [[1.0, 2.0, 3.0], [4.0, None, 6.0]],
+        ...     index=pd.MultiIndex.from_tuples(
+        ...         [('Mid', 'Coal'), ('Mid', 'Gas')], names=['Site', 'Pro']),
+        ...     columns=pd.MultiIndex.from_tuples(
+        ...         [('Cap', 'Total'), ('Cap', 'New'), ('Costs', 'Inv')]))
+        >>> directory = tempfile.mkdtemp()
+        >>> streamed = os.path.join(directory, 'streamed.xlsx')
+        >>> with ExcelReportWriter(streamed) as writer:
+        ...     writer.write('Table', df)
+        >>> written = os.path.join(directory, 'to_excel.xlsx')
+        >>> excel_writer = pd.ExcelWriter(written, engine='xlsxwriter')
+        >>> df.to_excel(excel_writer, sheet_name='Table')
+        >>> excel_writer.close()
+        >>> def layout(filename):
+        ...     sheet = openpyxl.load_workbook(filename)['Table']
+        ...     return ([[cell.value for cell in row]
+        ...              for row in sheet.iter_rows()],
+        ...             sorted(str(cells) for cells in sheet.merged_cells))
+        >>> layout(streamed) == layout(written)
+        True
+        >>> shutil.rmtree(directory)
+
+    Sheet names are cut to 31 characters; cut names that collide with an
+    earlier sheet get a number appended. Sheets are ordered like the list of
+    tables upon close. As pandas' ExcelWriter cannot reorder sheets, tables
+    are only written upon close without xlsxwriter; that writer keeps the
+    whole spreadsheet in memory anyway.
+    """
+    def __init__(self, path):
+        super(ExcelReportWriter, self).__init__(path)
+        self.constant_memory = False
+        if os.path.splitext(path)[1].lower() == '.xlsx':
+            try:
+                import xlsxwriter
+                self.constant_memory = True
+            except ImportError:
+                pass
+        if self.constant_memory:
+            self.writer = pd.ExcelWriter(path, engine='xlsxwriter',
+                                         options={'constant_memory': True})
+        else:
+            self.writer = pd.ExcelWriter(path)
+        self.sheet_names = {}
+        self.pending = {}
+
+    def _write(self, name, df):
+        cleaned = _replace_chars(name, '[]:*?/\\')
+        sheet_name = cleaned[:31]
+        k = 1
+        while sheet_name in self.sheet_names.values():
+            suffix = '~{}'.format(k)
+            sheet_name = cleaned[:31 - len(suffix)] + suffix
+            k += 1
+        self.sheet_names[name] = sheet_name
+        if self.constant_memory:
+            cells, merged = _excel_rows(df)
+            self.writer.write_cells(cells, sheet_name)
+            # merged ranges across rows, cf. _excel_rows
+            self.writer.sheets[sheet_name].merge.extend(merged)
+        else:
+            self.pending[name] = df
+
+    def close(self):
+        names = [table[0] for table in self.tables]
+        if self.constant_memory:
+            order = dict((self.sheet_names[name], k)
+                         for k, name in enumerate(names))
+            self.writer.book.worksheets_objs.sort(
+                key=lambda worksheet: order[worksheet.name])
+        else:
+            for name in names:
+                self.pending.pop(name).to_excel(
+                    self.writer, sheet_name=self.sheet_names[name])
+        self.writer.close()
+
+
+def _excel_rows(df):
+    """Return the cells to_excel writes for DataFrame df, in row order.
+
+    constant_memory mode of xlsxwriter only allows writing in row order,
+    while to_excel writes column by column. The cells are those that pandas
+    formats for to_excel, with merged cells for MultiIndex labels. Merged
+    cells within a row are left to ExcelWriter.write_cells. A merged range
+    across rows is split into its cells instead, as merge_range would write
+    blanks to the following rows right away, and returned separately.
+
+    Args:
+        df: a DataFrame
+
+    Returns:
+        (cells, merged) tuple: list of ExcelCell objects for
+        ExcelWriter.write_cells, list of [first row, first column, last row,
+        last column] of merged ranges across rows
+    """
+    import copy
     try:
-        esto = esto.groupby(level=['t', 'sit', 'com']).sum()
-        esto = esto.xs(sit, level='sit')
-        stored = esto.xs(com, level='com')
-        stored = stored.loc[timesteps]
-        stored.columns = ['Level', 'Stored', 'Retrieved']
-    except (KeyError, ValueError):
-        stored = pd.DataFrame(0, index=timesteps,
-                              columns=['Level', 'Stored', 'Retrieved'])
+        from pandas.io.formats.excel import ExcelFormatter
+    except ImportError:  # pandas < 0.20
+        from pandas.core.format import ExcelFormatter
+
+    cells = []
+    merged = []
+    for cell in ExcelFormatter(df, merge_cells=True).get_formatted_cells():
+        if cell.mergestart is None or cell.mergestart == cell.row:
+            cells.append(cell)
+            continue
+        merged.append([cell.row, cell.col, cell.mergestart, cell.mergeend])
+        for row in range(cell.row, cell.mergestart + 1):
+            for col in range(cell.col, cell.mergeend + 1):
+                part = copy.copy(cell)
+                part.row, part.col = row, col
+                part.mergestart = part.mergeend = None
+                if (row, col) != (cell.row, cell.col):
+                    part.val = ''
+                cells.append(part)
+    cells.sort(key=lambda cell: (cell.row, cell.col))
+    return cells, merged
+
+
+class _DirectoryReportWriter(ReportWriter):
+    """Write tables to one file each in directory path, listed in the
+    file 'tables.csv' upon close."""
+    extension = None
+
+    def __init__(self, path):
+        super(_DirectoryReportWriter, self).__init__(path)
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def _filename(self, name):
+        return self._table_filename(self.path, name)
+
+    @classmethod
+    def _table_filename(cls, path, name):
+        # keep table names readable, but valid as filenames
+        name = _replace_chars(name, '\\/:*?"<>|')
+        return os.path.join(path, name + cls.extension)
+
+    def close(self):
+        pd.DataFrame(self.tables,
+                     columns=['Table', 'Index levels', 'Column levels']
+                     ).to_csv(os.path.join(self.path, 'tables.csv'),
+                              index=False)
+
+    @classmethod
+    def read(cls, path):
+        tables = pd.read_csv(os.path.join(path, 'tables.csv'))
+        for name, index_levels, column_levels in tables.itertuples(
+                index=False):
+            yield name, cls._read(cls._table_filename(path, name),
+                                  index_levels, column_levels)
+
+
+class CsvReportWriter(_DirectoryReportWriter):
+    """Write tables to CSV files in a directory."""
+    extension = '.csv'
+
+    def _write(self, name, df):
+        df.to_csv(self._filename(name))
+
+    @staticmethod
+    def _read(filename, index_levels, column_levels):
+        return pd.read_csv(filename, index_col=list(range(index_levels)),
+                           header=list(range(column_levels)))
+
+
+class ParquetReportWriter(_DirectoryReportWriter):
+    """Write tables to Parquet files in a directory.
+
+    Parquet only allows string column labels, so each column label is
+    stored as JSON (a list of labels for MultiIndex columns) and restored by
+    read. Unlike joining the labels by a separator or converting them to
+    strings, this works for labels that contain any character and keeps
+    non-string labels, e.g. integer timesteps.
+    """
+    extension = '.parquet'
+
+    def _write(self, name, df):
+        import json
+        df = df.copy()
+        if df.columns.nlevels > 1:
+            labels = [list(column) for column in df.columns.tolist()]
+        else:
+            labels = df.columns.tolist()
+        # NumPy scalars are not JSON serializable, their Python values are
+        df.columns = [json.dumps(label, default=lambda value: value.item())
+                      for label in labels]
+        df.to_parquet(self._filename(name))
+
+    @staticmethod
+    def _read(filename, index_levels, column_levels):
+        import json
+        df = pd.read_parquet(filename)
+        labels = [json.loads(column) for column in df.columns]
+        if column_levels > 1:
+            df.columns = pd.MultiIndex.from_tuples(
+                [tuple(label) for label in labels])
+        else:
+            df.columns = labels
+        return df
 
-    # show stock as created
-    created = created.join(stock)
 
-    # show demand as consumed
-    consumed = consumed.join(demand)
+class HdfReportWriter(ReportWriter):
+    """Write tables to groups of a HDF5 file, listed in group 'tables'."""
+    def __init__(self, path):
+        super(HdfReportWriter, self).__init__(path)
+        self.store = pd.HDFStore(path, mode='w')
+        self.groups = {}
 
-    return created, consumed, stored, imported, exported
+    def _write(self, name, df):
+        # group names need not be valid identifiers, but are numbered to
+        # avoid PyTables naming warnings
+        self.groups[name] = 'table{}'.format(len(self.groups))
+        self.store.put(self.groups[name], df)
+
+    def close(self):
+        self.store.put('tables', pd.DataFrame(
+            [table + (self.groups[table[0]],) for table in self.tables],
+            columns=['Table', 'Index levels', 'Column levels', 'Group']))
+        self.store.close()
 
+    @classmethod
+    def read(cls, path):
+        with pd.HDFStore(path, mode='r') as store:
+            tables = store['tables']
+            for name, group in zip(tables['Table'], tables['Group']):
+                yield name, store[group]
 
-def report(instance, filename, commodities=None, sites=None):
-    """Write result summary to a spreadsheet file
+
+def _replace_chars(name, chars):
+    """Replace each of the characters chars in name by an underscore."""
+    return ''.join('_' if char in chars else char for char in name)
+
+
+# report formats: name: ReportWriter subclass
+REPORT_WRITERS = {
+    'excel': ExcelReportWriter,
+    'csv': CsvReportWriter,
+    'parquet': ParquetReportWriter,
+    'hdf': HdfReportWriter}
+
+
+def report(instance, filename, commodities=None, sites=None, fmt='excel'):
+    """Write result summary to a spreadsheet file or other table format
+
+    Writes the tables 'Costs', 'Process caps', 'Transmission caps',
+    'Storage caps', 'Energy sums' and one '<commodity>.<site> timeseries'
+    table per commodity and site. Each timeseries table is written as soon
+    as it is computed, so that none of them is kept in memory; only their
+    sums are kept for 'Energy sums', which is written last, but listed
+    before them.
 
     Args:
         instance: a urbs model instance
-        filename: Excel spreadsheet filename, will be overwritten if exists
+        filename: Excel spreadsheet filename, will be overwritten if exists;
+            for other formats, the directory (csv, parquet) or HDF5 file
+            (hdf) to write
         commodities: optional list of commodities for which to write timeseries
         sites: optional list of sites for which to write timeseries
+        fmt: a key of REPORT_WRITERS (default: 'excel') or a ReportWriter
+            subclass
 
     Returns:
         Nothing
     """
+    writer_class = REPORT_WRITERS.get(fmt, fmt)
+    commodities = commodities or []
+    sites = sites or []
+
     # get the data
     costs, cpro, ctra, csto = get_constants(instance)
+    balance = get_balance(instance)
 
-    # create spreadsheet writer object
-    with pd.ExcelWriter(filename) as writer:
+    with writer_class(filename) as writer:
 
-        # write constants to spreadsheet
-        costs.to_excel(writer, 'Costs')
-        cpro.to_excel(writer, 'Process caps')
-        ctra.to_excel(writer, 'Transmission caps')
-        csto.to_excel(writer, 'Storage caps')
+        # write constants
+        writer.write('Costs', costs)
+        writer.write('Process caps', cpro)
+        writer.write('Transmission caps', ctra)
+        writer.write('Storage caps', csto)
 
-        # initialize timeseries tableaus
+        # write timeseries to individual tables, one at a time; only their
+        # sums are kept
+        position = len(writer.tables)
         energies = []
-        timeseries = {}
-
-        # collect timeseries data
         for co in commodities:
             for sit in sites:
-                created, consumed, stored, imported, exported = get_timeseries(
-                    instance, co, sit)
-
-                overprod = pd.DataFrame(
-                    columns=['Overproduction'],
-                    data=created.sum(axis=1) - consumed.sum(axis=1) +
-                    imported.sum(axis=1) - exported.sum(axis=1) +
-                    stored['Retrieved'] - stored['Stored'])
-
-                tableau = pd.concat(
-                    [created, consumed, stored, imported, exported, overprod],
-                    axis=1,
-                    keys=['Created', 'Consumed', 'Storage',
-                          'Import from', 'Export to', 'Balance'])
-                timeseries[(co, sit)] = tableau.copy()
-
-                # timeseries sums
-                sums = pd.concat([created.sum(),
-                                  consumed.sum(),
-                                  stored.sum().drop('Level'),
-                                  imported.sum(),
-                                  exported.sum(),
-                                  overprod.sum()], axis=0,
-                                 keys=['Created', 'Consumed', 'Storage',
-                                 'Import', 'Export', 'Balance'])
+                tableau, sums = _report_tableau(instance, co, sit, balance)
+                writer.write("{}.{} timeseries".format(co, sit), tableau)
                 energies.append(sums.to_frame("{}.{}".format(co, sit)))
 
-        # write timeseries data (if any)
-        if timeseries:
-            # concatenate energy sums
+        # write timeseries sums (if any), listed before the timeseries
+        if energies:
             energy = pd.concat(energies, axis=1).fillna(0)
-            energy.to_excel(writer, 'Energy sums')
-    
-            # write timeseries to individual sheets
-            for co in commodities:
-                for sit in sites:
-                    # sheet names cannot be longer than 31 characters...
-                    sheet_name = "{}.{} timeseries".format(co, sit)[:31]
-                    timeseries[(co, sit)].to_excel(writer, sheet_name)
+            writer.write('Energy sums', energy, position=position)
+
+
+def _report_tableau(instance, co, sit, balance):
+    """Return timeseries tableau and its sums for report."""
+    created, consumed, stored, imported, exported = get_timeseries(
+        instance, co, sit, balance=balance)
+
+    overprod = pd.DataFrame(
+        columns=['Overproduction'],
+        data=created.sum(axis=1) - consumed.sum(axis=1) +
+        imported.sum(axis=1) - exported.sum(axis=1) +
+        stored['Retrieved'] - stored['Stored'])
+
+    tableau = pd.concat(
+        [created, consumed, stored, imported, exported, overprod],
+        axis=1,
+        keys=['Created', 'Consumed', 'Storage',
+              'Import from', 'Export to', 'Balance'])
+
+    # timeseries sums
+    sums = pd.concat([created.sum(),
+                      consumed.sum(),
+                      stored.sum().drop('Level'),
+                      imported.sum(),
+                      exported.sum(),
+                      overprod.sum()], axis=0,
+                     keys=['Created', 'Consumed', 'Storage',
+                     'Import', 'Export', 'Balance'])
+    return tableau, sums
+
+
+def export_report(path, filename, fmt):
+    """Export tables written by report in another format to Excel.
+
+    Args:
+        path: report directory or file, as passed to report
+        filename: Excel spreadsheet filename, will be overwritten if exists
+        fmt: format of the report, a key of REPORT_WRITERS or a
+            ReportWriter subclass with a class method read
 
+    Returns:
+        Nothing
+
+    Raises:
+        ValueError: if reports of format fmt cannot be read
+    """
+    writer_class = REPORT_WRITERS.get(fmt, fmt)
+    if not hasattr(writer_class, 'read'):
+        raise ValueError("Reports of format {} cannot be read.".format(fmt))
+    with ExcelReportWriter(filename) as writer:
+        for name, df in writer_class.read(path):
+            writer.write(name, df)
 
-def plot(prob, com, sit, timesteps=None, power_unit='MW', energy_unit='MWh'):
+
+def plot(prob, com, sit, timesteps=None, power_unit='MW', energy_unit='MWh',
+         balance=None, constants=None):
     """Plot a stacked timeseries of commodity balance and storage.
 
     Creates a stackplot of the energy balance of a given commodity, together
@@ -1608,6 +4456,9 @@ def plot(prob, com, sit, timesteps=None, power_unit='MW', energy_unit='MWh'):
         timesteps: optional list of  timesteps to plot; default: prob.tm
         power_unit: optional string for unit; default: 'MW'
         energy_unit: optional string for storage plot; default: 'MWh'
+        balance: optional result of get_balance, cf. get_timeseries
+        constants: optional result of get_constants, to save its computation
+            when plotting several commodities or sites
 
     Returns:
         fig: figure handle
@@ -1624,9 +4475,11 @@ def plot(prob, com, sit, timesteps=None, power_unit='MW', energy_unit='MWh'):
     gs = mpl.gridspec.GridSpec(2, 1, height_ratios=[2, 1])
 
     created, consumed, stored, imported, exported = get_timeseries(
-        prob, com, sit, timesteps)
+        prob, com, sit, timesteps, balance)
 
-    costs, cpro, ctra, csto = get_constants(prob)
+    if constants is None:
+        constants = get_constants(prob)
+    costs, cpro, ctra, csto = constants
 
     # move retrieved/stored storage timeseries to created/consumed and
     # rename storage columns back to 'storage' for color mapping
@@ -1766,8 +4619,15 @@ def plot(prob, com, sit, timesteps=None, power_unit='MW', energy_unit='MWh'):
     return fig
 
 
-def result_figures(prob, figure_basename, plot_title_prefix=None, periods={}, **kwds):
+def result_figures(prob, figure_basename, plot_title_prefix=None, periods={},
+                   processes=None, **kwds):
     """Create plot for each site and demand commodity and save to files.
+
+    The figures are rendered by a pool of worker processes on matplotlib's
+    non-interactive Agg backend. The plotted data is retrieved from prob
+    once and shared with the workers, which thus never need the model
+    instance itself. If called from a worker process of a pool already (e.g.
+    in runme.run_scenarios_parallel), figures are rendered one by one.
     
     Args:
         prob: urbs model instance
@@ -1775,33 +4635,79 @@ def result_figures(prob, figure_basename, plot_title_prefix=None, periods={}, **
         plot_title_prefix: (optional) plot title identifier
         periods: (optional) dict of 'period name': timesteps_list items
                  if omitted, one period 'all' with all timesteps is assumed
+        processes: (optional) number of worker processes, default: number of
+                   CPUs; 1 renders all figures in the calling process
         **kwds: (optional) keyword arguments are forwarded to urbs.plot()
     """
+    import multiprocessing
+
     # default to all timesteps if no
     if not periods:
         periods = {'all': sorted(get_entity(prob, 'tm').index)}
-            
-    # create timeseries plot for each demand (site, commodity) timeseries
-    for sit, com in prob.demand.columns:
-        for period, timesteps in periods.items():
-            # do the plotting
-            fig = plot(prob, com, sit, timesteps=timesteps, **kwds)
-
-            # change the figure title
-            ax0 = fig.get_axes()[0]
-            # if no custom title prefix is specified, use the figure 
-            if not plot_title_prefix:
-                plot_title_prefix = os.path.basename(figure_basename)
-            new_figure_title = ax0.get_title().replace(
-                'Energy balance of ', '{}: '.format(plot_title_prefix))
-            ax0.set_title(new_figure_title)
-            
-            # save plot to files
-            for ext in ['png', 'pdf']:
-                fig_filename = '{}-{}-{}-{}.{}'.format(
-                                    figure_basename, com, sit, period, ext)
-                fig.savefig(fig_filename, bbox_inches='tight')
-            plt.close(fig)
+
+    # if no custom title prefix is specified, use the figure basename
+    if not plot_title_prefix:
+        plot_title_prefix = os.path.basename(figure_basename)
+
+    # energy balance and constants of all plots at once; COLORS is passed
+    # on, as workers started by spawning a new interpreter (e.g. on Windows)
+    # do not see changes made to it in this process
+    figure_data = (get_balance(prob), get_constants(prob),
+                   figure_basename, plot_title_prefix, kwds, dict(COLORS))
+
+    # one timeseries plot for each demand (site, commodity) timeseries
+    figures = [(com, sit, period, timesteps)
+               for sit, com in prob.demand.columns
+               for period, timesteps in sorted(periods.items())]
+
+    # daemonic pool workers cannot start a pool of their own
+    if processes == 1 or multiprocessing.current_process().daemon:
+        for figure in figures:
+            _result_figure(figure, figure_data)
+    else:
+        pool = multiprocessing.Pool(processes, _init_result_figures,
+                                    (figure_data,))
+        try:
+            pool.map(_result_figure, figures)
+        finally:
+            pool.close()
+            pool.join()
+
+
+# data shared by all figures of result_figures in a worker process
+_RESULT_FIGURE_DATA = None
+
+
+def _init_result_figures(figure_data):
+    """Initialize a worker process of result_figures."""
+    global _RESULT_FIGURE_DATA
+    _RESULT_FIGURE_DATA = figure_data
+    COLORS.update(figure_data[-1])
+    plt.switch_backend('Agg')
+
+
+def _result_figure(figure, figure_data=None):
+    """Plot one figure of result_figures and save it to files."""
+    com, sit, period, timesteps = figure
+    balance, constants, figure_basename, plot_title_prefix, kwds, colors = (
+        figure_data or _RESULT_FIGURE_DATA)
+
+    # do the plotting
+    fig = plot(ResultSet({}), com, sit, timesteps=timesteps, balance=balance,
+               constants=constants, **kwds)
+
+    # change the figure title
+    ax0 = fig.get_axes()[0]
+    new_figure_title = ax0.get_title().replace(
+        'Energy balance of ', '{}: '.format(plot_title_prefix))
+    ax0.set_title(new_figure_title)
+
+    # save plot to files
+    for ext in ['png', 'pdf']:
+        fig_filename = '{}-{}-{}-{}.{}'.format(
+                            figure_basename, com, sit, period, ext)
+        fig.savefig(fig_filename, bbox_inches='tight')
+    plt.close(fig)
 
 
 def to_color(obj=None):
@@ -1828,22 +4734,25 @@ def to_color(obj=None):
     
 
 def save(prob, filename):
-    """Save urbs model instance to a gzip'ed pickle file.
-    
-    Pickle is the standard Python way of serializing and de-serializing Python
-    objects. By using it, saving any object, in case of this function a 
-    Pyomo ConcreteModel, becomes a twoliner. 
-    <https://docs.python.org/2/library/pickle.html>
-    GZip is a standard Python compression library that is used to transparently
-    compress the pickle file further.
-    <https://docs.python.org/2/library/gzip.html>
-    It is used over the possibly more compact bzip2 compression due to the
-    lower runtime. Source: <http://stackoverflow.com/a/18475192/2375855>
-    
+    """Save input and results of a urbs model instance to a result archive.
+
+    Pickling the whole Pyomo model (equations included) takes long and
+    yields large files. Instead, the archive only holds what result analysis
+    needs: the input DataFrames and the values of all variables, plus the
+    duals of all constraints if prob was solved with the import suffixes
+    'dual' and 'rc' (cf. get_dual). The archive is a directory with a
+    gzip'ed pickle of the input and index labels, and one NumPy array file
+    for the values and for each index level of every entity, so that load
+    can read each entity on first access by memory mapping.
+
+    Archives replace the gzip'ed pickle files of the whole model instance
+    ('.pgz') written by earlier versions; load still reads those.
+
     Args:
-        prob: a urbs model instance
-        filename: pickle file to be written
-        
+        prob: a urbs model instance with loaded results, or a ResultSet
+        filename: name of the archive directory; existing files in it are
+            overwritten
+
     Returns:
         Nothing
     """
@@ -1852,27 +4761,172 @@ def save(prob, filename):
         import cPickle as pickle
     except ImportError:
         import pickle
-    with gzip.GzipFile(filename, 'wb') as file_handle:
-        pickle.dump(prob, file_handle, pickle.HIGHEST_PROTOCOL)
+
+    if not os.path.exists(filename):
+        os.makedirs(filename)
+
+    # entities and duals
+    if isinstance(prob, ResultSet):
+        entities = dict((name, prob.entities[name]) for name in prob.entities)
+        duals = dict((name, prob.duals[name]) for name in prob.duals)
+    else:
+        names = list(list_entities(prob, 'var').index) + ['tm']
+        if getattr(prob, 'compact', False):
+            names += ['e_pro_in', 'e_pro_out']
+        entities = dict((name, get_entity(prob, name)) for name in names)
+        duals = {}
+        if hasattr(prob, 'dual'):
+            for name in list_entities(prob, 'con').index:
+                duals[name] = get_dual(prob, name)
+        if hasattr(prob, 'rc'):
+            for name in BOUND_CONSTRAINTS:
+                duals[name] = get_dual(prob, name)
+
+    # input and attributes needed for reporting
+    attributes = {}
+    for key in ['commodity', 'process', 'process_commodity', 'transmission',
+                'storage', 'demand', 'supim', 'buy_sell_price', 'hacks',
+                'prune', 'undirected', 'compact', 'timesteps', 'created']:
+        if hasattr(prob, key):
+            attributes[key] = getattr(prob, key)
+    for key in ['com_demand', 'sit']:
+        attributes[key] = list(getattr(prob, key))
+
+    meta = {
+        'attributes': attributes,
+        'entities': dict((name, _save_archive_frame(filename, 'entity', name,
+                                                    frame))
+                         for name, frame in entities.items()),
+        'duals': dict((name, _save_archive_frame(filename, 'dual', name,
+                                                 frame))
+                      for name, frame in duals.items())}
+    with gzip.GzipFile(os.path.join(filename, 'meta.pgz'), 'wb') as file_handle:
+        pickle.dump(meta, file_handle, pickle.HIGHEST_PROTOCOL)
 
 
 def load(filename):
-    """Load a urbs model instance from a gzip'ed pickle file
-    
+    """Load input and results from a result archive written by save.
+
+    For compatibility, filename may also be a gzip'ed pickle file of a whole
+    model instance, as written by earlier versions of save. Then the model
+    instance is returned.
+
     Args:
-        filename: pickle file
-    
+        filename: name of the archive directory, or of a legacy '.pgz' file
+
     Returns:
-        prob: the unpickled urbs model instance
+        prob: a ResultSet, which get_entity, get_dual, get_constants,
+        get_timeseries, report and plot accept in place of a model instance
+
+    Raises:
+        IOError: if filename is neither a result archive nor a file
     """
     import gzip
     try:
         import cPickle as pickle
     except ImportError:
         import pickle
-    with gzip.GzipFile(filename, 'r') as file_handle:
-        prob = pickle.load(file_handle)
-    return prob
+
+    # legacy format: gzip'ed pickle of the model instance
+    if os.path.isfile(filename):
+        with gzip.GzipFile(filename, 'r') as file_handle:
+            return pickle.load(file_handle)
+
+    meta_file = os.path.join(filename, 'meta.pgz')
+    if not os.path.isfile(meta_file):
+        raise IOError("'{}' is no result archive written by save.".format(
+            filename))
+    with gzip.GzipFile(meta_file, 'r') as file_handle:
+        meta = pickle.load(file_handle)
+    return ResultSet(ResultArchive(filename, 'entity', meta['entities']),
+                     duals=ResultArchive(filename, 'dual', meta['duals']),
+                     **meta['attributes'])
+
+
+class ResultArchive(Mapping):
+    """Entities of a result archive, read on first access.
+
+    Maps entity names to DataFrames like returned by get_entity. The arrays
+    of an entity are memory mapped, so only accessed entities are read. The
+    values of a DataFrame stay memory mapped (copy-on-write), i.e. are only
+    read from disk where used. The index is built from the integer codes of
+    each level, which are read into memory; only single-level indexes are
+    built from their labels.
+
+    Args:
+        dirname: name of the archive directory (cf. save)
+        prefix: 'entity' or 'dual'
+        specs: dict of entity name: index specification, as returned by
+            _save_archive_frame
+    """
+    def __init__(self, dirname, prefix, specs):
+        self.dirname = dirname
+        self.prefix = prefix
+        self.specs = specs
+        self._data = {}
+
+    def __getitem__(self, name):
+        if name not in self._data:
+            self._data[name] = _load_archive_frame(
+                self.dirname, self.prefix, name, self.specs[name])
+        return self._data[name]
+
+    def __iter__(self):
+        return iter(sorted(self.specs))
+
+    def __len__(self):
+        return len(self.specs)
+
+
+def _archive_filename(dirname, prefix, name, part):
+    """Return filename of an array of an entity in a result archive."""
+    return os.path.join(dirname, '{}-{}-{}.npy'.format(prefix, name, part))
+
+
+def _save_archive_frame(dirname, prefix, name, frame):
+    """Write entity DataFrame to array files, return its index specification.
+
+    Each index level is stored as integer codes to a sorted list of unique
+    labels, which become part of the specification; the values as float
+    array.
+    """
+    if frame.empty:
+        return None
+    spec = {'column': frame.columns[0],
+            'names': list(frame.index.names),
+            'levels': []}
+    for k in range(frame.index.nlevels):
+        codes, uniques = pd.factorize(frame.index.get_level_values(k),
+                                      sort=True)
+        np.save(_archive_filename(dirname, prefix, name, 'index{}'.format(k)),
+                codes.astype(np.int32))
+        spec['levels'].append(np.asarray(uniques))
+    np.save(_archive_filename(dirname, prefix, name, 'values'),
+            frame[spec['column']].values.astype(float))
+    return spec
+
+
+def _load_archive_frame(dirname, prefix, name, spec):
+    """Read entity DataFrame written by _save_archive_frame.
+
+    The values are not copied, but stay memory mapped; copy-on-write, so
+    that changing the DataFrame does not change the archive.
+    """
+    if spec is None:
+        return pd.DataFrame()
+    codes = [np.load(_archive_filename(dirname, prefix, name,
+                                       'index{}'.format(k)), mmap_mode='r')
+             for k in range(len(spec['levels']))]
+    if len(codes) > 1:
+        # MultiIndex directly from codes, without an array of labels per level
+        index = pd.MultiIndex(levels=spec['levels'], labels=codes,
+                              names=spec['names'], verify_integrity=False)
+    else:
+        index = pd.Index(spec['levels'][0][codes[0]], name=spec['names'][0])
+    values = np.load(_archive_filename(dirname, prefix, name, 'values'),
+                     mmap_mode='c')
+    return pd.DataFrame(values.reshape(-1, 1), index=index,
+                        columns=[spec['column']], copy=False)
 
 
 if __name__ == "__main__":